@@ -1,8 +1,12 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 
 from database.models import db
 from config import Config
@@ -12,6 +16,13 @@ from keyboards.keyboards import (
 )
 from localization.texts import get_text
 from ai.recommendations import ai_engine
+from utils import catalog_io, order_lifecycle
+from utils.eta import eta_model
+from utils.events import FUNNEL_STEPS
+from utils.metrics import metrics
+from utils.promotions import Rule, parse_promotion, promotion_engine
+from utils.sales import sales_report
+from utils.scheduler import scheduler
 
 router = Router()
 
@@ -26,6 +37,14 @@ class AdminStates(StatesGroup):
     waiting_for_product_description_ru = State()
     waiting_for_product_price = State()
     waiting_for_product_category = State()
+    waiting_for_catalog_file = State()
+
+PROMO_USAGE = (
+    "Использование: /promo add <КОД|auto> <10%|5000|2+1> [p<id товара>|c<id категории>] "
+    "[min=<сумма>] [uses=<кол-во>] [once] [until=<ГГГГ-ММ-ДД>], /promo on|off <id>"
+)
+
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
 
 def is_admin(user_id: int) -> bool:
     """Check if user is admin"""
@@ -44,6 +63,238 @@ async def admin_panel(message: Message):
         parse_mode='Markdown'
     )
 
+@router.message(Command("perf"))
+async def show_perf(message: Message):
+    """Show hot-path latency percentiles"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    sections = [
+        ("⚙️ Обработчики (мс)", 'handler'),
+        ("🗄 SQL запросы (мс)", 'db'),
+        ("📨 Telegram API (мс)", 'telegram'),
+        ("🤖 OpenAI (мс)", 'openai'),
+        ("🚚 Диспетчер (мс)", 'dispatch'),
+        ("💳 Платежи (мс)", 'payment'),
+        ("🗓 Фоновые задачи (мс)", 'job'),
+        ("📄 Строк на запрос", 'db_rows'),
+    ]
+    
+    perf_text = "📈 Производительность (p50 / p95 / p99)\n"
+    for title, kind in sections:
+        perf_text += f"\n{title}:\n{metrics.format_report(kind)}\n"
+    perf_text += f"\n⏱ ETA модель (мин):\n{eta_model.describe()}\n"
+    perf_text += "\n🗓 Расписание:\n" + '\n'.join(scheduler.describe()) + "\n"
+    
+    # Telegram messages are limited to 4096 characters
+    await message.answer(perf_text[:4000])
+
+@router.message(Command("funnel"))
+async def show_funnel(message: Message, command: CommandObject):
+    """Show a day's funnel and retention of users registered that day: /funnel [YYYY-MM-DD]"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    # Events and registrations are stored in UTC
+    day = (command.args or datetime.utcnow().strftime('%Y-%m-%d')).strip()
+    try:
+        start = datetime.strptime(day, '%Y-%m-%d')
+    except ValueError:
+        await message.answer("Использование: /funnel [ГГГГ-ММ-ДД]")
+        return
+    
+    end = start + timedelta(days=1)
+    counts = await db.get_funnel(FUNNEL_STEPS, f"{start:%Y-%m-%d}", f"{end:%Y-%m-%d}")
+    titles = ["Каталог", "Товар", "В корзину", "Оплата"]
+    
+    funnel_text = f"🔻 Воронка за {day} (UTC)\n\n"
+    previous = None
+    for title, count in zip(titles, counts):
+        share = f" ({count * 100 // previous}%)" if previous else ""
+        funnel_text += f"• {title}: {count}{share}\n"
+        previous = count
+    
+    size, active = await db.get_retention(day)
+    funnel_text += f"\n👥 Зарегистрировались {day}: {size}\n"
+    if size:
+        funnel_text += "Активны по дням:\n"
+        for offset, users in enumerate(active):
+            funnel_text += f"• День {offset}: {users} ({users * 100 // size}%)\n"
+    
+    await message.answer(funnel_text)
+
+@router.message(Command("courier_add"))
+async def add_courier(message: Message, command: CommandObject):
+    """Grant courier role: /courier_add <telegram_id>"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    if not command.args or not command.args.strip().isdigit():
+        await message.answer("Использование: /courier_add <telegram_id>")
+        return
+    
+    telegram_id = int(command.args.strip())
+    if await db.set_user_role(telegram_id, 'courier'):
+        await message.answer(f"✅ Пользователь {telegram_id} назначен курьером")
+    else:
+        await message.answer(f"❌ Пользователь {telegram_id} не найден")
+
+@router.message(Command("stock"))
+async def manage_stock(message: Message, command: CommandObject):
+    """Show low stock or set it: /stock [<product_id> <quantity>|off]"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    args = (command.args or '').split()
+    if not args:
+        products = await db.get_low_stock(Config.LOW_STOCK_THRESHOLD)
+        if not products:
+            await message.answer(f"✅ Нет товаров с остатком ≤ {Config.LOW_STOCK_THRESHOLD}")
+            return
+        # Plain text: product names may contain Markdown characters
+        text = "📦 Низкий остаток:\n\n"
+        for product in products:
+            mark = "" if product['is_available'] else " (нет в продаже)"
+            text += f"#{product['id']} {product['name_ru']}: {product['stock']} шт.{mark}\n"
+        await message.answer(text)
+        return
+    
+    if len(args) != 2 or not args[0].isdigit() or not (args[1].isdigit() or args[1] == 'off'):
+        await message.answer("Использование: /stock <id товара> <количество|off>")
+        return
+    
+    product_id = int(args[0])
+    stock = None if args[1] == 'off' else int(args[1])
+    if not await db.set_stock(product_id, stock):
+        await message.answer(f"❌ Товар {product_id} не найден")
+    elif stock is None:
+        await message.answer(f"✅ Остаток товара {product_id} больше не отслеживается")
+    else:
+        await message.answer(f"✅ Остаток товара {product_id}: {stock} шт.")
+
+@router.message(Command("promo"))
+async def manage_promotions(message: Message, command: CommandObject):
+    """List promotions or change them: /promo [add ...|on <id>|off <id>]"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    args = (command.args or '').split()
+    if not args:
+        promotions = await db.get_promotions()
+        if not promotions:
+            await message.answer("Акций пока нет. " + PROMO_USAGE)
+            return
+        text = "🎟 Акции:\n\n"
+        for promotion in promotions[:30]:
+            mark = "✅" if promotion['is_active'] else "⏸"
+            limit = f"/{promotion['max_uses']}" if promotion['max_uses'] else ""
+            text += (f"{mark} #{promotion['id']} {Rule(promotion).describe()}, "
+                     f"использовано {promotion['used_count']}{limit}\n")
+        await message.answer(text)
+        return
+    
+    if args[0] in ('on', 'off') and len(args) == 2 and args[1].isdigit():
+        if await db.set_promotion_active(int(args[1]), args[0] == 'on'):
+            promotion_engine.invalidate()
+            await message.answer(f"✅ Акция #{args[1]} {'включена' if args[0] == 'on' else 'выключена'}")
+        else:
+            await message.answer(f"❌ Акция #{args[1]} не найдена")
+        return
+    
+    if args[0] != 'add':
+        await message.answer(PROMO_USAGE)
+        return
+    try:
+        promotion = parse_promotion(args[1:])
+    except ValueError as e:
+        await message.answer(f"❌ {e}\n{PROMO_USAGE}")
+        return
+    
+    promotion_id = await db.add_promotion(**promotion)
+    if promotion_id is None:
+        await message.answer(f"❌ Промокод {promotion['code']} уже существует")
+        return
+    promotion_engine.invalidate()
+    await message.answer(f"✅ Акция #{promotion_id} создана")
+
+@router.message(Command("import"))
+async def start_catalog_import(message: Message, state: FSMContext):
+    """Ask for a catalog file: /import"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    formats = ', '.join(fmt.upper() for fmt in catalog_io.supported_formats())
+    await state.set_state(AdminStates.waiting_for_catalog_file)
+    await message.answer(
+        f"📥 Отправьте файл каталога ({formats})\n\n"
+        f"Столбцы: {', '.join(catalog_io.COLUMNS)}\n"
+        f"Обязательные: {', '.join(catalog_io.REQUIRED_COLUMNS)}\n\n"
+        "Товары с существующим SKU обновляются, остальные добавляются. "
+        "Проще всего начать с файла из /export."
+    )
+
+@router.message(AdminStates.waiting_for_catalog_file, F.document)
+async def catalog_file_received(message: Message, state: FSMContext):
+    """Validate and apply an uploaded catalog file"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    extension = (message.document.file_name or '').rsplit('.', 1)[-1].lower()
+    if extension not in catalog_io.supported_formats():
+        formats = ', '.join(catalog_io.supported_formats())
+        await message.answer(f"❌ Поддерживаются файлы: {formats}")
+        return
+    await state.clear()
+    
+    handle, path = tempfile.mkstemp(prefix='arzon-import-', suffix=f'.{extension}')
+    os.close(handle)
+    try:
+        try:
+            await message.bot.download(message.document, destination=path)
+        except Exception as e:
+            await message.answer(f"❌ Не удалось скачать файл, отправьте его ещё раз: {e}")
+            return
+        created, updated = await catalog_io.import_catalog(path)
+    except catalog_io.CatalogImportError as e:
+        text = "❌ Файл не загружен, исправьте ошибки:\n\n" + '\n'.join(e.errors)
+        if e.total > len(e.errors):
+            text += f"\n… и ещё {e.total - len(e.errors)}"
+        await message.answer(text[:4000])
+        return
+    except Exception as e:
+        # The import runs in one transaction: nothing was changed
+        await message.answer(f"❌ Ошибка загрузки каталога, изменения отменены: {e}")
+        return
+    finally:
+        os.remove(path)
+    
+    await message.answer(f"✅ Каталог загружен: добавлено {created}, обновлено {updated}")
+
+@router.message(Command("export"))
+async def send_catalog_export(message: Message, command: CommandObject):
+    """Send the catalog as a file: /export [csv|xlsx]"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    fmt = (command.args or 'csv').strip().lower()
+    if fmt not in catalog_io.supported_formats():
+        await message.answer(f"Использование: /export [{'|'.join(catalog_io.supported_formats())}]")
+        return
+    
+    path = await catalog_io.export_catalog(fmt)
+    try:
+        filename = f"catalog-{datetime.now():%Y%m%d-%H%M}.{fmt}"
+        await message.answer_document(FSInputFile(path, filename=filename), caption="📤 Каталог")
+    finally:
+        os.remove(path)
+
 @router.callback_query(F.data == "admin_stats")
 async def show_stats(callback: CallbackQuery):
     """Show bot statistics"""
@@ -51,43 +302,24 @@ async def show_stats(callback: CallbackQuery):
         await callback.answer("❌ Нет доступа")
         return
     
-    async with db.get_connection() as conn:
-        # Get user statistics
-        cursor = await conn.execute('SELECT COUNT(*) FROM users')
-        total_users = (await cursor.fetchone())[0]
-        
-        cursor = await conn.execute('SELECT COUNT(*) FROM users WHERE created_at >= date("now", "-7 days")')
-        new_users_week = (await cursor.fetchone())[0]
-        
-        # Get order statistics
-        cursor = await conn.execute('SELECT COUNT(*) FROM orders')
-        total_orders = (await cursor.fetchone())[0]
-        
-        cursor = await conn.execute('SELECT COUNT(*) FROM orders WHERE created_at >= date("now", "-7 days")')
-        orders_week = (await cursor.fetchone())[0]
-        
-        cursor = await conn.execute('SELECT SUM(total_amount) FROM orders WHERE payment_status = "completed"')
-        total_revenue = (await cursor.fetchone())[0] or 0
-        
-        # Get product statistics
-        cursor = await conn.execute('SELECT COUNT(*) FROM products WHERE is_available = 1')
-        active_products = (await cursor.fetchone())[0]
+    # Served from the analytics snapshot, so it may lag a few minutes
+    stats = await db.get_bot_stats()
     
     stats_text = f"""📊 **Статистика бота**
 
 👥 **Пользователи:**
-• Всего: {total_users}
-• Новых за неделю: {new_users_week}
+• Всего: {stats['total_users']}
+• Новых за неделю: {stats['new_users_week']}
 
 📋 **Заказы:**
-• Всего: {total_orders}
-• За неделю: {orders_week}
+• Всего: {stats['total_orders']}
+• За неделю: {stats['orders_week']}
 
 💰 **Доходы:**
-• Общий доход: {total_revenue:,} сум
+• Общий доход: {stats['total_revenue']:,} сум
 
 📦 **Товары:**
-• Активных товаров: {active_products}
+• Активных товаров: {stats['active_products']}
 """
     
     await callback.message.edit_text(
@@ -103,17 +335,7 @@ async def manage_orders(callback: CallbackQuery):
         await callback.answer("❌ Нет доступа")
         return
     
-    async with db.get_connection() as conn:
-        cursor = await conn.execute('''
-            SELECT o.id, o.user_id, o.total_amount, o.order_status, o.created_at,
-                   u.first_name, u.phone
-            FROM orders o
-            JOIN users u ON o.user_id = u.telegram_id
-            WHERE o.order_status IN ('new', 'confirmed', 'preparing')
-            ORDER BY o.created_at DESC
-            LIMIT 10
-        ''')
-        orders = await cursor.fetchall()
+    orders = await db.get_active_orders(10)
     
     if not orders:
         await callback.message.edit_text(
@@ -124,11 +346,11 @@ async def manage_orders(callback: CallbackQuery):
     
     orders_text = "📋 **Активные заказы:**\n\n"
     for order in orders:
-        orders_text += f"🆔 Заказ #{order[0]}\n"
-        orders_text += f"👤 {order[5]} ({order[6]})\n"
-        orders_text += f"💰 {order[2]:,} сум\n"
-        orders_text += f"📊 Статус: {order[3]}\n"
-        orders_text += f"📅 {order[4]}\n\n"
+        orders_text += f"🆔 Заказ #{order.id}\n"
+        orders_text += f"👤 {order.first_name} ({order.phone})\n"
+        orders_text += f"💰 {order.total_amount:,} сум\n"
+        orders_text += f"📊 Статус: {order.order_status}\n"
+        orders_text += f"📅 {order.created_at}\n\n"
     
     await callback.message.edit_text(
         orders_text,
@@ -136,6 +358,60 @@ async def manage_orders(callback: CallbackQuery):
         parse_mode='Markdown'
     )
 
+# callback -> (from status, to status) applied to all matching orders at once
+BULK_TRANSITIONS = {
+    'bulk_confirm': ('new', 'confirmed'),
+    'bulk_prepare': ('confirmed', 'preparing'),
+    'bulk_ready': ('preparing', 'ready'),
+}
+
+@router.callback_query(F.data.in_(BULK_TRANSITIONS))
+async def bulk_transition(callback: CallbackQuery):
+    """Move all orders of one status to the next"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
+    
+    from_status, to_status = BULK_TRANSITIONS[callback.data]
+    changed = await order_lifecycle.transition(
+        None, to_status, actor_id=callback.from_user.id, from_status=from_status
+    )
+    await callback.answer(f"✅ Обновлено заказов: {len(changed)}", show_alert=True)
+
+@router.message(Command("status"))
+async def set_order_status(message: Message, command: CommandObject):
+    """Change order status: /status <order_id> <status>"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    args = (command.args or '').split()
+    if len(args) != 2 or not args[0].isdigit() or args[1] not in order_lifecycle.ORDER_STATUSES:
+        await message.answer(
+            "Использование: /status <id заказа> <статус>\n"
+            f"Статусы: {', '.join(order_lifecycle.ORDER_STATUSES)}"
+        )
+        return
+    
+    order_id, status = int(args[0]), args[1]
+    order = await db.get_order(order_id)
+    if not order:
+        await message.answer(f"❌ Заказ #{order_id} не найден")
+        return
+    
+    if not await order_lifecycle.transition([order_id], status, actor_id=message.from_user.id):
+        await message.answer(
+            f"❌ Нельзя перевести заказ #{order_id} из «{order['order_status']}» в «{status}»"
+        )
+        return
+    
+    history = await db.get_order_events(order_id)
+    history_text = '\n'.join(
+        f"{event['created_at']}: {event['from_status'] or '—'} → {event['to_status']}"
+        for event in history
+    )
+    await message.answer(f"✅ Заказ #{order_id}: {status}\n\n📜 История:\n{history_text}")
+
 @router.callback_query(F.data == "admin_products")
 async def manage_products(callback: CallbackQuery):
     """Manage products"""
@@ -144,7 +420,8 @@ async def manage_products(callback: CallbackQuery):
         return
     
     await callback.message.edit_text(
-        "📦 **Управление товарами**\n\nВыберите действие:",
+        "📦 **Управление товарами**\n\nВыберите действие:\n\n"
+        "📥 Загрузить каталог файлом: /import\n📤 Выгрузить каталог: /export",
         reply_markup=get_products_management_keyboard(),
         parse_mode='Markdown'
     )
@@ -162,6 +439,60 @@ async def manage_categories(callback: CallbackQuery):
         parse_mode='Markdown'
     )
 
+def format_sales_report(report: dict) -> str:
+    """Admin text of a ``utils.sales.sales_report``"""
+    text = f"📈 Продажи {report['from']} — {report['to']}\n\n"
+    text += f"💰 Выручка: {report['revenue']:,} сум, {report['units']} шт.\n"
+    text += f"📊 Тренд: {report['revenue_trend_per_day']:+,} сум в день\n"
+    if report['moving_average']:
+        text += f"• Среднее за 7 дней: {report['moving_average'][-1]:,} сум\n"
+    
+    if report['top_products']:
+        text += "\n🏆 Лидеры продаж:\n"
+        for place, product in enumerate(report['top_products'], 1):
+            text += (f"{place}. {product['name']}: {product['revenue']:,} сум, "
+                     f"{product['units']} шт., заказов {product['orders']}\n")
+    for title, key in (("⬆️ Растут", 'rising'), ("⬇️ Падают", 'falling')):
+        if report[key]:
+            text += f"\n{title}:\n"
+            for product in report[key]:
+                text += f"• {product['name']}: {product['change_per_day'] * 100:+.1f}% в день\n"
+    
+    text += "\n📅 Средняя выручка по дням недели:\n"
+    text += ', '.join(f"{day} {revenue:,}" for day, revenue in zip(WEEKDAYS, report['weekday_revenue']))
+    hours = sorted(report['hourly_revenue'], key=report['hourly_revenue'].get, reverse=True)[:3]
+    if hours:
+        text += "\n\n🕐 Пиковые часы (UTC): " + ', '.join(f"{hour}:00" for hour in sorted(hours))
+    return text
+
+@router.message(Command("sales"))
+async def show_sales_command(message: Message, command: CommandObject):
+    """Show sales of the last days: /sales [days]"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав администратора")
+        return
+    
+    days = (command.args or '30').strip()
+    if not days.isdigit() or not 1 <= int(days) <= 365:
+        await message.answer("Использование: /sales [число дней, 1-365]")
+        return
+    
+    report = await sales_report(int(days))
+    await message.answer(format_sales_report(report)[:4000])
+
+@router.callback_query(F.data == "admin_sales")
+async def show_sales(callback: CallbackQuery):
+    """Show sales of the last 30 days"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа")
+        return
+    
+    report = await sales_report()
+    await callback.message.edit_text(
+        format_sales_report(report)[:4000],
+        reply_markup=get_admin_menu_keyboard()
+    )
+
 @router.callback_query(F.data == "admin_ai_insights")
 async def show_ai_insights(callback: CallbackQuery):
     """Show AI insights"""
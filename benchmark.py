@@ -0,0 +1,1208 @@
+"""Offline benchmarks for the Arzon bot.
+
+The ``pipeline`` benchmark builds the real dispatcher from ``main`` against a
+fake Bot session that records outgoing API calls instead of talking to
+Telegram, then replays scripted user journeys at the requested concurrency:
+
+    python benchmark.py pipeline --users 200 --concurrency 20
+    python benchmark.py pipeline --output run.json --compare baseline.json
+    python benchmark.py search --products 100000
+    python benchmark.py render --products 20000 --categories 10 --cart-lines 100
+    python benchmark.py events --users 20000 --days 7
+    python benchmark.py sales --orders 100000 400000 1600000
+    python benchmark.py checkout --users 200 --provider-latency 0.05
+    python benchmark.py stock --users 200 --stock 50
+    python benchmark.py promotions --users 200 --percent 10
+    python benchmark.py dispatch --couriers 200 --batch 500 --max-stops 6
+    python benchmark.py pipeline --db postgresql://localhost/arzon_bench
+
+With ``--compare`` the process exits with status 1 when any journey regressed
+by more than ``--threshold`` against the baseline results.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple, get_args
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import CallbackQuery, Message, Update, User
+from aiohttp import web
+
+import main
+from config import Config
+from database.models import db
+from database.queries import CART_ITEMS, CATALOG_PRODUCTS, CATEGORY_PRODUCTS, Query
+from fake_payment_provider import FakeProvider
+from generate_data import generate, DISHES, MODIFIERS
+from handlers.cart import render_cart
+from handlers.catalog import show_product_detail
+from keyboards.keyboards import get_products_keyboard
+from utils.dispatch import DispatchEngine
+from utils.events import FUNNEL_STEPS, EventTracker, EventTrackingMiddleware, event_tracker
+from utils import notifications
+from utils.geo import NUMPY_AVAILABLE
+from utils.inventory import InventoryMonitor
+from utils.routing import plan_routes
+from utils.sales import sales_report
+from utils.metrics import Histogram, metrics, TelegramTimingMiddleware
+from utils.payments import payment_gateway
+from utils.promotions import promotion_engine
+from utils.translit import normalize
+from utils.webserver import web_server
+
+BENCH_TOKEN = "123456789:BENCHMARK-TOKEN-NOT-REAL"
+ADMIN_ID = 900000000
+FIRST_USER_ID = 100000000
+
+
+class FakeSession(BaseSession):
+    """Bot session that records API calls and returns synthetic results"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls: Dict[str, int] = {}
+        self._message_id = 0
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30,
+                             chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        return self._fake_result(bot, method)
+
+    def _fake_result(self, bot: Bot, method: TelegramMethod) -> Any:
+        returning = method.__returning__
+        candidates = get_args(returning) or (returning,)
+
+        if Message in candidates:
+            self._message_id += 1
+            return Message.model_validate({
+                'message_id': self._message_id,
+                'date': int(time.time()),
+                'chat': {'id': getattr(method, 'chat_id', None) or 0, 'type': 'private'},
+                'text': getattr(method, 'text', None) or '',
+            }, context={'bot': bot})
+        if User in candidates:
+            return User(id=int(BENCH_TOKEN.split(':')[0]), is_bot=True,
+                        first_name='Arzon', username='arzon_bench_bot')
+        if bool in candidates:
+            return True
+        return None
+
+
+class UpdateFactory:
+    """Builds Telegram updates for simulated users"""
+
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._update_id = 0
+        self._message_id = 0
+
+    def _next_ids(self) -> Tuple[int, int]:
+        self._update_id += 1
+        self._message_id += 1
+        return self._update_id, self._message_id
+
+    @staticmethod
+    def _user(user_id: int) -> Dict:
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}',
+                'username': f'user{user_id}', 'language_code': 'uz'}
+
+    def _message_payload(self, user_id: int, **fields) -> Dict:
+        _, message_id = self._next_ids()
+        payload = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self._user(user_id),
+        }
+        payload.update(fields)
+        return payload
+
+    def message(self, user_id: int, text: str) -> Update:
+        payload = self._message_payload(user_id, text=text)
+        return Update.model_validate(
+            {'update_id': self._update_id, 'message': payload}, context={'bot': self.bot}
+        )
+
+    def contact(self, user_id: int, phone: str) -> Update:
+        payload = self._message_payload(user_id, contact={
+            'phone_number': phone, 'first_name': f'User{user_id}', 'user_id': user_id
+        })
+        return Update.model_validate(
+            {'update_id': self._update_id, 'message': payload}, context={'bot': self.bot}
+        )
+
+    def inline_query(self, user_id: int, query: str, offset: str = '') -> Update:
+        self._next_ids()
+        return Update.model_validate({
+            'update_id': self._update_id,
+            'inline_query': {
+                'id': str(self._update_id),
+                'from': self._user(user_id),
+                'query': query,
+                'offset': offset,
+            },
+        }, context={'bot': self.bot})
+
+    def callback(self, user_id: int, data: str) -> Update:
+        message = self._message_payload(user_id, text='...')
+        message['from'] = {'id': int(BENCH_TOKEN.split(':')[0]), 'is_bot': True,
+                           'first_name': 'Arzon'}
+        return Update.model_validate({
+            'update_id': self._update_id,
+            'callback_query': {
+                'id': str(self._update_id),
+                'from': self._user(user_id),
+                'chat_instance': str(user_id),
+                'message': message,
+                'data': data,
+            },
+        }, context={'bot': self.bot})
+
+
+# A journey is a list of steps; each step builds one update for a user id
+Step = Callable[[UpdateFactory, int], Update]
+
+JOURNEYS: Dict[str, List[Step]] = {
+    'register': [
+        lambda f, uid: f.message(uid, '/start'),
+        lambda f, uid: f.callback(uid, 'lang_uz'),
+        lambda f, uid: f.contact(uid, f'+99890{uid % 10000000:07d}'),
+        lambda f, uid: f.message(uid, f'Toshkent, Chilonzor {uid % 100}'),
+    ],
+    'browse': [
+        lambda f, uid: f.message(uid, '📂 Категориялар'),
+        lambda f, uid: f.callback(uid, f'category_{uid % 4 + 1}'),
+        lambda f, uid: f.callback(uid, f'product_{uid % 14 + 1}'),
+    ],
+    'search': [
+        lambda f, uid: f.message(uid, 'plov'),
+        lambda f, uid: f.message(uid, '🔍 Қидирув'),
+        lambda f, uid: f.message(uid, 'Шашли'),
+    ],
+    'inline': [
+        lambda f, uid: f.inline_query(uid, 'pl'),
+        lambda f, uid: f.inline_query(uid, 'plov'),
+        lambda f, uid: f.inline_query(uid, 'plov', offset='20'),
+        lambda f, uid: f.inline_query(uid, 'шаш'),
+    ],
+    'add_to_cart': [
+        lambda f, uid: f.callback(uid, f'add_to_cart_{uid % 14 + 1}'),
+        lambda f, uid: f.callback(uid, f'add_to_cart_{(uid + 5) % 14 + 1}'),
+    ],
+    'checkout': [
+        lambda f, uid: f.message(uid, '🛒 Саватча'),
+        lambda f, uid: f.callback(uid, 'checkout'),
+        lambda f, uid: f.callback(uid, 'payment_cash'),
+    ],
+    'my_orders': [
+        lambda f, uid: f.callback(uid, 'my_orders'),
+    ],
+    'profile': [
+        lambda f, uid: f.callback(uid, 'edit_phone'),
+        lambda f, uid: f.message(uid, f'+99891{uid % 10000000:07d}'),
+        lambda f, uid: f.callback(uid, 'edit_address'),
+        lambda f, uid: f.message(uid, f'Toshkent, Yunusobod {uid % 100}'),
+        lambda f, uid: f.message(uid, '👤 Профил'),
+    ],
+    'admin_stats': [
+        lambda f, uid: f.callback(ADMIN_ID, 'admin_stats'),
+    ],
+}
+
+
+# Checkout paid online, alternating between the two providers
+ONLINE_CHECKOUT: List[Step] = [
+    lambda f, uid: f.message(uid, '🛒 Саватча'),
+    lambda f, uid: f.callback(uid, 'checkout'),
+    lambda f, uid: f.callback(uid, 'payment_payme' if uid % 2 else 'payment_click'),
+]
+
+
+def _db_query_count() -> int:
+    return sum(h.count for h in metrics.histograms('db').values())
+
+
+def _db_commit_count() -> int:
+    return metrics.counters().get('db_commits', 0)
+
+
+async def run_journey(dp, bot: Bot, factory: UpdateFactory, name: str,
+                      user_ids: List[int], concurrency: int,
+                      steps: Optional[List[Step]] = None) -> Dict:
+    """Run one journey for every user and collect its statistics"""
+    steps = steps or JOURNEYS[name]
+    latency = Histogram()
+    semaphore = asyncio.Semaphore(concurrency)
+    session: FakeSession = bot.session
+    api_calls_before = sum(session.calls.values())
+    queries_before = _db_query_count()
+    commits_before = _db_commit_count()
+    errors = 0
+
+    async def simulate(user_id: int):
+        nonlocal errors
+        async with semaphore:
+            for step in steps:
+                update = step(factory, user_id)
+                start = time.perf_counter()
+                try:
+                    await dp.feed_update(bot, update)
+                except Exception:
+                    errors += 1
+                latency.record(int((time.perf_counter() - start) * 1_000_000))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(user_id) for user_id in user_ids))
+    # Queued writes of the journey are part of its cost
+    await db.write_behind.flush()
+    elapsed = time.perf_counter() - started
+
+    p50, p95, p99 = latency.percentiles((50, 95, 99))
+    return {
+        'journeys': len(user_ids),
+        'updates': latency.count,
+        'errors': errors,
+        'updates_per_sec': round(latency.count / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': p50 / 1000.0,
+        'p95_ms': p95 / 1000.0,
+        'p99_ms': p99 / 1000.0,
+        'db_queries_per_journey': round((_db_query_count() - queries_before) / len(user_ids), 2),
+        'db_commits_per_journey': round((_db_commit_count() - commits_before) / len(user_ids), 2),
+        'api_calls_per_journey': round(
+            (sum(session.calls.values()) - api_calls_before) / len(user_ids), 2
+        ),
+    }
+
+
+async def run_pipeline(args) -> Dict:
+    """Run all journeys in sequence and return the results document"""
+    database = await _fresh_database(args)
+    await main.init_database()
+    if args.dataset_users or args.dataset_orders or args.dataset_products:
+        # The loader changes the journal mode, which needs the only open connection
+        await db.close()
+        await asyncio.to_thread(
+            generate, database, users=args.dataset_users, orders=args.dataset_orders,
+            products=args.dataset_products, seed=args.seed
+        )
+
+    if ADMIN_ID not in Config.ADMIN_IDS:
+        Config.ADMIN_IDS.append(ADMIN_ID)
+
+    session = FakeSession()
+    session.middleware(TelegramTimingMiddleware())
+    bot = Bot(token=BENCH_TOKEN, session=session)
+    dp = main.create_dispatcher()
+    factory = UpdateFactory(bot)
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+
+    results: Dict[str, Dict] = {}
+    for name in args.journeys:
+        ids = user_ids[:max(1, args.users // 10)] if name == 'admin_stats' else user_ids
+        results[name] = await run_journey(dp, bot, factory, name, ids, args.concurrency)
+    # Funnel events are written after the journeys, as on shutdown
+    await event_tracker.close()
+
+    return {
+        'benchmark': 'pipeline',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {'users': args.users, 'concurrency': args.concurrency,
+                   'dataset_users': args.dataset_users, 'dataset_orders': args.dataset_orders,
+                   'dataset_products': args.dataset_products, 'seed': args.seed},
+        'telegram_calls': dict(session.calls),
+        'events_stored': event_tracker.stored,
+        'results': results,
+    }
+
+
+def _is_postgres(database: Optional[str]) -> bool:
+    return bool(database) and database.startswith(('postgresql://', 'postgres://'))
+
+
+async def _fresh_database(args) -> str:
+    """Point ``db`` at an empty database; returns its SQLite path or URL.
+    On PostgreSQL every run gets a new schema unless --keep-db is given. An
+    existing SQLite --db is only replaced with --overwrite (checked by
+    ``main_cli``); later calls in the same run replace the benchmark's own file."""
+    # Pooled connections belong to the previous database
+    await db.close()
+    if _is_postgres(args.db):
+        url = args.db
+        if not args.keep_db:
+            import asyncpg
+            schema = f'arzon_bench_{os.getpid()}_{int(time.time())}'
+            conn = await asyncpg.connect(url)
+            try:
+                await conn.execute(f'CREATE SCHEMA {schema}')
+            finally:
+                await conn.close()
+            # asyncpg passes unknown URL parameters on as server settings
+            url += ('&' if '?' in url else '?') + f'search_path={schema}'
+        db.configure(url)
+        return url
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='arzon-bench-'), 'bench.db')
+    if not args.keep_db:
+        # WAL files and the analytics snapshot belong to the old database too
+        for path in (db_path, f'{db_path}-wal', f'{db_path}-shm', f'{db_path}.snapshot'):
+            if os.path.exists(path):
+                os.remove(path)
+    db.configure(db_path)
+    return db_path
+
+
+def search_queries(count: int, seed: int) -> List[str]:
+    """Mixed Cyrillic/Latin, full-word and prefix queries"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        dish = rng.choice(DISHES)[rng.randrange(2)]
+        modifier = rng.choice(MODIFIERS)[rng.randrange(2)]
+        text = f"{modifier} {dish}".strip() if rng.random() < 0.3 else dish
+        if rng.random() < 0.4:
+            text = normalize(text)
+        if rng.random() < 0.5:
+            text = text[:max(2, len(text) // 2)]
+        queries.append(text)
+    return queries
+
+
+async def run_search(args) -> Dict:
+    """Search latency over a catalog of --products products"""
+    database = await _fresh_database(args)
+    await main.init_database()
+    await db.close()
+    await asyncio.to_thread(
+        generate, database, products=args.products, users=args.dataset_users,
+        orders=args.dataset_orders, seed=args.seed
+    )
+
+    queries = search_queries(args.queries, args.seed)
+    await db.search_products(queries[0])  # warm popularity cache
+    latency = Histogram()
+    hits = 0
+    started = time.perf_counter()
+    for query in queries:
+        start = time.perf_counter()
+        results = await db.search_products(query, limit=10)
+        latency.record(int((time.perf_counter() - start) * 1_000_000))
+        hits += bool(results)
+    elapsed = time.perf_counter() - started
+
+    p50, p95, p99 = latency.percentiles((50, 95, 99))
+    return {
+        'benchmark': 'search',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {'products': args.products, 'queries': args.queries, 'seed': args.seed},
+        'results': {
+            'search': {
+                'queries': latency.count,
+                'hit_rate': round(hits / len(queries), 3),
+                'queries_per_sec': round(len(queries) / elapsed, 1),
+                'p50_ms': p50 / 1000.0,
+                'p95_ms': p95 / 1000.0,
+                'p99_ms': p99 / 1000.0,
+            }
+        },
+    }
+
+
+def _retained_bytes(build: Callable[[], Any]) -> int:
+    """Bytes allocated by ``build()`` and still held by its result"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return retained
+
+
+async def _render_case(query: Query, parameters: Tuple, fetch: Callable,
+                       render: Callable, repeat: int) -> Dict:
+    """Memory of one result set as column dicts and as row tuples, plus the
+    time to fetch it through ``Database`` and render it"""
+    async with db.get_connection() as conn:
+        cursor = await conn.execute_query(query, parameters)
+        rows = [tuple(row) for row in await cursor.fetchall()]
+    fields = query.row_type._fields
+    # dict(row) of an aiosqlite.Row built the same per-row mapping
+    as_dicts = _retained_bytes(lambda: [dict(zip(fields, row)) for row in rows])
+    as_rows = _retained_bytes(lambda: [query.decode(row) for row in rows])
+
+    fetch_latency, render_latency = Histogram(), Histogram()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = await fetch()
+        middle = time.perf_counter()
+        render(result)
+        end = time.perf_counter()
+        fetch_latency.record(int((middle - start) * 1_000_000))
+        render_latency.record(int((end - middle) * 1_000_000))
+
+    count = max(1, len(rows))
+    return {
+        'rows': len(rows),
+        'dict_bytes_per_row': as_dicts // count,
+        'tuple_bytes_per_row': as_rows // count,
+        'allocation_reduction': round(1 - as_rows / as_dicts, 3) if as_dicts else 0.0,
+        'fetch_p50_ms': fetch_latency.percentiles((50,))[0] / 1000.0,
+        'render_p50_ms': render_latency.percentiles((50,))[0] / 1000.0,
+    }
+
+
+async def run_render(args) -> Dict:
+    """Row memory and render time of the largest category, a large cart and
+    the catalog snapshot"""
+    database = await _fresh_database(args)
+    await main.init_database()
+    await db.close()
+    await asyncio.to_thread(
+        generate, database, products=args.products, categories=args.categories, seed=args.seed
+    )
+
+    async with db.get_connection() as conn:
+        cursor = await conn.execute('''
+            SELECT category_id FROM products WHERE is_available = 1
+            GROUP BY category_id ORDER BY COUNT(*) DESC, category_id LIMIT 1
+        ''')
+        category_id = (await cursor.fetchone())[0]
+        cursor = await conn.execute(
+            'SELECT id FROM products WHERE is_available = 1 ORDER BY id LIMIT ?', (args.cart_lines,)
+        )
+        cart_products = [row[0] for row in await cursor.fetchall()]
+    user_id = FIRST_USER_ID
+    for product_id in cart_products:
+        await db.add_to_cart(user_id, product_id, 2)
+
+    def render_summary(summary: Dict):
+        render_cart(summary['items'], summary['total'], 'ru')
+
+    def index_names(products: List):
+        return [f"{product.name_uz} {product.name_ru}" for product in products]
+
+    return {
+        'benchmark': 'render',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {'products': args.products, 'categories': args.categories,
+                   'cart_lines': args.cart_lines, 'repeat': args.repeat, 'seed': args.seed},
+        'results': {
+            'category': await _render_case(
+                CATEGORY_PRODUCTS, (category_id,), lambda: db.get_products_by_category(category_id),
+                lambda products: get_products_keyboard(products, 'ru'), args.repeat
+            ),
+            'cart': await _render_case(
+                CART_ITEMS, (user_id,), lambda: db.get_cart_summary(user_id),
+                render_summary, args.repeat
+            ),
+            'snapshot': await _render_case(
+                CATALOG_PRODUCTS, (), db.get_catalog_products, index_names, args.repeat
+            ),
+        },
+    }
+
+
+async def _emit_cost(updates: int) -> Dict:
+    """Time added to a handled callback query by the event middleware"""
+    tracker = EventTracker(capacity=updates, interval=3600)
+    middleware = EventTrackingMiddleware(tracker)
+    event = CallbackQuery(
+        id='bench', chat_instance='bench', data='product_12',
+        from_user=User(id=FIRST_USER_ID, is_bot=False, first_name='Bench')
+    )
+    data = {'handler': SimpleNamespace(callback=show_product_detail)}
+
+    async def handler(event, data):
+        return None
+
+    start = time.perf_counter()
+    for _ in range(updates):
+        await handler(event, data)
+    bare = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(updates):
+        await middleware(handler, event, data)
+    tracked = time.perf_counter() - start
+
+    # The timer would flush an hour from now; write the buffer here instead
+    tracker._flush_task.cancel()
+    tracker._flush_task = None
+    start = time.perf_counter()
+    await tracker.flush()
+    flushed = time.perf_counter() - start
+    return {
+        'updates': updates,
+        'middleware_us_per_update': round((tracked - bare) / updates * 1_000_000, 3),
+        'flush_rows_per_sec': round(tracker.stored / flushed, 1),
+        'dropped': tracker.dropped,
+    }
+
+
+def synthetic_events(users: List[int], first_day: datetime, days: int,
+                     rng: random.Random) -> Tuple[List[Tuple], List[int]]:
+    """Funnel sessions of ``users`` on ``first_day`` and the ``days`` after it,
+    in time order, and how many users reached each step on the first day"""
+    events = []
+    reached = [0] * len(FUNNEL_STEPS)
+    for offset in range(days + 1):
+        day = first_day + timedelta(days=offset)
+        for user_id in users:
+            # Everyone is active on the day they registered, fewer later on
+            if offset and rng.random() > 0.6 / offset:
+                continue
+            at = day + timedelta(seconds=rng.randrange(80_000))
+            object_id = rng.randrange(1, 1000)
+            for step, name in enumerate(FUNNEL_STEPS):
+                events.append((at, user_id, name, object_id if step else None))
+                if not offset:
+                    reached[step] += 1
+                if rng.random() > 0.6:
+                    break
+                at += timedelta(seconds=rng.randrange(1, 120))
+    events.sort(key=lambda event: event[0])
+    return [(f'{at:%Y-%m-%d %H:%M:%S}.000', *rest) for at, *rest in events], reached
+
+
+async def run_events(args) -> Dict:
+    """Event emission overhead, ingest rate and funnel/retention query time
+    over --days days of events of a --users user cohort"""
+    await _fresh_database(args)
+    await main.init_database()
+    emit = await _emit_cost(args.updates)
+
+    first_day = datetime(2024, 1, 1)
+    cohort_day = f'{first_day:%Y-%m-%d}'
+    users = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    async with db.get_connection() as conn:
+        await conn.executemany(
+            'INSERT INTO users (telegram_id, first_name, created_at) VALUES (?, ?, ?)',
+            [(user_id, f'User{user_id}', f'{cohort_day} 08:00:00') for user_id in users]
+        )
+        await conn.commit()
+    events, expected = synthetic_events(users, first_day, args.days, random.Random(args.seed))
+
+    start = time.perf_counter()
+    for offset in range(0, len(events), args.batch):
+        await db.add_events(events[offset:offset + args.batch])
+    ingest = time.perf_counter() - start
+
+    end_day = f'{first_day + timedelta(days=1):%Y-%m-%d}'
+    funnel_latency, retention_latency = Histogram(), Histogram()
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        funnel = await db.get_funnel(FUNNEL_STEPS, cohort_day, end_day)
+        middle = time.perf_counter()
+        size, active = await db.get_retention(cohort_day, args.days)
+        end = time.perf_counter()
+        funnel_latency.record(int((middle - start) * 1_000_000))
+        retention_latency.record(int((end - middle) * 1_000_000))
+
+    return {
+        'benchmark': 'events',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {'users': args.users, 'days': args.days, 'updates': args.updates,
+                   'batch': args.batch, 'repeat': args.repeat, 'seed': args.seed},
+        'results': {
+            'emit': emit,
+            'ingest': {
+                'events': len(events),
+                'rows_per_sec': round(len(events) / ingest, 1),
+            },
+            'queries': {
+                'funnel': funnel,
+                'funnel_correct': funnel == expected,
+                'cohort_size': size,
+                'retention': active,
+                'funnel_p50_ms': funnel_latency.percentiles((50,))[0] / 1000.0,
+                'retention_p50_ms': retention_latency.percentiles((50,))[0] / 1000.0,
+            },
+        },
+    }
+
+
+# What reports computed before the sales buckets: a scan of the window's orders
+SALES_SCAN_SQL = '''
+    SELECT substr(o.created_at, 1, 10), oi.product_id, COUNT(DISTINCT o.id),
+           SUM(oi.quantity), SUM(oi.quantity * oi.price)
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.id
+    WHERE o.created_at >= ? AND o.created_at < ?
+    GROUP BY substr(o.created_at, 1, 10), oi.product_id
+'''
+
+
+async def run_sales(args) -> Dict:
+    """Sales report time as order history grows to each of --orders, next to
+    a scan of the report window's orders"""
+    database = await _fresh_database(args)
+    await main.init_database()
+    today = datetime.utcnow().date()
+    start = (today - timedelta(days=args.days)).isoformat()
+
+    results = {}
+    for orders in sorted(args.orders):
+        await db.close()
+        await asyncio.to_thread(
+            generate, database, products=args.products, users=args.dataset_users,
+            orders=orders, seed=args.seed
+        )
+        report_latency, scan_latency = Histogram(), Histogram()
+        for _ in range(args.repeat):
+            begin = time.perf_counter()
+            report = await sales_report(args.days, today=today)
+            middle = time.perf_counter()
+            async with db.get_connection() as conn:
+                cursor = await conn.execute(SALES_SCAN_SQL, (start, today.isoformat()))
+                scanned = await cursor.fetchall()
+            end = time.perf_counter()
+            report_latency.record(int((middle - begin) * 1_000_000))
+            scan_latency.record(int((end - middle) * 1_000_000))
+
+        results[f'orders_{orders}'] = {
+            'orders': orders,
+            'report_p50_ms': report_latency.percentiles((50,))[0] / 1000.0,
+            'scan_p50_ms': scan_latency.percentiles((50,))[0] / 1000.0,
+            'buckets_match_scan': report['revenue'] == sum(row[4] for row in scanned),
+        }
+
+    return {
+        'benchmark': 'sales',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {'orders': args.orders, 'products': args.products, 'days': args.days,
+                   'users': args.dataset_users, 'numpy': NUMPY_AVAILABLE, 'seed': args.seed},
+        'results': results,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _count_paid() -> int:
+    async with db.get_connection() as conn:
+        cursor = await conn.execute("SELECT COUNT(*) FROM payments WHERE status = 'completed'")
+        return (await cursor.fetchone())[0]
+
+
+async def _count_orders() -> int:
+    async with db.get_connection() as conn:
+        cursor = await conn.execute('SELECT COUNT(*) FROM orders')
+        return (await cursor.fetchone())[0]
+
+
+async def run_repeated_taps(dp, bot: Bot, factory: UpdateFactory, step: Step,
+                            user_ids: List[int], taps: int, concurrency: int) -> Dict:
+    """Deliver one step ``taps`` times at once per user, plus a redelivery of the first"""
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def simulate(user_id: int):
+        nonlocal errors
+        async with semaphore:
+            updates = [step(factory, user_id) for _ in range(taps)]
+            updates.append(updates[0])
+            results = await asyncio.gather(
+                *(dp.feed_update(bot, update) for update in updates), return_exceptions=True
+            )
+            errors += sum(isinstance(result, Exception) for result in results)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate(user_id) for user_id in user_ids))
+    return {
+        'journeys': len(user_ids),
+        'updates': len(user_ids) * (taps + 1),
+        'errors': errors,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+async def run_checkout(args) -> Dict:
+    """Online checkout end to end against the local fake payment provider"""
+    database = await _fresh_database(args)
+    await main.init_database()
+
+    provider_port, bot_port = _free_port(), _free_port()
+    provider_url = f'http://127.0.0.1:{provider_port}'
+    Config.PAYME_MERCHANT_ID, Config.PAYME_KEY = 'bench-merchant', 'bench-key'
+    Config.PAYME_API_URL = f'{provider_url}/payme/api'
+    Config.CLICK_MERCHANT_ID = Config.CLICK_SERVICE_ID = Config.CLICK_MERCHANT_USER_ID = '1'
+    Config.CLICK_SECRET_KEY = 'bench-secret'
+    Config.CLICK_API_URL = f'{provider_url}/click/v2/merchant'
+
+    provider = FakeProvider(f'http://127.0.0.1:{bot_port}', args.provider_latency,
+                            args.pay_delay, Config.PAYME_KEY, Config.CLICK_SECRET_KEY)
+    provider_runner = web.AppRunner(provider.create_app(), access_log=None)
+    await provider_runner.setup()
+    await web.TCPSite(provider_runner, '127.0.0.1', provider_port).start()
+
+    session = FakeSession()
+    session.middleware(TelegramTimingMiddleware())
+    bot = Bot(token=BENCH_TOKEN, session=session)
+    dp = main.create_dispatcher()
+    payment_gateway.setup(bot)
+    await web_server.start(bot_port, host='127.0.0.1')
+
+    factory = UpdateFactory(bot)
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+    try:
+        for name in ('register', 'add_to_cart'):
+            await run_journey(dp, bot, factory, name, user_ids, args.concurrency)
+        metrics.reset()
+        started = time.perf_counter()
+        # With repeated taps the payment step is sent separately, several times at once
+        steps = ONLINE_CHECKOUT if args.taps <= 1 else ONLINE_CHECKOUT[:-1]
+        checkout = await run_journey(dp, bot, factory, 'checkout', user_ids,
+                                     args.concurrency, steps=steps)
+        repeated_taps = None
+        if args.taps > 1:
+            repeated_taps = await run_repeated_taps(dp, bot, factory, ONLINE_CHECKOUT[-1],
+                                                    user_ids, args.taps, args.concurrency)
+
+        paid = 0
+        deadline = time.perf_counter() + args.pay_delay + 30
+        while time.perf_counter() < deadline:
+            paid = await _count_paid()
+            if paid >= provider.invoices:
+                break
+            await asyncio.sleep(0.05)
+        # Let redelivered webhooks arrive; they must not change anything
+        await asyncio.sleep(0.2)
+        elapsed = time.perf_counter() - started
+        paid = await _count_paid()
+        orders = await _count_orders()
+    finally:
+        await web_server.stop()
+        await provider_runner.cleanup()
+        await payment_gateway.close()
+
+    def _percentiles_ms(name: str) -> Dict:
+        histogram = metrics.histogram('payment', name)
+        p50, p95, p99 = histogram.percentiles((50, 95, 99))
+        return {'count': histogram.count, 'p50_ms': p50 / 1000.0,
+                'p95_ms': p95 / 1000.0, 'p99_ms': p99 / 1000.0}
+
+    return {
+        'benchmark': 'checkout',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {'users': args.users, 'concurrency': args.concurrency, 'taps': args.taps,
+                   'provider_latency': args.provider_latency, 'pay_delay': args.pay_delay},
+        'results': {
+            'checkout': checkout,
+            **({'repeated_taps': repeated_taps} if repeated_taps else {}),
+            'payme_invoice': _percentiles_ms('payme_invoice'),
+            'click_invoice': _percentiles_ms('click_invoice'),
+            'invoice_to_paid': _percentiles_ms('invoice_to_paid'),
+            'payments': {
+                'orders': orders,
+                'invoices': provider.invoices,
+                'paid': paid,
+                'webhooks_sent': provider.webhooks_sent,
+                'webhook_retries': provider.webhook_retries,
+                'duplicate_callbacks': metrics.counters().get('duplicate_callbacks', 0),
+                'errors': sum(v for k, v in metrics.counters().items() if k.endswith('_errors')),
+                'seconds': round(elapsed, 2),
+            },
+        },
+    }
+
+
+async def run_stock(args) -> Dict:
+    """Concurrent checkouts competing for the last items of one product"""
+    database = await _fresh_database(args)
+    await main.init_database()
+    if ADMIN_ID not in Config.ADMIN_IDS:
+        Config.ADMIN_IDS.append(ADMIN_ID)
+
+    session = FakeSession()
+    session.middleware(TelegramTimingMiddleware())
+    bot = Bot(token=BENCH_TOKEN, session=session)
+    dp = main.create_dispatcher()
+    notifications.init_notification_service(bot)
+    monitor = InventoryMonitor(args.low_stock, window=0.05)
+    monitor.attach()
+
+    product_id = 1
+    await db.set_stock(product_id, args.stock)
+    factory = UpdateFactory(bot)
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+    add_items = [lambda f, uid: f.callback(uid, f'add_to_cart_{product_id}')] * args.quantity
+    await run_journey(dp, bot, factory, 'register', user_ids, args.concurrency)
+    await run_journey(dp, bot, factory, 'add_to_cart', user_ids, args.concurrency, steps=add_items)
+
+    metrics.reset()
+    checkout = await run_journey(dp, bot, factory, 'checkout', user_ids, args.concurrency)
+    await monitor.close()
+
+    async with db.get_connection() as conn:
+        cursor = await conn.execute(
+            'SELECT stock, is_available FROM products WHERE id = ?', (product_id,)
+        )
+        stock_left, available = await cursor.fetchone()
+        cursor = await conn.execute('''
+            SELECT COUNT(DISTINCT order_id), COALESCE(SUM(quantity), 0)
+            FROM order_items WHERE product_id = ?
+        ''', (product_id,))
+        orders, sold = await cursor.fetchone()
+
+    return {
+        'benchmark': 'stock',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {'users': args.users, 'concurrency': args.concurrency, 'stock': args.stock,
+                   'quantity': args.quantity, 'low_stock': args.low_stock},
+        'results': {
+            'checkout': checkout,
+            'inventory': {
+                'orders': orders,
+                'sold': sold,
+                'stock_left': stock_left,
+                'available': bool(available),
+                # Every unit is either sold or still in stock
+                'consistent': sold + stock_left == args.stock and stock_left >= 0,
+                'low_stock_alerts': monitor.alerts_sent,
+            },
+        },
+    }
+
+
+async def run_promotions(args) -> Dict:
+    """Two checkouts per user under an automatic once-per-user discount: the
+    first gets it, the second must go through at full price"""
+    database = await _fresh_database(args)
+    await main.init_database()
+
+    session = FakeSession()
+    session.middleware(TelegramTimingMiddleware())
+    bot = Bot(token=BENCH_TOKEN, session=session)
+    dp = main.create_dispatcher()
+    notifications.init_notification_service(bot)
+
+    await db.add_promotion('percent', args.percent, once_per_user=True)
+    promotion_engine.invalidate()
+    factory = UpdateFactory(bot)
+    user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+    await run_journey(dp, bot, factory, 'register', user_ids, args.concurrency)
+
+    metrics.reset()
+    checkouts = {}
+    for name in ('first_checkout', 'repeat_checkout'):
+        await run_journey(dp, bot, factory, 'add_to_cart', user_ids, args.concurrency)
+        checkouts[name] = await run_journey(dp, bot, factory, 'checkout', user_ids,
+                                            args.concurrency)
+
+    async with db.get_connection() as conn:
+        cursor = await conn.execute('''
+            SELECT COUNT(*),
+                   COALESCE(SUM(CASE WHEN discount_amount > 0 THEN 1 ELSE 0 END), 0),
+                   COALESCE(SUM(CASE WHEN discount_amount = 0 AND total_amount = (
+                       SELECT SUM(i.quantity * i.price) FROM order_items i
+                       WHERE i.order_id = orders.id
+                   ) THEN 1 ELSE 0 END), 0)
+            FROM orders
+        ''')
+        orders, discounted, full_price = await cursor.fetchone()
+
+    return {
+        'benchmark': 'promotions',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {'users': args.users, 'concurrency': args.concurrency,
+                   'percent': args.percent},
+        'results': {
+            **checkouts,
+            'redemptions': {
+                'orders': orders,
+                'discounted': discounted,
+                'full_price': full_price,
+                # Every user ordered twice and got the discount exactly once
+                'consistent': (orders == 2 * args.users and discounted == args.users
+                               and full_price == args.users),
+            },
+        },
+    }
+
+
+# Tashkent bounding box used for simulated courier and order positions
+CITY_BBOX = (41.20, 69.15, 41.40, 69.40)
+
+
+def random_points(count: int, rng: random.Random) -> List[Tuple[float, float]]:
+    lat_min, lon_min, lat_max, lon_max = CITY_BBOX
+    return [(rng.uniform(lat_min, lat_max), rng.uniform(lon_min, lon_max)) for _ in range(count)]
+
+
+async def run_dispatch(args) -> Dict:
+    """Nearest-courier lookup latency and dispatch planning throughput"""
+    rng = random.Random(args.seed)
+    engine = DispatchEngine()
+    for courier_id, (lat, lon) in enumerate(random_points(args.couriers, rng), start=1):
+        engine.go_online(courier_id)
+        engine.update_position(courier_id, lat, lon)
+    orders = [(order_id, lat, lon)
+              for order_id, (lat, lon) in enumerate(random_points(args.orders, rng), start=1)]
+
+    latency = Histogram()
+    for _, lat, lon in orders:
+        start = time.perf_counter()
+        engine.index.nearest(lat, lon)
+        latency.record(int((time.perf_counter() - start) * 1_000_000))
+
+    # One tick's worth of ready orders batched onto fewer couriers
+    batch = orders[:args.batch]
+    started = time.perf_counter()
+    routes = plan_routes(batch, engine.index, max_stops=args.max_stops, budget=args.budget)
+    elapsed = time.perf_counter() - started
+    stops = sum(len(route.stops) for route in routes)
+
+    p50, p95, p99 = latency.percentiles((50, 95, 99))
+    return {
+        'benchmark': 'dispatch',
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'params': {'couriers': args.couriers, 'orders': args.orders, 'batch': args.batch,
+                   'max_stops': args.max_stops, 'budget': args.budget, 'seed': args.seed,
+                   'numpy': NUMPY_AVAILABLE},
+        'results': {
+            'nearest': {
+                'queries': latency.count,
+                'p50_ms': p50 / 1000.0,
+                'p95_ms': p95 / 1000.0,
+                'p99_ms': p99 / 1000.0,
+            },
+            'routes': {
+                'orders': len(batch),
+                'assigned': stops,
+                'routes': len(routes),
+                'stops_per_route': round(stops / max(1, len(routes)), 2),
+                'km_per_stop': round(
+                    sum(route.distance_km for route in routes) / max(1, stops), 3
+                ),
+                'plan_ms': round(elapsed * 1000, 2),
+                'queries_per_sec': round(len(batch) / elapsed, 1),
+            },
+        },
+    }
+
+
+def compare_results(current: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """Return human readable regressions of current results against baseline"""
+    regressions = []
+    checks = (
+        ('updates_per_sec', -1),
+        ('queries_per_sec', -1),
+        ('p95_ms', 1),
+        ('p99_ms', 1),
+        ('db_queries_per_journey', 1),
+        ('db_commits_per_journey', 1),
+    )
+    for name, result in current.get('results', {}).items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        for key, direction in checks:
+            old, new = base.get(key), result.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if change * direction > threshold:
+                regressions.append(f"{name}.{key}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def print_table(document: Dict):
+    if document['benchmark'] != 'pipeline':
+        for name, result in document['results'].items():
+            print(f"{name}: " + ', '.join(f"{key}={value}" for key, value in result.items()))
+        return
+
+    header = (f"{'journey':<12} {'updates/s':>10} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'db q/j':>7} {'com/j':>6} {'api/j':>6} {'err':>4}")
+    print(header)
+    print('-' * len(header))
+    for name, r in document['results'].items():
+        print(f"{name:<12} {r['updates_per_sec']:>10} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+              f"{r['p99_ms']:>8.2f} {r['db_queries_per_journey']:>7} "
+              f"{r['db_commits_per_journey']:>6} {r['api_calls_per_journey']:>6} {r['errors']:>4}")
+
+
+def finish(document: Dict, args) -> int:
+    """Print, store and compare a results document; return exit status"""
+    print_table(document)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(document, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(document, baseline, args.threshold)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against baseline")
+    return 0
+
+
+def add_common_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--db', help='SQLite file or postgresql:// URL to use '
+                        '(default: fresh temp file; Postgres runs in a new schema)')
+    parser.add_argument('--keep-db', action='store_true', help='reuse an existing --db database')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='delete an existing SQLite --db and start from an empty one')
+    parser.add_argument('--output', help='write results JSON to this file')
+    parser.add_argument('--compare', help='baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help='allowed relative regression (default 0.15)')
+
+
+def add_dataset_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--dataset-users', type=int, default=0,
+                        help='top the database up to this many users (generate_data)')
+    parser.add_argument('--dataset-orders', type=int, default=0,
+                        help='top the database up to this many orders')
+    parser.add_argument('--dataset-products', type=int, default=0,
+                        help='top the database up to this many products')
+    parser.add_argument('--seed', type=int, default=42, help='dataset generator seed')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pipeline = commands.add_parser('pipeline', help='replay user journeys through the dispatcher')
+    pipeline.add_argument('--users', type=int, default=100, help='simulated users')
+    pipeline.add_argument('--concurrency', type=int, default=10, help='users in flight')
+    add_dataset_arguments(pipeline)
+    pipeline.add_argument('--journeys', nargs='+', default=list(JOURNEYS), choices=list(JOURNEYS))
+    add_common_arguments(pipeline)
+
+    search = commands.add_parser('search', help='full-text product search latency')
+    search.add_argument('--products', type=int, default=100_000, help='catalog size')
+    search.add_argument('--queries', type=int, default=2000, help='queries to run')
+    add_dataset_arguments(search)
+    add_common_arguments(search)
+
+    render = commands.add_parser('render', help='row memory and rendering of large menus and carts')
+    render.add_argument('--products', type=int, default=20_000, help='catalog size')
+    render.add_argument('--categories', type=int, default=10, help='categories the catalog spans')
+    render.add_argument('--cart-lines', type=int, default=100, help='distinct products in the cart')
+    render.add_argument('--repeat', type=int, default=20, help='fetch and render rounds per case')
+    render.add_argument('--seed', type=int, default=42, help='dataset generator seed')
+    add_common_arguments(render)
+
+    events = commands.add_parser('events', help='funnel event emission, ingest and reports')
+    events.add_argument('--users', type=int, default=20_000, help='users in the cohort')
+    events.add_argument('--days', type=int, default=7, help='days of activity after registration')
+    events.add_argument('--updates', type=int, default=100_000, help='updates through the middleware')
+    events.add_argument('--batch', type=int, default=10_000, help='events written per transaction')
+    events.add_argument('--repeat', type=int, default=5, help='funnel and retention query rounds')
+    events.add_argument('--seed', type=int, default=42, help='event generator seed')
+    add_common_arguments(events)
+
+    sales = commands.add_parser('sales', help='sales report time as order history grows')
+    sales.add_argument('--orders', type=int, nargs='+', default=[50_000, 200_000, 800_000],
+                       help='order history sizes to measure at')
+    sales.add_argument('--products', type=int, default=2000, help='catalog size')
+    sales.add_argument('--days', type=int, default=30, help='report window')
+    sales.add_argument('--dataset-users', type=int, default=20_000, help='users placing the orders')
+    sales.add_argument('--repeat', type=int, default=5, help='report rounds per history size')
+    sales.add_argument('--seed', type=int, default=42, help='dataset generator seed')
+    add_common_arguments(sales)
+
+    checkout = commands.add_parser('checkout', help='online payment checkout end to end')
+    checkout.add_argument('--users', type=int, default=100, help='simulated users')
+    checkout.add_argument('--concurrency', type=int, default=10, help='users in flight')
+    checkout.add_argument('--provider-latency', type=float, default=0.05,
+                          help='fake provider invoice latency, s')
+    checkout.add_argument('--pay-delay', type=float, default=0.2,
+                          help='seconds from invoice to payment webhook')
+    checkout.add_argument('--taps', type=int, default=1,
+                          help='simultaneous taps on the payment button per user')
+    add_common_arguments(checkout)
+
+    stock = commands.add_parser('stock', help='concurrent checkouts of a scarce product')
+    stock.add_argument('--users', type=int, default=200, help='simulated users')
+    stock.add_argument('--concurrency', type=int, default=50, help='users in flight')
+    stock.add_argument('--stock', type=int, default=50, help='initial stock of the product')
+    stock.add_argument('--quantity', type=int, default=1, help='items of it in every cart')
+    stock.add_argument('--low-stock', type=int, default=5, help='low stock alert threshold')
+    add_common_arguments(stock)
+
+    promotions = commands.add_parser('promotions',
+                                     help='repeat checkouts under a once-per-user discount')
+    promotions.add_argument('--users', type=int, default=200, help='simulated users')
+    promotions.add_argument('--concurrency', type=int, default=50, help='users in flight')
+    promotions.add_argument('--percent', type=int, default=10, help='discount of the promotion')
+    add_common_arguments(promotions)
+
+    dispatch = commands.add_parser('dispatch', help='courier spatial index and assignment')
+    dispatch.add_argument('--couriers', type=int, default=5000, help='couriers on shift')
+    dispatch.add_argument('--orders', type=int, default=2000, help='nearest-courier lookups')
+    dispatch.add_argument('--batch', type=int, default=500, help='ready orders routed in one tick')
+    dispatch.add_argument('--max-stops', type=int, default=4, help='orders per route')
+    dispatch.add_argument('--budget', type=float, default=0.2, help='route planning budget, s')
+    dispatch.add_argument('--seed', type=int, default=42, help='position generator seed')
+    add_common_arguments(dispatch)
+
+    return parser
+
+
+BENCHMARKS: Dict[str, Callable] = {
+    'pipeline': run_pipeline,
+    'search': run_search,
+    'render': run_render,
+    'events': run_events,
+    'sales': run_sales,
+    'dispatch': run_dispatch,
+    'checkout': run_checkout,
+    'stock': run_stock,
+    'promotions': run_promotions,
+}
+
+
+async def run_benchmark(args) -> Dict:
+    try:
+        return await BENCHMARKS[args.command](args)
+    finally:
+        await db.close()
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    # main configures INFO logging on import; per-update logs would dominate timings
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if (args.db and not _is_postgres(args.db) and os.path.exists(args.db)
+            and not (args.keep_db or args.overwrite)):
+        # Without either flag the run would delete a database it did not create
+        parser.error(f"{args.db} exists: pass --keep-db to reuse it or --overwrite to replace it")
+    document = asyncio.run(run_benchmark(args))
+    return finish(document, args)
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
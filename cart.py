@@ -1,67 +1,180 @@
+import uuid
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database.models import db
+from database.models import db, OutOfStockError, PriceChangedError, RedemptionError
+from database.queries import CartItem, User
 from keyboards.keyboards import (
     get_cart_keyboard, get_payment_keyboard, 
-    get_location_keyboard, get_main_menu_keyboard
+    get_location_keyboard, get_main_menu_keyboard, get_pay_keyboard
 )
 from localization.texts import get_text
+from utils.eta import eta_model
+from utils.helpers import calculate_delivery_time
+from utils.idempotency import checkout_guard
+from utils.payments import payment_gateway
+from utils.promotions import promotion_engine
 
 router = Router()
 
 class OrderStates(StatesGroup):
     waiting_for_location = State()
     waiting_for_payment = State()
+    waiting_for_promo_code = State()
+
+@lru_cache(maxsize=None)
+def _cart_templates(lang: str) -> Tuple[str, str, str]:
+    """Localized (header, line, footer) format strings for cart rendering"""
+    header = "🛒 **Саватчангиз:**\n\n"
+    line = "📦 {}\n   " + get_text('quantity', lang) + "\n   💰 {:,} сўм\n\n"
+    footer = "**" + get_text('cart_total', lang) + "**"
+    return header, line, footer
+
+def render_cart(items: List[CartItem], total: int, lang: str,
+                discount: int = 0, bonus: int = 0) -> str:
+    """Build cart message from precomputed line totals"""
+    header, line, footer = _cart_templates(lang)
+    parts = [header]
+    parts.extend(line.format(item.name(lang), item.quantity, item.line_total) for item in items)
+    if discount:
+        parts.append(get_text('cart_discount', lang).format(f'{discount:,}'))
+    if bonus:
+        parts.append(get_text('cart_bonus', lang).format(f'{bonus:,}'))
+    parts.append(footer.format(f'{total:,}'))
+    return ''.join(parts)
+
+async def checkout_data(user: User, summary: Dict, data: Dict) -> Dict:
+    """Cart facts kept in FSM between showing the cart and creating the order;
+    ``data`` is the FSM data holding the promo code and bonus choice"""
+    bonus_balance = (user.bonus_balance or 0) if data.get('use_bonus') else 0
+    quote = await promotion_engine.quote(summary['items'], data.get('promo_code'), bonus_balance,
+                                         user.telegram_id)
+    return {
+        'cart_total': quote.total,
+        'cart_discount': quote.discount,
+        'bonus_used': quote.bonus,
+        'promotion_ids': quote.promotion_ids,
+        'promo_applied': quote.code_applied,
+        'cart_categories': list({item.category_id for item in summary['items']}),
+    }
+
+async def cart_view(user: User, state: FSMContext) -> Optional[Tuple[str, InlineKeyboardMarkup]]:
+    """Priced cart message and keyboard, None if the cart is empty; the
+    checkout data is kept in FSM so the cart is not read again"""
+    lang = user.lang
+    summary = await db.get_cart_summary(user.telegram_id)
+    if not summary['items']:
+        return None
+    
+    data = await state.get_data()
+    checkout = await checkout_data(user, summary, data)
+    await state.update_data(**checkout)
+    
+    text = render_cart(summary['items'], checkout['cart_total'], lang,
+                       checkout['cart_discount'], checkout['bonus_used'])
+    keyboard = get_cart_keyboard(lang, user.bonus_balance or 0, bool(data.get('use_bonus')))
+    return text, keyboard
 
 @router.message(F.text.in_(['🛒 Саватча', '🛒 Корзина']))
-async def show_cart(message: Message):
+async def show_cart(message: Message, state: FSMContext):
     """Show user's cart"""
     user = await db.get_user(message.from_user.id)
     if not user:
         return
     
-    lang = user.get('language_code', 'uz')
-    cart_items = await db.get_cart(message.from_user.id)
+    lang = user.lang
+    view = await cart_view(user, state)
     
-    if not cart_items:
+    if view is None:
         await message.answer(
             get_text('cart_empty', lang),
             reply_markup=get_main_menu_keyboard(lang)
         )
         return
     
-    # Calculate total and format cart
-    total = 0
-    cart_text = "🛒 **Саватчангиз:**\n\n"
+    text, keyboard = view
+    await message.answer(text, reply_markup=keyboard, parse_mode='Markdown')
+
+@router.callback_query(F.data == "promo_code")
+async def ask_promo_code(callback: CallbackQuery, state: FSMContext):
+    """Ask for a promo code"""
+    user = await db.get_user(callback.from_user.id)
+    lang = user.lang
+    
+    await callback.message.answer(get_text('enter_promo_code', lang))
+    await state.set_state(OrderStates.waiting_for_promo_code)
+    await callback.answer()
+
+@router.message(OrderStates.waiting_for_promo_code, F.text)
+async def promo_code_entered(message: Message, state: FSMContext):
+    """Check the promo code and show the repriced cart"""
+    user = await db.get_user(message.from_user.id)
+    lang = user.lang
     
-    for item in cart_items:
-        name = item[f'name_{lang}'] if f'name_{lang}' in item else item['name_uz']
-        item_total = item['price'] * item['quantity']
-        total += item_total
-        
-        cart_text += f"📦 {name}\n"
-        cart_text += f"   {get_text('quantity', lang).format(item['quantity'])}\n"
-        cart_text += f"   💰 {item_total:,} сўм\n\n"
+    rule = await promotion_engine.find_code(message.text)
+    if rule is None:
+        await message.answer(get_text('promo_invalid', lang))
+        return
+    if rule.once_per_user and await db.has_redeemed(rule.id, message.from_user.id):
+        await message.answer(get_text('promo_used', lang))
+        return
     
-    cart_text += f"**{get_text('cart_total', lang).format(f'{total:,}')}**"
+    # set_state(None) leaves the FSM data in place
+    await state.set_state(None)
+    await state.update_data(promo_code=rule.code)
+    view = await cart_view(user, state)
+    if view is None:
+        await message.answer(get_text('cart_empty', lang), reply_markup=get_main_menu_keyboard(lang))
+        return
     
+    data = await state.get_data()
     await message.answer(
-        cart_text,
-        reply_markup=get_cart_keyboard(lang),
-        parse_mode='Markdown'
+        get_text('promo_applied' if data.get('promo_applied') else 'promo_not_applicable', lang)
     )
+    text, keyboard = view
+    await message.answer(text, reply_markup=keyboard, parse_mode='Markdown')
+
+@router.callback_query(F.data == "toggle_bonus")
+async def toggle_bonus(callback: CallbackQuery, state: FSMContext):
+    """Pay part of the order with bonus balance, or stop doing so"""
+    user = await db.get_user(callback.from_user.id)
+    lang = user.lang
+    
+    data = await state.get_data()
+    await state.update_data(use_bonus=not data.get('use_bonus'))
+    view = await cart_view(user, state)
+    if view is None:
+        await callback.answer(get_text('cart_empty', lang))
+        return
+    
+    text, keyboard = view
+    await callback.message.edit_text(text, reply_markup=keyboard, parse_mode='Markdown')
 
 @router.callback_query(F.data == "checkout")
 async def start_checkout(callback: CallbackQuery, state: FSMContext):
     """Start checkout process"""
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
+    
+    data = await state.get_data()
+    if data.get('cart_total') is None:
+        # Checkout button from an old cart message: recompute once
+        summary = await db.get_cart_summary(callback.from_user.id)
+        if not summary['items']:
+            await callback.answer(get_text('cart_empty', lang))
+            return
+        await state.update_data(**await checkout_data(user, summary, data))
+    
+    # Identifies this checkout; repeated payment taps reuse its order
+    await state.update_data(checkout_token=uuid.uuid4().hex)
     
     # Check if user has address
-    if not user.get('address'):
+    if not user.address:
         await callback.message.edit_text(
             "📍 Илтимос, етказиб бериш манзилини юборинг:",
             reply_markup=None
@@ -83,7 +196,7 @@ async def start_checkout(callback: CallbackQuery, state: FSMContext):
 async def location_received(message: Message, state: FSMContext):
     """Handle location for delivery"""
     user = await db.get_user(message.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     latitude = message.location.latitude
     longitude = message.location.longitude
@@ -111,33 +224,97 @@ async def payment_selected(callback: CallbackQuery, state: FSMContext):
     payment_method = callback.data.split("_")[1]
     
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
-    
-    # Get cart items and calculate total
-    cart_items = await db.get_cart(callback.from_user.id)
-    total = sum(item['price'] * item['quantity'] for item in cart_items)
+    lang = user.lang
     
-    # Get location data
+    # Total was computed when the cart was shown
     data = await state.get_data()
+    if data.get('cart_total') is None:
+        # Cart changed after checkout started
+        summary = await db.get_cart_summary(callback.from_user.id)
+        data.update(await checkout_data(user, summary, data))
+    total = data['cart_total']
+    categories = data.get('cart_categories') or []
     latitude = data.get('latitude')
     longitude = data.get('longitude')
     
-    # Create order
-    order_id = await db.create_order(
-        user_id=callback.from_user.id,
-        total_amount=total,
-        delivery_address=user.get('address', 'Локация орқали'),
-        phone=user.get('phone'),
-        payment_method=payment_method,
-        latitude=latitude,
-        longitude=longitude
-    )
+    # Checkouts started before tokens existed fall back to the payment message
+    token = data.get('checkout_token') or f"{callback.from_user.id}:{callback.message.message_id}"
     
+    # Create order once per checkout; a repeated tap gets the same order
+    try:
+        order_id, created = await checkout_guard.run(token, lambda: db.create_order(
+            user_id=callback.from_user.id,
+            total_amount=total,
+            delivery_address=user.address or 'Локация орқали',
+            phone=user.phone,
+            payment_method=payment_method,
+            latitude=latitude,
+            longitude=longitude,
+            idempotency_key=token,
+            discount_amount=data.get('cart_discount') or 0,
+            bonus_used=data.get('bonus_used') or 0,
+            promotion_ids=data.get('promotion_ids') or []
+        ))
+    except RedemptionError:
+        # A usage limit was reached meanwhile: reload rules and show the cart
+        # repriced, keeping the promo code and bonus choice
+        promotion_engine.invalidate()
+        await state.set_state(None)
+        view = await cart_view(user, state)
+        if view is None:
+            await callback.message.edit_text(get_text('cart_empty', lang), reply_markup=None)
+            return
+        text, keyboard = view
+        await callback.message.edit_text(get_text('redemption_failed', lang) + "\n\n" + text,
+                                         reply_markup=keyboard, parse_mode='Markdown')
+        return
+    except OutOfStockError as e:
+        products = [await db.get_product(product_id) for product_id in e.product_ids]
+        names = ', '.join(p.name(lang) for p in products if p)
+        await state.clear()
+        await callback.message.edit_text(get_text('out_of_stock', lang).format(names),
+                                         reply_markup=None)
+        return
+    except PriceChangedError:
+        # Prices or lines changed after the cart was shown: show it repriced
+        await state.set_state(None)
+        view = await cart_view(user, state)
+        if view is None:
+            await callback.message.edit_text(get_text('cart_empty', lang), reply_markup=None)
+            return
+        text, keyboard = view
+        await callback.message.edit_text(get_text('cart_repriced', lang) + "\n\n" + text,
+                                         reply_markup=keyboard, parse_mode='Markdown')
+        return
+    
+    if order_id is not None and not created:
+        await callback.answer(get_text('order_already_created', lang).format(order_id))
+        return
+    
+    if order_id is None:
+        await state.clear()
+        await callback.message.edit_text(get_text('cart_empty', lang), reply_markup=None)
+        return
+    
+    eta = await eta_model.estimate(order_id, latitude, longitude, categories)
     await callback.message.edit_text(
-        get_text('order_created', lang).format(order_id),
+        get_text('order_created', lang).format(order_id) + "\n"
+        + get_text('order_eta', lang).format(calculate_delivery_time(eta), round(eta)),
         reply_markup=None
     )
     
+    if payment_gateway.supports(payment_method):
+        invoice = await payment_gateway.create_invoice(
+            payment_method, order_id, total, user.phone
+        )
+        if invoice:
+            await callback.message.answer(
+                get_text('payment_link', lang),
+                reply_markup=get_pay_keyboard(invoice.pay_url, lang)
+            )
+        else:
+            await callback.message.answer(get_text('payment_unavailable', lang))
+    
     await callback.message.answer(
         get_text('main_menu', lang),
         reply_markup=get_main_menu_keyboard(lang)
@@ -146,12 +323,13 @@ async def payment_selected(callback: CallbackQuery, state: FSMContext):
     await state.clear()
 
 @router.callback_query(F.data == "clear_cart")
-async def clear_cart(callback: CallbackQuery):
+async def clear_cart(callback: CallbackQuery, state: FSMContext):
     """Clear user's cart"""
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     await db.clear_cart(callback.from_user.id)
+    await state.update_data(cart_total=None, promo_code=None)
     
     await callback.message.edit_text(
         get_text('cart_empty', lang),
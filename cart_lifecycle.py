@@ -0,0 +1,67 @@
+"""Abandoned cart reminders and expiry.
+
+Run periodically by the scheduler. Carts untouched for
+``CART_REMINDER_HOURS`` get one reminder, sent in batches through the
+rate-limited notification sender; carts untouched for ``CART_TTL_DAYS``
+are deleted in small chunks so checkouts never wait long for the write
+lock. Cart table size and reminder throughput are published as metrics.
+"""
+import logging
+import time
+
+from config import Config
+from database.models import db
+from localization.texts import get_text
+from utils import notifications
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+REMINDER_BATCH = 100
+# Upper bound per run; the rest wait for the next run
+MAX_REMINDERS_PER_RUN = 3000
+
+
+async def remind_idle_carts() -> int:
+    """Remind owners of idle carts; returns the number of reminders delivered"""
+    service = notifications.notification_service
+    if service is None:
+        return 0
+
+    attempted = delivered = 0
+    start = time.perf_counter()
+    while attempted < MAX_REMINDERS_PER_RUN:
+        carts = await db.get_idle_carts(Config.CART_REMINDER_HOURS, REMINDER_BATCH)
+        if not carts:
+            break
+        messages = [
+            (user_id, get_text('cart_reminder', lang).format(items, f'{total:,}'))
+            for user_id, lang, items, total in carts
+        ]
+        delivered += await service.send_many(messages)
+        # Undeliverable reminders (blocked bot) are not retried either
+        await db.mark_carts_reminded([user_id for user_id, _, _, _ in carts])
+        attempted += len(carts)
+
+    if attempted:
+        elapsed = time.perf_counter() - start
+        metrics.incr('cart_reminders_sent', delivered)
+        metrics.incr('cart_reminders_failed', attempted - delivered)
+        metrics.set_gauge('cart_reminders_per_second', round(attempted / elapsed, 1))
+        logger.info(f"Sent {delivered}/{attempted} cart reminders in {elapsed:.1f}s")
+    return delivered
+
+
+async def run_cart_lifecycle():
+    """Scheduler job: remind, expire and measure carts"""
+    # Expire first so nobody is reminded of a cart that is about to go
+    removed = await db.purge_expired_carts(Config.CART_TTL_DAYS)
+    if removed:
+        metrics.incr('cart_rows_purged', removed)
+        logger.info(f"Removed {removed} expired cart items")
+
+    await remind_idle_carts()
+
+    rows, carts = await db.get_cart_size()
+    metrics.set_gauge('cart_rows', rows)
+    metrics.set_gauge('carts', carts)
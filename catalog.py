@@ -18,7 +18,7 @@ async def show_categories(message: Message):
     if not user:
         return
     
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     categories = await db.get_categories()
     
     if not categories:
@@ -36,7 +36,7 @@ async def show_products(callback: CallbackQuery):
     category_id = int(callback.data.split("_")[1])
     
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     products = await db.get_products_by_category(category_id)
     
@@ -55,7 +55,7 @@ async def show_product_detail(callback: CallbackQuery):
     product_id = int(callback.data.split("_")[1])
     
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     # Get product details
     product = await db.get_product(product_id)
@@ -64,36 +64,54 @@ async def show_product_detail(callback: CallbackQuery):
         await callback.answer("Маҳсулот топилмади")
         return
     
-    name = product[f'name_{lang}'] if f'name_{lang}' in product else product['name_uz']
-    description = product[f'description_{lang}'] if f'description_{lang}' in product else product['description_uz']
+    name = product.name(lang)
+    description = product.description(lang)
     
     text = get_text('product_details', lang).format(
-        name, f"{product['price']:,}", description or "Тафсилот йўқ"
+        name, f"{product.price:,}", description or "Тафсилот йўқ"
     )
+    is_favourite = product_id in await db.get_favourites(callback.from_user.id)
     
     await callback.message.edit_text(
         text,
-        reply_markup=get_product_detail_keyboard(product_id, lang),
+        reply_markup=get_product_detail_keyboard(product_id, lang, is_favourite),
         parse_mode='Markdown'
     )
 
 @router.callback_query(F.data.startswith("add_to_cart_"))
-async def add_to_cart(callback: CallbackQuery):
+async def add_to_cart(callback: CallbackQuery, state: FSMContext):
     """Add product to cart"""
     product_id = int(callback.data.split("_")[3])
     
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     await db.add_to_cart(callback.from_user.id, product_id, 1)
+    # Cart total cached for checkout is stale now
+    await state.update_data(cart_total=None)
     
     await callback.answer(get_text('product_added_to_cart', lang))
 
+@router.callback_query(F.data.startswith("fav_"))
+async def toggle_favourite(callback: CallbackQuery):
+    """Add product to favourites or remove it"""
+    product_id = int(callback.data.split("_")[1])
+    
+    user = await db.get_user(callback.from_user.id)
+    lang = user.lang
+    
+    is_favourite = await db.toggle_favourite(callback.from_user.id, product_id)
+    
+    await callback.message.edit_reply_markup(
+        reply_markup=get_product_detail_keyboard(product_id, lang, is_favourite)
+    )
+    await callback.answer(get_text('favourite_added' if is_favourite else 'favourite_removed', lang))
+
 @router.callback_query(F.data == "back_to_categories")
 async def back_to_categories(callback: CallbackQuery):
     """Go back to categories"""
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     categories = await db.get_categories()
     
@@ -111,7 +129,7 @@ async def back_to_products(callback: CallbackQuery):
 async def back_to_menu(callback: CallbackQuery):
     """Go back to main menu"""
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     await callback.message.edit_text(get_text('main_menu', lang))
     await callback.message.answer(
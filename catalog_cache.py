@@ -0,0 +1,139 @@
+"""In-memory, prefix-indexed copy of the available product catalog.
+
+Inline queries arrive on every keystroke and must be answered quickly, so
+they are served from this snapshot instead of the database. The snapshot is
+reloaded when invalidated (after catalog writes) or when it gets older than
+``ttl`` seconds; query results are memoized per snapshot version.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from database.models import db
+from database.queries import Product
+from utils.translit import tokenize
+
+# Prefix lengths kept in the index; longer query tokens are verified by startswith
+INDEX_PREFIX_LENGTHS = (2, 3)
+MIN_QUERY_LENGTH = 2
+
+
+class CatalogCache:
+    def __init__(self, ttl: float = 300.0, max_cached_queries: int = 2048):
+        self.ttl = ttl
+        self.max_cached_queries = max_cached_queries
+        self.version = 0
+        self.products: Dict[int, Product] = {}
+        self._ranked_ids: List[int] = []
+        self._tokens: Dict[int, Tuple[str, ...]] = {}
+        self._prefix_index: Dict[str, Set[int]] = {}
+        self._rank: Dict[int, int] = {}
+        self._results: 'OrderedDict[str, List[int]]' = OrderedDict()
+        self._loaded_at = 0.0
+        # Created lazily: on Python 3.9 a Lock binds to the loop current at creation
+        self._lock: Optional[asyncio.Lock] = None
+
+    def invalidate(self):
+        """Force reload on next access"""
+        self._loaded_at = 0.0
+
+    @property
+    def is_fresh(self) -> bool:
+        return bool(self._loaded_at) and time.monotonic() - self._loaded_at < self.ttl
+
+    async def ensure_loaded(self):
+        """Reload the snapshot if it was invalidated or expired"""
+        if self.is_fresh:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.is_fresh:
+                await self._load()
+
+    async def refresh(self):
+        """Reload the snapshot now; readers keep the current one until the swap"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await self._load()
+
+    async def _load(self):
+        rows = await db.get_catalog_products()
+        popularity = await db.get_product_popularity()
+
+        products = {row.id: row for row in rows}
+        ranked_ids = sorted(products, key=lambda pid: (-popularity.get(pid, 0), pid))
+
+        tokens: Dict[int, Tuple[str, ...]] = {}
+        prefix_index: Dict[str, Set[int]] = {}
+        for product_id, product in products.items():
+            product_tokens = tuple(set(tokenize(
+                f"{product.name_uz} {product.name_ru}", limit=32
+            )))
+            tokens[product_id] = product_tokens
+            for token in product_tokens:
+                for length in INDEX_PREFIX_LENGTHS:
+                    if len(token) >= length:
+                        prefix_index.setdefault(token[:length], set()).add(product_id)
+
+        # Swap everything at once so concurrent readers never see a partial index
+        self.products = products
+        self._ranked_ids = ranked_ids
+        self._rank = {pid: position for position, pid in enumerate(ranked_ids)}
+        self._tokens = tokens
+        self._prefix_index = prefix_index
+        self._results.clear()
+        self.version += 1
+        self._loaded_at = time.monotonic()
+
+    @staticmethod
+    def _query_tokens(query: str) -> List[str]:
+        return [t for t in tokenize(query) if len(t) >= MIN_QUERY_LENGTH]
+
+    def cached_result(self, query: str) -> Optional[List[int]]:
+        """Get memoized product ids for a query without computing them"""
+        key = ' '.join(self._query_tokens(query))
+        result = self._results.get(key)
+        if result is not None:
+            self._results.move_to_end(key)
+        return result
+
+    def search(self, query: str) -> List[int]:
+        """Product ids matching all query token prefixes, most popular first"""
+        query_tokens = self._query_tokens(query)
+        key = ' '.join(query_tokens)
+
+        cached = self._results.get(key)
+        if cached is not None:
+            self._results.move_to_end(key)
+            return cached
+
+        if not query_tokens:
+            result = self._ranked_ids
+        else:
+            longest_prefix = max(INDEX_PREFIX_LENGTHS)
+            candidates: Optional[Set[int]] = None
+            # Most selective tokens first keeps intersections small
+            for token in sorted(query_tokens, key=len, reverse=True):
+                posting = self._prefix_index.get(token[:longest_prefix], set())
+                candidates = posting if candidates is None else candidates & posting
+                if not candidates:
+                    break
+            long_tokens = [t for t in query_tokens if len(t) > longest_prefix]
+            matched = [
+                pid for pid in (candidates or ())
+                if all(any(word.startswith(t) for word in self._tokens[pid]) for t in long_tokens)
+            ]
+            rank = self._rank
+            result = sorted(matched, key=rank.__getitem__)
+
+        self._results[key] = result
+        if len(self._results) > self.max_cached_queries:
+            self._results.popitem(last=False)
+        return result
+
+
+# Global catalog cache instance
+catalog_cache = CatalogCache()
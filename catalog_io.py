@@ -0,0 +1,207 @@
+"""Catalog import and export as CSV or XLSX documents.
+
+An uploaded file is read row by row in a worker thread, so a large menu
+neither blocks the event loop nor sits in memory twice. Every row is
+validated before anything is written: a file with errors is rejected as a
+whole with a list of the offending lines, and so is a file that cannot be
+read (a corrupt XLSX, a CSV in the wrong encoding). A valid file is applied
+by ``Database.upsert_products`` in one transaction, keyed by the ``sku``
+column, and the catalog cache is invalidated once afterwards. A SKU that
+clashes with an existing product rolls the whole import back.
+
+Export writes the same columns, so an exported file can be edited and
+uploaded back. XLSX needs the optional ``openpyxl`` package.
+"""
+import asyncio
+import csv
+import os
+import tempfile
+import zipfile
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from database.backends import INTEGRITY_ERRORS
+from database.models import db
+from utils.catalog_cache import catalog_cache
+
+try:
+    import openpyxl
+    from openpyxl.utils.exceptions import InvalidFileException
+    OPENPYXL_AVAILABLE = True
+except ImportError:
+    OPENPYXL_AVAILABLE = False
+
+# Raised while reading a damaged or mislabelled file (UnicodeDecodeError is
+# a ValueError; openpyxl raises KeyError for missing workbook parts)
+READ_ERRORS: Tuple[type, ...] = (OSError, ValueError, KeyError, csv.Error, zipfile.BadZipFile)
+if OPENPYXL_AVAILABLE:
+    READ_ERRORS += (InvalidFileException,)
+
+COLUMNS = (
+    'sku', 'category_uz', 'category_ru', 'name_uz', 'name_ru', 'description_uz',
+    'description_ru', 'price', 'image_url', 'is_available', 'stock',
+)
+REQUIRED_COLUMNS = ('sku', 'category_uz', 'name_uz', 'name_ru', 'price')
+MAX_ROWS = 20000
+# Errors listed back to the admin; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+EXPORT_CHUNK_SIZE = 500
+
+_TRUE = {'1', 'true', 'yes', 'да', 'ha', '+'}
+_FALSE = {'0', 'false', 'no', 'нет', "yo'q", '-'}
+
+
+class CatalogImportError(Exception):
+    """The file cannot be imported; ``errors`` lists the reasons"""
+
+    def __init__(self, errors: List[str], total: Optional[int] = None):
+        super().__init__(f"{total or len(errors)} errors")
+        self.errors = errors[:MAX_REPORTED_ERRORS]
+        self.total = total or len(errors)
+
+
+def supported_formats() -> Tuple[str, ...]:
+    return ('csv', 'xlsx') if OPENPYXL_AVAILABLE else ('csv',)
+
+
+def _csv_rows(path: str) -> Iterator[Sequence]:
+    # utf-8-sig strips the byte order mark Excel puts in front of CSV files
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        sample = file.read(4096)
+        file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        yield from csv.reader(file, dialect)
+
+
+def _xlsx_rows(path: str) -> Iterator[Sequence]:
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        # Spreadsheets store whole numbers such as prices as floats
+        value = int(value)
+    return str(value).strip()
+
+
+def _parse_row(values: Dict[str, str]) -> Tuple[Optional[Dict], Optional[str]]:
+    """Validated product fields, or the reason the row is invalid"""
+    missing = [column for column in REQUIRED_COLUMNS if not values.get(column)]
+    if missing:
+        return None, f"не заполнено: {', '.join(missing)}"
+
+    price = values['price'].replace(' ', '')
+    if not price.isdigit() or int(price) <= 0:
+        return None, f"неверная цена «{values['price']}»"
+
+    stock = values.get('stock', '')
+    if stock and not stock.isdigit():
+        return None, f"неверный остаток «{stock}»"
+
+    available = values.get('is_available', '').lower()
+    if available and available not in _TRUE | _FALSE:
+        return None, f"неверное значение is_available «{values['is_available']}»"
+
+    product = {column: values.get(column) or None for column in COLUMNS}
+    product['category_ru'] = product['category_ru'] or product['category_uz']
+    product['price'] = int(price)
+    product['stock'] = int(stock) if stock else None
+    product['is_available'] = int(
+        available not in _FALSE and (product['stock'] is None or product['stock'] > 0)
+    )
+    return product, None
+
+
+def parse_catalog(path: str) -> List[Dict]:
+    """Read and validate a CSV or XLSX catalog; raises CatalogImportError"""
+    if path.lower().endswith('.xlsx'):
+        if not OPENPYXL_AVAILABLE:
+            raise CatalogImportError(["XLSX не поддерживается: установите openpyxl или загрузите CSV"])
+        rows = _xlsx_rows(path)
+    else:
+        rows = _csv_rows(path)
+    try:
+        return _parse_rows(rows)
+    except READ_ERRORS as e:
+        raise CatalogImportError([f"файл повреждён или не читается: {e}"])
+
+
+def _parse_rows(rows: Iterator[Sequence]) -> List[Dict]:
+    header = [_cell(value).lower() for value in next(rows, ())]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise CatalogImportError([f"нет столбцов: {', '.join(missing)}"])
+    positions = [(column, header.index(column)) for column in COLUMNS if column in header]
+
+    products: List[Dict] = []
+    errors: List[str] = []
+    seen: Dict[str, int] = {}
+    for line, row in enumerate(rows, start=2):
+        values = {column: _cell(row[index]) if index < len(row) else ''
+                  for column, index in positions}
+        if not any(values.values()):
+            continue
+        if len(products) + len(errors) >= MAX_ROWS:
+            errors.append(f"больше {MAX_ROWS} строк")
+            break
+
+        product, error = _parse_row(values)
+        if error is None and product['sku'] in seen:
+            error = f"SKU {product['sku']} повторяет строку {seen[product['sku']]}"
+        if error is not None:
+            errors.append(f"строка {line}: {error}")
+            continue
+        seen[product['sku']] = line
+        products.append(product)
+
+    if errors:
+        raise CatalogImportError(errors)
+    if not products:
+        raise CatalogImportError(["файл не содержит товаров"])
+    return products
+
+
+async def import_catalog(path: str) -> Tuple[int, int]:
+    """Import a catalog file; returns (created, updated) product counts"""
+    products = await asyncio.to_thread(parse_catalog, path)
+    try:
+        created, updated = await db.upsert_products(products)
+    except INTEGRITY_ERRORS as e:
+        # Products added without a SKU get 'P<id>', which a file may already use
+        raise CatalogImportError([f"SKU совпадает с кодом существующего товара: {e}"])
+    catalog_cache.invalidate()
+    return created, updated
+
+
+async def export_catalog(fmt: str = 'csv') -> str:
+    """Write the whole catalog to a temporary file and return its path;
+    the caller removes it"""
+    if fmt not in supported_formats():
+        raise ValueError(f"Unsupported export format: {fmt}")
+    handle, path = tempfile.mkstemp(prefix='arzon-catalog-', suffix=f'.{fmt}')
+    os.close(handle)
+
+    if fmt == 'csv':
+        with open(path, 'w', newline='', encoding='utf-8-sig') as file:
+            writer = csv.writer(file)
+            writer.writerow(COLUMNS)
+            async for chunk in db.iter_catalog(EXPORT_CHUNK_SIZE):
+                writer.writerows(chunk)
+        return path
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('catalog')
+    sheet.append(COLUMNS)
+    async for chunk in db.iter_catalog(EXPORT_CHUNK_SIZE):
+        for row in chunk:
+            sheet.append(row)
+    await asyncio.to_thread(workbook.save, path)
+    return path
@@ -0,0 +1,67 @@
+from aiogram import Router, F
+from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command, StateFilter
+
+from database.models import db
+from localization.texts import get_text
+from utils import order_lifecycle
+from utils.dispatch import dispatch_engine
+
+router = Router()
+
+@router.message(Command("shift_on"))
+async def shift_on(message: Message):
+    """Start courier shift"""
+    user = await db.get_user(message.from_user.id)
+    if not user:
+        return
+
+    lang = user.lang
+    if user.role != 'courier':
+        await message.answer(get_text('courier_not_registered', lang))
+        return
+
+    dispatch_engine.go_online(message.from_user.id)
+    await message.answer(get_text('courier_shift_on', lang))
+
+@router.message(Command("shift_off"))
+async def shift_off(message: Message):
+    """End courier shift"""
+    user = await db.get_user(message.from_user.id)
+    if not user:
+        return
+
+    dispatch_engine.go_offline(message.from_user.id)
+    await message.answer(get_text('courier_shift_off', user.lang))
+
+@router.message(StateFilter(None), F.location)
+async def courier_location(message: Message):
+    """Courier shared a location (first message of a live location)"""
+    dispatch_engine.update_position(
+        message.from_user.id, message.location.latitude, message.location.longitude
+    )
+
+@router.edited_message(F.location)
+async def courier_live_location(message: Message):
+    """Live location updates arrive as edits of the original message"""
+    dispatch_engine.update_position(
+        message.from_user.id, message.location.latitude, message.location.longitude
+    )
+
+@router.callback_query(F.data.startswith("delivered_"))
+async def order_delivered(callback: CallbackQuery):
+    """Courier marks order as delivered"""
+    order_id = int(callback.data.split("_")[1])
+    order = await db.get_order(order_id)
+    if not order or order['courier_id'] != callback.from_user.id:
+        await callback.answer()
+        return
+
+    user = await db.get_user(callback.from_user.id)
+    lang = user.lang if user else 'uz'
+
+    await order_lifecycle.transition([order_id], 'completed', actor_id=callback.from_user.id)
+    dispatch_engine.release(callback.from_user.id, order_id)
+
+    await callback.message.edit_text(get_text('courier_order_delivered', lang).format(order_id))
+    await callback.answer()
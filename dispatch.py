@@ -0,0 +1,139 @@
+"""Courier dispatch: spatial index of courier positions and order assignment.
+
+Couriers share Telegram live locations; every update moves them in a grid
+index of roughly 1 km cells. Each dispatch tick takes orders that reached
+'ready' without a courier, batches nearby ones into multi-stop routes for
+the closest free couriers (see ``utils.routing``) and writes all
+assignments at once.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiogram import Bot
+
+from database.models import db
+from utils import order_lifecycle
+from utils.geo import GridIndex
+from utils.metrics import metrics
+from utils.routing import Route, plan_routes
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_INTERVAL = 5.0
+
+
+class DispatchEngine:
+    def __init__(self):
+        self.index = GridIndex()
+        # Couriers who started a shift; location updates from others are ignored
+        self.on_shift: Set[int] = set()
+        # courier_id -> order ids on the courier's current route
+        self.busy: Dict[int, Set[int]] = {}
+        self.bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def go_online(self, courier_id: int):
+        self.on_shift.add(courier_id)
+
+    def go_offline(self, courier_id: int):
+        self.on_shift.discard(courier_id)
+        self.index.remove(courier_id)
+
+    def update_position(self, courier_id: int, lat: float, lon: float) -> bool:
+        """Record courier position from a (live) location message"""
+        if courier_id not in self.on_shift:
+            return False
+        if courier_id not in self.busy:
+            self.index.update(courier_id, lat, lon)
+        return True
+
+    def release(self, courier_id: int, order_id: int):
+        """Courier delivered an order; free again after the last stop"""
+        orders = self.busy.get(courier_id)
+        if orders is None:
+            return
+        orders.discard(order_id)
+        if not orders:
+            del self.busy[courier_id]
+
+    def plan(self, orders: List[Tuple[int, float, float]]) -> List[Route]:
+        """Multi-stop routes for (order_id, lat, lon) in queue order"""
+        return plan_routes(orders, self.index)
+
+    async def tick(self) -> int:
+        """Assign routes to free couriers; returns number of assigned orders"""
+        if not len(self.index):
+            return 0
+        with metrics.timer('dispatch', 'tick'):
+            orders = await db.get_dispatchable_orders()
+            routes = self.plan(orders)
+            if not routes:
+                return 0
+            assigned = await db.assign_couriers(
+                [(route.courier_id, order_id) for route in routes for order_id in route.order_ids]
+            )
+
+        if assigned:
+            await order_lifecycle.transition(list(assigned), 'delivering')
+
+        for route in routes:
+            # Orders taken by someone else in the meantime drop out of the route
+            stops = [stop for stop in route.stops if stop[0] in assigned]
+            if not stops:
+                continue
+            self.index.remove(route.courier_id)
+            self.busy[route.courier_id] = {order_id for order_id, _, _ in stops}
+            if self.bot:
+                for number, (order_id, leg_km, eta) in enumerate(stops, start=1):
+                    await self._notify_courier(
+                        route.courier_id, order_id, number, len(stops), leg_km, eta
+                    )
+        metrics.incr('dispatch_assignments', len(assigned))
+        return len(assigned)
+
+    async def _notify_courier(self, courier_id: int, order_id: int, number: int,
+                              stops: int, distance: float, eta: float):
+        # Imported here: keyboards pull in localization, not needed for planning
+        from keyboards.keyboards import get_courier_order_keyboard
+        from localization.texts import get_text
+
+        order = await db.get_order(order_id)
+        courier = await db.get_user(courier_id)
+        if not order or not courier:
+            return
+        lang = courier.lang
+        text = get_text('courier_new_order', lang).format(
+            order['id'], number, stops, order['delivery_address'], order['phone'],
+            f"{order['total_amount']:,}", f"{distance:.1f}", round(eta)
+        )
+        try:
+            await self.bot.send_message(
+                courier_id, text,
+                reply_markup=get_courier_order_keyboard(order, lang)
+            )
+        except Exception as e:
+            logger.error(f"Failed to notify courier {courier_id} about order {order_id}: {e}")
+
+    def start(self, bot: Bot, interval: float = DISPATCH_INTERVAL):
+        """Run dispatch ticks in the background"""
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, interval: float):
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                logger.error(f"Dispatch tick failed: {e}")
+            await asyncio.sleep(interval)
+
+
+# Global dispatch engine instance
+dispatch_engine = DispatchEngine()
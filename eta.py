@@ -0,0 +1,218 @@
+"""Delivery ETA estimates learned from completed orders.
+
+An order's delivery time in minutes is modelled as a linear function of
+the kitchen queue depth, the distance from the store and the typical
+delivery time of the slowest product category in the basket:
+
+    minutes = w0 + w1 * queue + w2 * distance_km + w3 * category_minutes
+
+Weights are fitted by recursive least squares, first on recent history at
+startup and then on every completed order, with a forgetting factor so the
+model follows changes in kitchen and traffic conditions. The features of
+an order are kept from checkout until ``order_lifecycle.transition``
+completes or cancels it. Predictions are
+memoized per delivery zone and reset whenever the weights change.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+from database.models import db
+from utils.geo import haversine_km
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ETA_MINUTES = 30.0
+MIN_ETA_MINUTES = 15.0
+MAX_ETA_MINUTES = 180.0
+# Completed orders needed before the model replaces the default
+MIN_SAMPLES = 20
+# Weight of older observations decays by this factor per new one
+FORGETTING_FACTOR = 0.999
+# Zone size in degrees (~2 km), granularity of the prediction cache
+ZONE_SIZE = 0.02
+# Seconds a counted queue depth is reused
+QUEUE_TTL = 15.0
+HISTORY_DAYS = 14
+HISTORY_LIMIT = 20000
+# Orders awaiting completion whose features are kept; older ones are dropped
+PENDING_LIMIT = 10000
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+Features = Tuple[float, float, float, float]
+
+
+class OnlineRegression:
+    """Recursive least squares with exponential forgetting"""
+
+    def __init__(self, size: int, forgetting: float = FORGETTING_FACTOR, prior: float = 1000.0):
+        self.size = size
+        self.forgetting = forgetting
+        self.weights = [0.0] * size
+        self.covariance = [[prior if i == j else 0.0 for j in range(size)] for i in range(size)]
+        self.samples = 0
+
+    def predict(self, x: Iterable[float]) -> float:
+        return sum(w * v for w, v in zip(self.weights, x))
+
+    def update(self, x: List[float], y: float):
+        P = self.covariance
+        n = self.size
+        px = [sum(P[i][j] * x[j] for j in range(n)) for i in range(n)]
+        denominator = self.forgetting + sum(x[i] * px[i] for i in range(n))
+        gain = [v / denominator for v in px]
+        error = y - self.predict(x)
+        self.weights = [w + g * error for w, g in zip(self.weights, gain)]
+        self.covariance = [
+            [(P[i][j] - gain[i] * px[j]) / self.forgetting for j in range(n)]
+            for i in range(n)
+        ]
+        self.samples += 1
+
+
+def _minutes_between(start: str, end: str) -> float:
+    return (datetime.strptime(end, TIMESTAMP_FORMAT)
+            - datetime.strptime(start, TIMESTAMP_FORMAT)).total_seconds() / 60
+
+
+class EtaModel:
+    def __init__(self):
+        self.model = OnlineRegression(4)
+        # category_id -> (mean delivery minutes, completed orders seen)
+        self.category_minutes: Dict[int, Tuple[float, int]] = {}
+        self.default_category_minutes = DEFAULT_ETA_MINUTES
+        # order_id -> features and unix time at checkout, consumed when the
+        # order completes or is cancelled
+        self._pending: Dict[int, Tuple[Features, Tuple[int, ...], float]] = {}
+        self._zone_cache: Dict[Tuple[int, int, int, int], float] = {}
+        self._queue_depth = 0
+        self._queue_counted_at = 0.0
+
+    @staticmethod
+    def distance_km(latitude: Optional[float], longitude: Optional[float]) -> Optional[float]:
+        if latitude is None or longitude is None:
+            return None
+        return haversine_km(Config.STORE_LATITUDE, Config.STORE_LONGITUDE, latitude, longitude)
+
+    def _category_feature(self, category_ids: Iterable[int]) -> float:
+        """Typical delivery time of the slowest category in the basket"""
+        known = [self.category_minutes[c][0] for c in category_ids if c in self.category_minutes]
+        return max(known) if known else self.default_category_minutes
+
+    async def queue_depth(self) -> int:
+        """Orders waiting in the kitchen, counted at most every QUEUE_TTL seconds"""
+        if time.monotonic() - self._queue_counted_at > QUEUE_TTL:
+            self._queue_depth = await db.get_queue_depth()
+            self._queue_counted_at = time.monotonic()
+        return self._queue_depth
+
+    def predict(self, queue: int, latitude: Optional[float], longitude: Optional[float],
+                category_ids: Iterable[int]) -> Tuple[float, Features]:
+        """ETA in minutes and the features it was computed from"""
+        distance = self.distance_km(latitude, longitude)
+        if distance is None:
+            # No location shared: assume the average distance of a city delivery
+            distance = 5.0
+            zone = (0, 0)
+        else:
+            zone = (int(latitude // ZONE_SIZE), int(longitude // ZONE_SIZE))
+        category = self._category_feature(category_ids)
+        features = (1.0, float(queue), distance, category)
+
+        key = (*zone, queue, int(category))
+        minutes = self._zone_cache.get(key)
+        if minutes is None:
+            if self.model.samples < MIN_SAMPLES:
+                minutes = DEFAULT_ETA_MINUTES
+            else:
+                minutes = min(MAX_ETA_MINUTES, max(MIN_ETA_MINUTES, self.model.predict(features)))
+            self._zone_cache[key] = minutes
+        return minutes, features
+
+    async def estimate(self, order_id: int, latitude: Optional[float],
+                       longitude: Optional[float], category_ids: Iterable[int]) -> float:
+        """ETA in minutes for a new order; remembers its features for learning"""
+        category_ids = tuple(set(category_ids))
+        queue = await self.queue_depth()
+        minutes, features = self.predict(queue, latitude, longitude, category_ids)
+        if len(self._pending) >= PENDING_LIMIT:
+            # Oldest first: orders left unfinished for a long time
+            del self._pending[next(iter(self._pending))]
+        self._pending[order_id] = (features, category_ids, time.time())
+        # The new order joins the queue before the next recount
+        self._queue_depth += 1
+        return minutes
+
+    def observe(self, order_ids: Iterable[int]):
+        """Learn from orders completed just now that were placed since startup"""
+        now = time.time()
+        for order_id in order_ids:
+            pending = self._pending.pop(order_id, None)
+            if pending is None:
+                continue
+            features, category_ids, placed_at = pending
+            minutes = (now - placed_at) / 60
+            if minutes > 0:
+                self._learn(features, category_ids, minutes)
+
+    def forget(self, order_ids: Iterable[int]):
+        """Drop the features of cancelled orders"""
+        for order_id in order_ids:
+            self._pending.pop(order_id, None)
+
+    def _learn(self, features: Features, category_ids: Iterable[int], minutes: float):
+        self.model.update(list(features), minutes)
+        self._update_categories(category_ids, minutes)
+        self._zone_cache.clear()
+
+    def _update_categories(self, category_ids: Iterable[int], minutes: float):
+        for category_id in category_ids:
+            mean, count = self.category_minutes.get(category_id, (minutes, 0))
+            count += 1
+            self.category_minutes[category_id] = (mean + (minutes - mean) / count, count)
+
+    def describe(self) -> str:
+        """Current weights in human readable form"""
+        w = self.model.weights
+        return (f"{w[0]:.1f} + {w[1]:.2f}·queue + {w[2]:.2f}·km + {w[3]:.2f}·category "
+                f"(n={self.model.samples})")
+
+    async def load(self):
+        """Fit category averages and weights on recently completed orders"""
+        history = await db.get_delivery_history(HISTORY_DAYS, HISTORY_LIMIT)
+        if not history:
+            return
+
+        # Category averages come first: they are a feature of the regression
+        durations = {}
+        for order_id, created_at, completed_at, _, _, category_ids in history:
+            minutes = _minutes_between(created_at, completed_at)
+            if minutes <= 0:
+                continue
+            durations[order_id] = minutes
+            self._update_categories(category_ids, minutes)
+        if durations:
+            self.default_category_minutes = sum(durations.values()) / len(durations)
+
+        # Replay orders in time order, tracking how many were still in progress
+        in_progress: List[str] = []
+        for order_id, created_at, completed_at, latitude, longitude, category_ids in history:
+            minutes = durations.get(order_id)
+            if minutes is None:
+                continue
+            in_progress = [end for end in in_progress if end > created_at]
+            distance = self.distance_km(latitude, longitude)
+            features = (1.0, float(len(in_progress)),
+                        5.0 if distance is None else distance,
+                        self._category_feature(category_ids))
+            self.model.update(list(features), minutes)
+            in_progress.append(completed_at)
+        self._zone_cache.clear()
+        logger.info(f"ETA model fitted on {self.model.samples} completed orders")
+
+
+# Global ETA model instance
+eta_model = EtaModel()
@@ -0,0 +1,113 @@
+"""User events for funnel and retention reports.
+
+``EventTrackingMiddleware`` records an event for every message and callback
+query a handler completed: the handler's name, the user and the number at
+the end of the callback data (the product of ``product_12``). Emitting one
+appends a tuple to an in-memory ring buffer, with no I/O or formatting on
+the update's path. The first event after a flush starts a timer that writes
+the buffer ``interval`` seconds later in one transaction (COPY on
+PostgreSQL) to the append-only ``events`` table. If writes fall behind, the
+buffer drops its oldest events instead of growing.
+
+``Database.get_funnel`` and ``Database.get_retention`` read the table;
+admins see both with ``/funnel``.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+from config import Config
+from database.models import db
+
+logger = logging.getLogger(__name__)
+
+# From opening the catalog to choosing how to pay
+FUNNEL_STEPS = ('show_categories', 'show_product_detail', 'add_to_cart', 'payment_selected')
+
+# (unix time, user_id, handler name, object id)
+Event = Tuple[float, int, str, Optional[int]]
+
+
+class EventTracker:
+    def __init__(self, capacity: int = Config.EVENTS_BUFFER_SIZE,
+                 interval: float = Config.EVENTS_FLUSH_INTERVAL):
+        self.capacity = capacity
+        self.interval = interval
+        self._buffer: Deque[Event] = deque(maxlen=capacity)
+        self._flush_task: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.stored = 0
+
+    def emit(self, name: str, user_id: int, object_id: Optional[int] = None):
+        buffer = self._buffer
+        if len(buffer) == self.capacity:
+            self.dropped += 1
+        buffer.append((time.time(), user_id, name, object_id))
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.interval)
+        finally:
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Write buffered events now"""
+        if not self._buffer:
+            return
+        events = list(self._buffer)
+        self._buffer.clear()
+
+        # UTC like datetime('now'), but to the millisecond so a user's events
+        # sort in the order they happened; the date part is formatted once a second
+        seconds: Dict[int, str] = {}
+        rows: List[Tuple[str, int, str, Optional[int]]] = []
+        for at, user_id, name, object_id in events:
+            second = int(at)
+            stamp = seconds.get(second)
+            if stamp is None:
+                stamp = seconds[second] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(second))
+            rows.append((f'{stamp}.{int(at * 1000) % 1000:03d}', user_id, name, object_id))
+        try:
+            await db.add_events(rows)
+            self.stored += len(rows)
+        except Exception as e:
+            logger.error(f"Failed to store {len(rows)} events: {e}")
+
+    async def close(self):
+        """Write buffered events before shutdown"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+
+class EventTrackingMiddleware(BaseMiddleware):
+    """Inner middleware emitting an event per successfully handled update"""
+
+    def __init__(self, tracker: EventTracker):
+        self.tracker = tracker
+
+    async def __call__(self, handler, event, data):
+        result = await handler(event, data)
+        callback = getattr(data.get('handler'), 'callback', None)
+        user = event.from_user
+        if callback is not None and user is not None:
+            object_id = None
+            if isinstance(event, CallbackQuery) and event.data:
+                tail = event.data.rpartition('_')[2]
+                if tail.isdigit():
+                    object_id = int(tail)
+            self.tracker.emit(callback.__name__, user.id, object_id)
+        return result
+
+
+# Global event tracker instance
+event_tracker = EventTracker()
@@ -0,0 +1,179 @@
+"""Local stand-in for the Payme and Click merchant APIs.
+
+Answers invoice creation the way the real services do and, ``--pay-delay``
+seconds later, reports every invoice as paid to the bot's payment webhooks
+with valid credentials and signatures, in the order the real callbacks come
+(Payme: CheckPerformTransaction, CreateTransaction, PerformTransaction;
+Click: Prepare, Complete). Point the bot at it with
+
+    PAYME_API_URL=http://localhost:8090/payme/api
+    CLICK_API_URL=http://localhost:8090/click/v2/merchant
+
+and run
+
+    python fake_payment_provider.py --port 8090 --webhook http://localhost:8080
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import time
+import uuid
+from typing import Optional, Set
+
+import aiohttp
+from aiohttp import web
+
+from config import Config
+
+WEBHOOK_ATTEMPTS = 5
+# Seconds before a failed webhook is retried, times the attempt number
+RETRY_BACKOFF = 0.5
+
+
+class FakeProvider:
+    def __init__(self, webhook_url: str, latency: float = 0.0, pay_delay: float = 0.5,
+                 payme_key: str = '', click_secret: str = '', duplicate_webhooks: bool = True):
+        self.webhook_url = webhook_url.rstrip('/')
+        self.latency = latency
+        self.pay_delay = pay_delay
+        self.payme_key = payme_key
+        self.click_secret = click_secret
+        # Real providers retry webhooks; send each one twice to exercise idempotency
+        self.duplicate_webhooks = duplicate_webhooks
+        self.invoices = 0
+        self.webhooks_sent = 0
+        self.webhook_retries = 0
+        self._click_ids = itertools.count(1)
+        self._tasks: Set[asyncio.Task] = set()
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/payme/api', self.payme_api)
+        app.router.add_post('/click/v2/merchant/invoice/create', self.click_invoice)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    def _later(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _post(self, path: str, **kwargs) -> Optional[dict]:
+        """Deliver a webhook, retrying while the bot reports an error;
+        returns the last answer"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        body = None
+        for delivery in range(2 if self.duplicate_webhooks else 1):
+            for attempt in range(1, WEBHOOK_ATTEMPTS + 1):
+                async with self._session.post(f"{self.webhook_url}{path}", **kwargs) as response:
+                    body = await response.json(content_type=None) if response.status == 200 else None
+                self.webhooks_sent += 1
+                if body is not None and not body.get('error'):
+                    break
+                self.webhook_retries += 1
+                await asyncio.sleep(RETRY_BACKOFF * attempt)
+        return body
+
+    async def payme_api(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        await asyncio.sleep(self.latency)
+        if data.get('method') != 'receipts.create':
+            return web.json_response({'id': data.get('id'), 'error': {
+                'code': -32601, 'message': 'Method not found'
+            }})
+
+        receipt_id = uuid.uuid4().hex[:24]
+        self.invoices += 1
+        self._later(self._pay_payme(data['params']))
+        return web.json_response({'id': data.get('id'), 'result': {
+            'receipt': {'_id': receipt_id, 'state': 0, 'amount': data['params']['amount']}
+        }})
+
+    async def _pay_payme(self, receipt: dict):
+        """Merchant API sequence of a paid receipt: check the order, create
+        a transaction for it, then perform that transaction"""
+        await asyncio.sleep(self.pay_delay)
+        auth = base64.b64encode(f"Paycom:{self.payme_key}".encode()).decode()
+        headers = {'Authorization': f"Basic {auth}"}
+        order = {'amount': receipt['amount'], 'account': receipt['account']}
+        body = await self._post('/payments/payme', headers=headers, json={
+            'id': 1, 'method': 'CheckPerformTransaction', 'params': order
+        })
+        if not body or 'error' in body:
+            return
+
+        transaction_id = uuid.uuid4().hex[:24]
+        body = await self._post('/payments/payme', headers=headers, json={
+            'id': 2, 'method': 'CreateTransaction', 'params': {
+                'id': transaction_id, 'time': int(time.time() * 1000), **order
+            }
+        })
+        if not body or 'error' in body:
+            return
+        await self._post('/payments/payme', headers=headers, json={
+            'id': 3, 'method': 'PerformTransaction', 'params': {'id': transaction_id}
+        })
+
+    async def click_invoice(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        await asyncio.sleep(self.latency)
+        invoice_id = next(self._click_ids)
+        self.invoices += 1
+        self._later(self._pay_click(data))
+        return web.json_response({'error_code': 0, 'error_note': 'Success', 'invoice_id': invoice_id})
+
+    def _click_form(self, data: dict, action: int) -> dict:
+        form = {
+            'click_trans_id': str(1_000_000 + int(data['merchant_trans_id'])),
+            'service_id': str(data['service_id']),
+            'click_paydoc_id': '1',
+            'merchant_trans_id': str(data['merchant_trans_id']),
+            'amount': str(data['amount']),
+            'action': str(action),
+            'error': '0',
+            'error_note': 'Success',
+            'sign_time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        prepare_id = ''
+        if action == 1:
+            form['merchant_prepare_id'] = prepare_id = form['merchant_trans_id']
+        raw = (f"{form['click_trans_id']}{form['service_id']}{self.click_secret}"
+               f"{form['merchant_trans_id']}{prepare_id}{form['amount']}"
+               f"{form['action']}{form['sign_time']}")
+        form['sign_string'] = hashlib.md5(raw.encode()).hexdigest()
+        return form
+
+    async def _pay_click(self, data: dict):
+        await asyncio.sleep(self.pay_delay)
+        await self._post('/payments/click', data=self._click_form(data, 0))
+        await self._post('/payments/click', data=self._click_form(data, 1))
+
+    async def _cleanup(self, app: web.Application):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._session:
+            await self._session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--webhook', default='http://localhost:8080',
+                        help='base URL of the bot web server')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds before answering invoice creation')
+    parser.add_argument('--pay-delay', type=float, default=0.5,
+                        help='seconds between invoice and payment webhook')
+    args = parser.parse_args()
+
+    provider = FakeProvider(args.webhook, args.latency, args.pay_delay,
+                            Config.PAYME_KEY or '', Config.CLICK_SECRET_KEY or '')
+    web.run_app(provider.create_app(), port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,383 @@
+"""Synthetic dataset generator for scaling tests.
+
+Fills an Arzon database (a SQLite file or a PostgreSQL URL, loaded with
+COPY) with users, products, orders and order items up to the requested totals. Product popularity follows a Zipf distribution
+and order times follow lunch/dinner peaks, so aggregate queries see
+realistic skew. Output is deterministic for a given seed and starting state,
+and running again with bigger totals tops the database up incrementally:
+
+    python generate_data.py --db bench.db --users 1000000 --orders 3000000
+    python generate_data.py --db bench.db --users 1500000 --orders 5000000
+    python generate_data.py --db postgresql://localhost/arzon --users 1000000
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from config import Config
+from database.backends import create_backend
+from database.models import Database
+from utils.geo import haversine_km
+from utils.translit import normalize
+
+logger = logging.getLogger(__name__)
+
+# Rows per executemany or COPY batch / transaction
+CHUNK_SIZE = 100_000
+
+FIRST_TELEGRAM_ID = 1_000_000_000
+
+# Relative order volume per hour of day (Tashkent time)
+HOURLY_WEIGHTS = [
+    1, 1, 0.5, 0.3, 0.3, 0.5, 1, 2,      # 00-07
+    3, 4, 5, 8, 14, 15, 10, 6,           # 08-15
+    5, 6, 10, 14, 15, 12, 7, 3,          # 16-23
+]
+
+DISHES = [
+    ("Плов", "Плов"), ("Лагман", "Лагман"), ("Шашлик", "Шашлык"),
+    ("Манты", "Манты"), ("Самса", "Самса"), ("Шўрва", "Шурпа"),
+    ("Чучвара", "Чучвара"), ("Норин", "Нарын"), ("Димлама", "Димлама"),
+    ("Қозон кабоб", "Казан кабоб"), ("Чой", "Чай"), ("Кофе", "Кофе"),
+    ("Шарбат", "Шербет"), ("Компот", "Компот"), ("Торт", "Торт"),
+    ("Пахлава", "Пахлава"), ("Олма", "Яблоки"), ("Узум", "Виноград"),
+    ("Помидор", "Помидоры"), ("Бодринг", "Огурцы"), ("Нон", "Лепёшка"),
+    ("Салат", "Салат"), ("Гўшт", "Мясо"), ("Товуқ", "Курица"),
+]
+
+MODIFIERS = [
+    ("", ""), ("Катта", "Большой"), ("Кичик", "Маленький"),
+    ("Аччиқ", "Острый"), ("Уйча", "Домашний"), ("Тошкентча", "Ташкентский"),
+    ("Самарқандча", "Самаркандский"), ("Янги", "Свежий"), ("Махсус", "Особый"),
+]
+
+
+def _rng(seed: int, table: str, start: int) -> random.Random:
+    """Independent RNG stream per table and starting row count"""
+    return random.Random(f"{seed}:{table}:{start}")
+
+
+def _zipf_cum_weights(count: int, exponent: float) -> List[float]:
+    return list(itertools.accumulate(1.0 / (rank ** exponent) for rank in range(1, count + 1)))
+
+
+# One batch of rows: (table, columns, rows)
+Batch = Tuple[str, Sequence[str], List[Tuple]]
+
+
+class SqliteLoader:
+    """Loads rows into a SQLite file with executemany"""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        # Product inserts fire the search index triggers
+        self.conn.create_function('translit', 1, normalize, deterministic=True)
+        # Bulk-load settings: the data is regenerable, durability is not needed
+        self.conn.execute('PRAGMA synchronous = OFF')
+        self.conn.execute('PRAGMA journal_mode = MEMORY')
+        self.conn.execute('PRAGMA temp_store = MEMORY')
+        self.conn.execute('PRAGMA cache_size = -262144')
+
+    def query(self, sql: str) -> List[Tuple]:
+        return self.conn.execute(sql).fetchall()
+
+    def insert(self, *batches: Batch):
+        """Insert the batches in one transaction"""
+        self.conn.execute('BEGIN')
+        for table, columns, rows in batches:
+            marks = ', '.join('?' * len(columns))
+            self.conn.executemany(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({marks})", rows
+            )
+        self.conn.execute('COMMIT')
+
+    def finish(self):
+        self.conn.execute('ANALYZE')
+        # Bulk loading left rollback journaling on; the bot runs in WAL mode
+        self.conn.execute('PRAGMA journal_mode = WAL')
+
+    def close(self):
+        self.conn.close()
+
+
+class PostgresLoader:
+    """Loads rows into PostgreSQL with COPY, on a private event loop so the
+    generator stays synchronous"""
+
+    def __init__(self, dsn: str):
+        import asyncpg
+        self.loop = asyncio.new_event_loop()
+        self.conn = self.loop.run_until_complete(asyncpg.connect(dsn))
+
+    def query(self, sql: str) -> List[Tuple]:
+        return [tuple(row) for row in self.loop.run_until_complete(self.conn.fetch(sql))]
+
+    def insert(self, *batches: Batch):
+        """Insert the batches in one transaction"""
+        async def copy():
+            async with self.conn.transaction():
+                for table, columns, rows in batches:
+                    await self.conn.copy_records_to_table(table, records=rows, columns=columns)
+        self.loop.run_until_complete(copy())
+
+    def finish(self):
+        # Orders are copied with their ids: move the id sequence past them
+        self.loop.run_until_complete(self.conn.execute(
+            "SELECT setval(pg_get_serial_sequence('orders', 'id'), MAX(id)) FROM orders"
+        ))
+        self.loop.run_until_complete(self.conn.execute('ANALYZE'))
+
+    def close(self):
+        self.loop.run_until_complete(self.conn.close())
+        self.loop.close()
+
+
+Loader = Union[SqliteLoader, PostgresLoader]
+
+
+def _count(loader: Loader, table: str) -> int:
+    return loader.query(f'SELECT COUNT(*) FROM {table}')[0][0]
+
+
+def _max_id(loader: Loader, table: str, column: str = 'id') -> int:
+    return loader.query(f'SELECT COALESCE(MAX({column}), 0) FROM {table}')[0][0]
+
+
+def _insert_chunks(loader: Loader, table: str, columns: Sequence[str], rows) -> int:
+    """Insert in CHUNK_SIZE transactions; returns inserted row count"""
+    total = 0
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_SIZE))
+        if not chunk:
+            return total
+        loader.insert((table, columns, chunk))
+        total += len(chunk)
+
+
+def generate_categories(loader: Loader, target: int) -> int:
+    start = _count(loader, 'categories')
+    if start >= target:
+        return 0
+    rows = (
+        (f"Бўлим {n}", f"Раздел {n}", None, None, None)
+        for n in range(start + 1, target + 1)
+    )
+    return _insert_chunks(loader, 'categories', (
+        'name_uz', 'name_ru', 'description_uz', 'description_ru', 'image_url'
+    ), rows)
+
+
+def generate_products(loader: Loader, target: int, seed: int) -> int:
+    start = _count(loader, 'products')
+    if start >= target:
+        return 0
+    rng = _rng(seed, 'products', start)
+    category_ids = [row[0] for row in loader.query('SELECT id FROM categories')]
+
+    def rows():
+        for n in range(start + 1, target + 1):
+            dish_uz, dish_ru = rng.choice(DISHES)
+            mod_uz, mod_ru = rng.choice(MODIFIERS)
+            name_uz = f"{mod_uz} {dish_uz}".strip()
+            name_ru = f"{mod_ru} {dish_ru}".strip()
+            yield (
+                rng.choice(category_ids), f"{name_uz} №{n}", f"{name_ru} №{n}",
+                f"{name_uz} — уйда тайёрланган", f"{name_ru} — домашнего приготовления",
+                rng.randrange(2, 120) * 1000, None
+            )
+
+    return _insert_chunks(loader, 'products', (
+        'category_id', 'name_uz', 'name_ru', 'description_uz', 'description_ru', 'price',
+        'image_url'
+    ), rows())
+
+
+def generate_users(loader: Loader, target: int, seed: int,
+                   start_date: datetime, days: int) -> int:
+    start = _count(loader, 'users')
+    if start >= target:
+        return 0
+    rng = _rng(seed, 'users', start)
+    first_id = max(FIRST_TELEGRAM_ID, _max_id(loader, 'users', 'telegram_id') + 1)
+    span = days * 86400
+
+    def rows():
+        for offset in range(target - start):
+            telegram_id = first_id + offset
+            created = start_date + timedelta(seconds=int(span * rng.random() ** 0.7))
+            yield (
+                telegram_id, f"user{telegram_id}", f"User{telegram_id % 100000}",
+                rng.choice(('uz', 'uz', 'ru')), f"G{telegram_id:X}",
+                f"+99890{telegram_id % 10000000:07d}", "Тошкент",
+                created.strftime('%Y-%m-%d %H:%M:%S')
+            )
+
+    return _insert_chunks(loader, 'users', (
+        'telegram_id', 'username', 'first_name', 'language_code', 'referral_code', 'phone',
+        'address', 'created_at'
+    ), rows())
+
+
+def generate_orders(loader: Loader, target: int, seed: int,
+                    start_date: datetime, days: int, zipf_exponent: float) -> Tuple[int, int]:
+    """Generate orders with their items; returns (orders, items) inserted"""
+    start = _count(loader, 'orders')
+    if start >= target:
+        return 0, 0
+    rng = _rng(seed, 'orders', start)
+
+    user_ids = [row[0] for row in loader.query('SELECT telegram_id FROM users')]
+    products = loader.query('SELECT id, price FROM products WHERE is_available = 1')
+    if not user_ids or not products:
+        raise ValueError("users and products must exist before generating orders")
+
+    # Popularity rank is a seeded shuffle so top sellers are spread across categories
+    ranked = products[:]
+    _rng(seed, 'popularity', 0).shuffle(ranked)
+    product_weights = _zipf_cum_weights(len(ranked), zipf_exponent)
+    # Customer activity is skewed too: a few regulars place many orders
+    user_weights = _zipf_cum_weights(len(user_ids), 0.6)
+    hours = list(range(24))
+    hour_weights = list(itertools.accumulate(HOURLY_WEIGHTS))
+    statuses = ['completed'] * 17 + ['cancelled', 'delivering', 'new']
+    methods = ['cash', 'cash', 'payme', 'click', 'uzcard']
+
+    order_id = _max_id(loader, 'orders') + 1
+    inserted_orders = inserted_items = 0
+    remaining = target - start
+
+    while remaining:
+        batch = min(CHUNK_SIZE, remaining)
+        orders, items, events = [], [], []
+        users = rng.choices(user_ids, cum_weights=user_weights, k=batch)
+        order_hours = rng.choices(hours, cum_weights=hour_weights, k=batch)
+        for user_id, hour in zip(users, order_hours):
+            created = start_date + timedelta(
+                days=rng.randrange(days), hours=hour, seconds=rng.randrange(3600)
+            )
+            lines = rng.choices(ranked, cum_weights=product_weights, k=rng.randint(1, 4))
+            total = 0
+            for product_id, price in lines:
+                quantity = rng.randint(1, 3)
+                total += price * quantity
+                items.append((order_id, product_id, quantity, price))
+            status = rng.choice(statuses)
+            method = rng.choice(methods)
+            latitude, longitude = 41.2 + rng.random() * 0.2, 69.15 + rng.random() * 0.25
+            updated = created
+            if status == 'completed':
+                # Preparation grows with basket size, travel with distance
+                distance = haversine_km(Config.STORE_LATITUDE, Config.STORE_LONGITUDE,
+                                        latitude, longitude)
+                updated += timedelta(minutes=12 + 3 * len(lines) + 3 * distance
+                                     + rng.expovariate(1 / 8))
+                # The ETA model reads delivery times from this event
+                events.append((order_id, 'delivering', 'completed',
+                               updated.strftime('%Y-%m-%d %H:%M:%S')))
+            orders.append((
+                order_id, user_id, total, "Тошкент", f"+99890{user_id % 10000000:07d}",
+                latitude, longitude,
+                method, 'completed' if status == 'completed' else 'pending',
+                status, created.strftime('%Y-%m-%d %H:%M:%S'),
+                updated.strftime('%Y-%m-%d %H:%M:%S')
+            ))
+            order_id += 1
+
+        loader.insert(
+            ('orders', ('id', 'user_id', 'total_amount', 'delivery_address', 'phone',
+                        'latitude', 'longitude', 'payment_method', 'payment_status',
+                        'order_status', 'created_at', 'updated_at'), orders),
+            ('order_items', ('order_id', 'product_id', 'quantity', 'price'), items),
+            ('order_events', ('order_id', 'from_status', 'to_status', 'created_at'), events),
+        )
+
+        inserted_orders += len(orders)
+        inserted_items += len(items)
+        remaining -= batch
+        logger.info("orders: %s/%s", start + inserted_orders, target)
+
+    return inserted_orders, inserted_items
+
+
+async def _init_schema(database: str):
+    storage = Database(database)
+    try:
+        await storage.init_db()
+    finally:
+        await storage.close()
+
+
+async def _rebuild_sales(database: str):
+    storage = Database(database)
+    try:
+        await storage.rebuild_sales_buckets()
+    finally:
+        await storage.close()
+
+
+def generate(database: str, users: int = 0, orders: int = 0, products: int = 0,
+             categories: int = 0, seed: int = 42, days: int = 180,
+             zipf_exponent: float = 1.1, end_date: Optional[datetime] = None) -> Dict[str, int]:
+    """Top the database (SQLite file or database URL) up to the requested
+    totals; returns rows inserted per table"""
+    asyncio.run(_init_schema(database))
+
+    # History ends at today's midnight so reruns on the same day are identical
+    end_date = end_date or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start_date = end_date - timedelta(days=days)
+
+    backend = create_backend(database)
+    loader = SqliteLoader(backend.path) if backend.name == 'sqlite' else PostgresLoader(backend.dsn)
+    try:
+        inserted = {
+            'categories': generate_categories(loader, categories),
+            'products': generate_products(loader, products, seed),
+            'users': generate_users(loader, users, seed, start_date, days),
+        }
+        inserted['orders'], inserted['order_items'] = generate_orders(
+            loader, orders, seed, start_date, days, zipf_exponent
+        ) if orders else (0, 0)
+        loader.finish()
+    finally:
+        loader.close()
+    # Orders are loaded without create_order, which keeps the sales buckets
+    if inserted['orders']:
+        asyncio.run(_rebuild_sales(database))
+    return inserted
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Arzon dataset")
+    parser.add_argument('--db', default='arzon_bot.db', help='SQLite file or database URL')
+    parser.add_argument('--users', type=int, default=0, help='target number of users')
+    parser.add_argument('--orders', type=int, default=0, help='target number of orders')
+    parser.add_argument('--products', type=int, default=0, help='target number of products')
+    parser.add_argument('--categories', type=int, default=0, help='target number of categories')
+    parser.add_argument('--days', type=int, default=180, help='order history length in days')
+    parser.add_argument('--zipf', type=float, default=1.1, help='product popularity exponent')
+    parser.add_argument('--end-date', help='last day of history, YYYY-MM-DD (default: today)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+    started = time.perf_counter()
+    inserted = generate(
+        args.db, users=args.users, orders=args.orders, products=args.products,
+        categories=max(args.categories, 1 if args.products else 0), seed=args.seed,
+        days=args.days, zipf_exponent=args.zipf,
+        end_date=datetime.strptime(args.end_date, '%Y-%m-%d') if args.end_date else None
+    )
+    elapsed = time.perf_counter() - started
+    for table, count in inserted.items():
+        print(f"{table:<12} +{count}")
+    print(f"done in {elapsed:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Geographic helpers: haversine distances and a grid index of points.
+
+Points are bucketed into square cells of ``CELL_SIZE`` degrees (roughly
+1 km); nearest-point queries search rings of cells outward from the query
+cell and compute exact distances only for the candidates found.
+"""
+import math
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+EARTH_RADIUS_KM = 6371.0088
+# Grid cell size in degrees (~1.1 km north-south)
+CELL_SIZE = 0.01
+# Positions older than this are treated as stale (live location ended)
+POSITION_TTL = 600
+# Rings searched before giving up (~20 km)
+MAX_RINGS = 20
+
+Cell = Tuple[int, int]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points in kilometers"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def haversine_many(lat: float, lon: float, lats, lons) -> List[float]:
+    """Distances from one point to many points in kilometers"""
+    if NUMPY_AVAILABLE:
+        lat1, lon1 = math.radians(lat), math.radians(lon)
+        lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+        lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+        a = (np.sin((lat2 - lat1) / 2) ** 2
+             + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+    return [haversine_km(lat, lon, lat2, lon2) for lat2, lon2 in zip(lats, lons)]
+
+
+def cell_of(lat: float, lon: float) -> Cell:
+    return int(math.floor(lat / CELL_SIZE)), int(math.floor(lon / CELL_SIZE))
+
+
+def _ring(center: Cell, radius: int) -> Iterable[Cell]:
+    """Cells at Chebyshev distance ``radius`` from center"""
+    ci, cj = center
+    if radius == 0:
+        yield center
+        return
+    for dj in range(-radius, radius + 1):
+        yield ci - radius, cj + dj
+        yield ci + radius, cj + dj
+    for di in range(-radius + 1, radius):
+        yield ci + di, cj - radius
+        yield ci + di, cj + radius
+
+
+class GridIndex:
+    """Grid index of the last known positions of moving points"""
+
+    def __init__(self):
+        self.positions: Dict[int, Tuple[float, float, float]] = {}
+        self._cells: Dict[Cell, Set[int]] = {}
+        self._cell_of: Dict[int, Cell] = {}
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def update(self, point_id: int, lat: float, lon: float, timestamp: Optional[float] = None):
+        """Insert or move a point"""
+        cell = cell_of(lat, lon)
+        old_cell = self._cell_of.get(point_id)
+        if old_cell != cell:
+            if old_cell is not None:
+                self._discard(point_id, old_cell)
+            self._cells.setdefault(cell, set()).add(point_id)
+            self._cell_of[point_id] = cell
+        self.positions[point_id] = (lat, lon, timestamp or time.time())
+
+    def remove(self, point_id: int):
+        """Take a point out of the index"""
+        cell = self._cell_of.pop(point_id, None)
+        if cell is not None:
+            self._discard(point_id, cell)
+        self.positions.pop(point_id, None)
+
+    def _discard(self, point_id: int, cell: Cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(point_id)
+            if not members:
+                del self._cells[cell]
+
+    def nearest(self, lat: float, lon: float, exclude: Optional[Set[int]] = None,
+                max_rings: int = MAX_RINGS) -> Optional[Tuple[int, float]]:
+        """Nearest fresh point as (point_id, distance_km), or None"""
+        center = cell_of(lat, lon)
+        stale_before = time.time() - POSITION_TTL
+        candidates: List[int] = []
+        found_at = None
+
+        for radius in range(max_rings + 1):
+            for cell in _ring(center, radius):
+                for point_id in self._cells.get(cell, ()):
+                    if exclude and point_id in exclude:
+                        continue
+                    if self.positions[point_id][2] < stale_before:
+                        continue
+                    candidates.append(point_id)
+            if candidates and found_at is None:
+                found_at = radius
+            # One extra ring: a closer courier may sit just across a cell border
+            if found_at is not None and radius > found_at:
+                break
+
+        if not candidates:
+            return None
+
+        positions = self.positions
+        distances = haversine_many(
+            lat, lon,
+            [positions[c][0] for c in candidates],
+            [positions[c][1] for c in candidates]
+        )
+        if NUMPY_AVAILABLE:
+            best = int(np.argmin(distances))
+        else:
+            best = min(range(len(candidates)), key=distances.__getitem__)
+        return candidates[best], float(distances[best])
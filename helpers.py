@@ -35,10 +35,10 @@ def format_price(price: int) -> str:
     """Format price with thousand separators"""
     return f"{price:,}".replace(',', ' ')
 
-def calculate_delivery_time() -> str:
-    """Calculate estimated delivery time"""
+def calculate_delivery_time(minutes: float = 30) -> str:
+    """Clock time of delivery expected in ``minutes``"""
     now = datetime.now()
-    delivery_time = now + timedelta(minutes=30)
+    delivery_time = now + timedelta(minutes=minutes)
     return delivery_time.strftime("%H:%M")
 
 def generate_order_number() -> str:
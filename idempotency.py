@@ -0,0 +1,123 @@
+"""Deduplication of repeated callbacks and checkouts.
+
+Telegram redelivers a callback query when an update is not acknowledged in
+time, and users tap buttons twice. ``CallbackDeduplicationMiddleware``
+drops callback queries whose id was already seen. Actions that must happen
+once, such as creating an order, run through an ``IdempotencyGuard``:
+calls with the same key wait for the one in flight and receive its result
+instead of repeating the work. Both checks are dictionary lookups, cheap
+enough to put in front of every callback.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+from utils.metrics import metrics
+
+# Callback query ids remembered; Telegram stops redelivering well before
+SEEN_CALLBACKS = 10000
+CALLBACK_TTL = 600.0
+# Results of completed actions remembered for duplicates arriving later
+MAX_RESULTS = 10000
+RESULT_TTL = 3600.0
+
+
+class RecentKeys:
+    """Bounded set of keys seen within the last ``ttl`` seconds"""
+
+    def __init__(self, size: int = SEEN_CALLBACKS, ttl: float = CALLBACK_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._seen: 'OrderedDict[str, float]' = OrderedDict()
+
+    def add(self, key: str) -> bool:
+        """Remember ``key``; False if it was already seen"""
+        now = time.monotonic()
+        seen_at = self._seen.get(key)
+        if seen_at is not None and now - seen_at < self.ttl:
+            return False
+        self._seen[key] = now
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.size:
+            self._seen.popitem(last=False)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+
+class IdempotencyGuard:
+    """Runs an action at most once per key, sharing its result with duplicates"""
+
+    def __init__(self, size: int = MAX_RESULTS, ttl: float = RESULT_TTL):
+        self.size = size
+        self.ttl = ttl
+        # key -> (completed at, result)
+        self._results: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        # key -> lock held by the call in flight and the number of calls using it
+        self._in_flight: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    def result(self, key: str) -> Optional[Any]:
+        """Result of the completed action for ``key``, if still remembered"""
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self._results[key]
+            return None
+        return entry[1]
+
+    def _remember(self, key: str, value: Any):
+        self._results[key] = (time.monotonic(), value)
+        self._results.move_to_end(key)
+        while len(self._results) > self.size:
+            self._results.popitem(last=False)
+
+    async def run(self, key: str, action: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Run ``action`` unless it already ran for ``key``.
+
+        Returns the result and whether this call produced it. A ``None``
+        result is not remembered, so a failed action may be retried.
+        """
+        value = self.result(key)
+        if value is not None:
+            return value, False
+
+        lock, users = self._in_flight.get(key) or (asyncio.Lock(), 0)
+        self._in_flight[key] = (lock, users + 1)
+        try:
+            async with lock:
+                value = self.result(key)
+                if value is not None:
+                    return value, False
+                value = await action()
+                if value is not None:
+                    self._remember(key, value)
+                return value, True
+        finally:
+            lock, users = self._in_flight[key]
+            if users == 1:
+                del self._in_flight[key]
+            else:
+                self._in_flight[key] = (lock, users - 1)
+
+
+class CallbackDeduplicationMiddleware(BaseMiddleware):
+    """Outer middleware dropping redelivered callback queries"""
+
+    def __init__(self, seen: Optional[RecentKeys] = None):
+        self.seen = seen or RecentKeys()
+
+    async def __call__(self, handler, event: CallbackQuery, data):
+        if not self.seen.add(event.id):
+            metrics.incr('duplicate_callbacks')
+            return None
+        return await handler(event, data)
+
+
+# Guard for order creation, keyed by checkout token
+checkout_guard = IdempotencyGuard()
@@ -0,0 +1,102 @@
+import asyncio
+from typing import Dict, List
+
+from aiogram import Router
+from aiogram.types import (
+    InlineQuery, InlineQueryResultArticle, InlineQueryResultPhoto,
+    InputTextMessageContent, InlineKeyboardMarkup, InlineKeyboardButton
+)
+
+from database.queries import Product
+from localization.texts import get_text
+from utils.catalog_cache import catalog_cache
+
+router = Router()
+
+INLINE_PAGE_SIZE = 20
+# Seconds Telegram may cache an answer for the same query text
+INLINE_CACHE_TIME = 300
+# Wait this long for the next keystroke before computing an uncached query
+INLINE_DEBOUNCE = 0.25
+
+# Latest inline query id per user, used to drop superseded keystrokes
+_latest_query: Dict[int, str] = {}
+
+def _product_text(product: Product, lang: str) -> str:
+    return get_text('product_details', lang).format(
+        product.name(lang), f"{product.price:,}", product.description(lang) or "—"
+    )
+
+def _build_results(product_ids: List[int], lang: str, bot_username: str) -> List:
+    results = []
+    for product_id in product_ids:
+        product = catalog_cache.products.get(product_id)
+        if not product:
+            continue
+
+        name = product.name(lang)
+        price = get_text('inline_price', lang).format(f"{product.price:,}")
+        markup = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(
+                text=get_text('inline_open_in_bot', lang),
+                url=f"https://t.me/{bot_username}?start=product_{product_id}"
+            )
+        ]])
+        content = InputTextMessageContent(
+            message_text=_product_text(product, lang),
+            parse_mode='Markdown'
+        )
+
+        if product.image_url:
+            results.append(InlineQueryResultPhoto(
+                id=str(product_id),
+                photo_url=product.image_url,
+                thumbnail_url=product.image_url,
+                title=name,
+                description=price,
+                caption=content.message_text,
+                parse_mode='Markdown',
+                reply_markup=markup
+            ))
+        else:
+            results.append(InlineQueryResultArticle(
+                id=str(product_id),
+                title=name,
+                description=price,
+                input_message_content=content,
+                reply_markup=markup
+            ))
+    return results
+
+@router.inline_query()
+async def inline_catalog_search(inline_query: InlineQuery):
+    """Answer inline product search from the in-memory catalog"""
+    user_id = inline_query.from_user.id
+    query = inline_query.query or ''
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    lang = 'ru' if (inline_query.from_user.language_code or '').startswith('ru') else 'uz'
+
+    await catalog_cache.ensure_loaded()
+    product_ids = catalog_cache.cached_result(query)
+
+    # Debounce only fresh, uncached queries; next pages and repeats answer at once
+    if product_ids is None and not offset:
+        _latest_query[user_id] = inline_query.id
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        if _latest_query.get(user_id) != inline_query.id:
+            return
+        _latest_query.pop(user_id, None)
+
+    if product_ids is None:
+        product_ids = catalog_cache.search(query)
+
+    page = product_ids[offset:offset + INLINE_PAGE_SIZE]
+    next_offset = str(offset + INLINE_PAGE_SIZE) if offset + INLINE_PAGE_SIZE < len(product_ids) else ''
+    bot_username = (await inline_query.bot.me()).username
+
+    await inline_query.answer(
+        _build_results(page, lang, bot_username),
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=next_offset
+    )
@@ -0,0 +1,83 @@
+"""Reactions to stock changes: catalog refresh and low-stock alerts.
+
+Stock is reserved inside the order transaction (see ``Database.create_order``);
+the database then reports the new levels here. Products that sold out or came
+back make the catalog cache reload. Products at or below the low-stock
+threshold are collected for a short window and reported to admins in one
+message, each product once until it is restocked above the threshold.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from config import Config
+from database.models import db
+from utils import notifications
+from utils.catalog_cache import catalog_cache
+
+logger = logging.getLogger(__name__)
+
+# Low stock reports within this many seconds are sent as one alert
+LOW_STOCK_ALERT_WINDOW = 30.0
+
+
+class InventoryMonitor:
+    def __init__(self, threshold: int = Config.LOW_STOCK_THRESHOLD,
+                 window: float = LOW_STOCK_ALERT_WINDOW):
+        self.threshold = threshold
+        self.window = window
+        # product_id -> latest stock, waiting to be reported
+        self._pending: Dict[int, int] = {}
+        # Products already reported and not restocked since
+        self._alerted: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.alerts_sent = 0
+
+    def attach(self):
+        """Start receiving stock changes from the database"""
+        db.stock_listener = self.on_stock_change
+
+    def on_stock_change(self, levels: List[Tuple[int, int]], availability_changed: bool):
+        if availability_changed:
+            catalog_cache.invalidate()
+
+        for product_id, stock in levels:
+            if stock > self.threshold:
+                self._alerted.discard(product_id)
+                self._pending.pop(product_id, None)
+            elif product_id not in self._alerted:
+                self._pending[product_id] = stock
+
+        if self._pending and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        """Report pending low stock products now"""
+        pending, self._pending = self._pending, {}
+        service = notifications.notification_service
+        if not pending or service is None:
+            return
+        self._alerted.update(pending)
+        self.alerts_sent += 1
+        try:
+            await service.notify_low_stock_batch(pending)
+        except Exception as e:
+            logger.error(f"Failed to send low stock alert: {e}")
+
+    async def close(self):
+        """Send pending alerts before shutdown"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+
+# Global inventory monitor instance
+inventory_monitor = InventoryMonitor()
@@ -1,5 +1,6 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
+from database.queries import Category, Product
 from localization.texts import get_text
 from typing import List, Dict
 
@@ -37,23 +38,21 @@ def get_main_menu_keyboard(lang: str = 'uz') -> ReplyKeyboardMarkup:
         KeyboardButton(text=get_text('btn_orders', lang)),
         KeyboardButton(text=get_text('btn_profile', lang)),
         KeyboardButton(text=get_text('btn_referral', lang)),
-        KeyboardButton(text=get_text('btn_language', lang))
+        KeyboardButton(text=get_text('btn_language', lang)),
+        KeyboardButton(text=get_text('btn_search', lang))
     )
-    builder.adjust(2, 2, 2)
+    builder.adjust(2, 2, 2, 1)
     return builder.as_markup(resize_keyboard=True)
 
-def get_categories_keyboard(categories: List[Dict], lang: str = 'uz') -> InlineKeyboardMarkup:
+def get_categories_keyboard(categories: List[Category], lang: str = 'uz') -> InlineKeyboardMarkup:
     """Categories inline keyboard"""
     builder = InlineKeyboardBuilder()
     
-    for category in categories:
-        name = category[f'name_{lang}'] if f'name_{lang}' in category else category['name_uz']
-        builder.add(
-            InlineKeyboardButton(
-                text=name,
-                callback_data=f"category_{category['id']}"
-            )
-        )
+    # One add() for all buttons: the builder revalidates its markup on every call
+    builder.add(*(
+        InlineKeyboardButton(text=category.name(lang), callback_data=f"category_{category.id}")
+        for category in categories
+    ))
     
     builder.add(
         InlineKeyboardButton(text=get_text('btn_back', lang), callback_data="back_to_menu")
@@ -61,19 +60,17 @@ def get_categories_keyboard(categories: List[Dict], lang: str = 'uz') -> InlineK
     builder.adjust(2)
     return builder.as_markup()
 
-def get_products_keyboard(products: List[Dict], lang: str = 'uz') -> InlineKeyboardMarkup:
+def get_products_keyboard(products: List[Product], lang: str = 'uz') -> InlineKeyboardMarkup:
     """Products inline keyboard"""
     builder = InlineKeyboardBuilder()
     
-    for product in products:
-        name = product[f'name_{lang}'] if f'name_{lang}' in product else product['name_uz']
-        price = f"{product['price']:,} сўм"
-        builder.add(
-            InlineKeyboardButton(
-                text=f"{name} - {price}",
-                callback_data=f"product_{product['id']}"
-            )
+    builder.add(*(
+        InlineKeyboardButton(
+            text=f"{product.name(lang)} - {product.price:,} сўм",
+            callback_data=f"product_{product.id}"
         )
+        for product in products
+    ))
     
     builder.add(
         InlineKeyboardButton(text=get_text('btn_back', lang), callback_data="back_to_categories")
@@ -81,7 +78,8 @@ def get_products_keyboard(products: List[Dict], lang: str = 'uz') -> InlineKeybo
     builder.adjust(1)
     return builder.as_markup()
 
-def get_product_detail_keyboard(product_id: int, lang: str = 'uz') -> InlineKeyboardMarkup:
+def get_product_detail_keyboard(product_id: int, lang: str = 'uz',
+                                is_favourite: bool = False) -> InlineKeyboardMarkup:
     """Product detail keyboard"""
     builder = InlineKeyboardBuilder()
     builder.add(
@@ -89,16 +87,28 @@ def get_product_detail_keyboard(product_id: int, lang: str = 'uz') -> InlineKeyb
             text=get_text('add_to_cart', lang),
             callback_data=f"add_to_cart_{product_id}"
         ),
+        InlineKeyboardButton(
+            text=get_text('btn_favourite_remove' if is_favourite else 'btn_favourite_add', lang),
+            callback_data=f"fav_{product_id}"
+        ),
         InlineKeyboardButton(text=get_text('btn_back', lang), callback_data="back_to_products")
     )
     builder.adjust(1)
     return builder.as_markup()
 
-def get_cart_keyboard(lang: str = 'uz') -> InlineKeyboardMarkup:
+def get_cart_keyboard(lang: str = 'uz', bonus_balance: int = 0,
+                      use_bonus: bool = False) -> InlineKeyboardMarkup:
     """Cart management keyboard"""
     builder = InlineKeyboardBuilder()
     builder.add(
         InlineKeyboardButton(text=get_text('checkout', lang), callback_data="checkout"),
+        InlineKeyboardButton(text=get_text('btn_promo_code', lang), callback_data="promo_code")
+    )
+    if bonus_balance > 0:
+        text = (get_text('btn_skip_bonus', lang) if use_bonus
+                else get_text('btn_use_bonus', lang).format(f"{bonus_balance:,}"))
+        builder.add(InlineKeyboardButton(text=text, callback_data="toggle_bonus"))
+    builder.add(
         InlineKeyboardButton(text=get_text('clear_cart', lang), callback_data="clear_cart"),
         InlineKeyboardButton(text=get_text('btn_back', lang), callback_data="back_to_menu")
     )
@@ -131,6 +141,7 @@ def get_admin_menu_keyboard() -> InlineKeyboardMarkup:
         InlineKeyboardButton(text="📋 Заказы", callback_data="admin_orders"),
         InlineKeyboardButton(text="📦 Товары", callback_data="admin_products"),
         InlineKeyboardButton(text="📂 Категории", callback_data="admin_categories"),
+        InlineKeyboardButton(text="📈 Продажи", callback_data="admin_sales"),
         InlineKeyboardButton(text="🤖 AI Аналитика", callback_data="admin_ai_insights")
     )
     builder.adjust(2)
@@ -143,11 +154,49 @@ def get_profile_keyboard(lang: str = 'uz') -> InlineKeyboardMarkup:
         InlineKeyboardButton(text=get_text('edit_phone', lang), callback_data="edit_phone"),
         InlineKeyboardButton(text=get_text('edit_address', lang), callback_data="edit_address"),
         InlineKeyboardButton(text=get_text('my_orders', lang), callback_data="my_orders"),
+        InlineKeyboardButton(text=get_text('favourites', lang), callback_data="favourites"),
         InlineKeyboardButton(text=get_text('btn_back', lang), callback_data="back_to_menu")
     )
     builder.adjust(2)
     return builder.as_markup()
 
+def get_my_orders_keyboard(order_ids: List[int], lang: str = 'uz') -> InlineKeyboardMarkup:
+    """Repeat buttons for past orders, then the profile menu"""
+    builder = InlineKeyboardBuilder()
+    for order_id in order_ids:
+        builder.add(
+            InlineKeyboardButton(
+                text=get_text('btn_repeat_order', lang).format(order_id),
+                callback_data=f"repeat_order_{order_id}"
+            )
+        )
+    builder.adjust(2)
+    builder.attach(InlineKeyboardBuilder.from_markup(get_profile_keyboard(lang)))
+    return builder.as_markup()
+
+def get_favourites_keyboard(products: List[Product], lang: str = 'uz') -> InlineKeyboardMarkup:
+    """Favourite products with a button putting all of them into the cart"""
+    builder = InlineKeyboardBuilder()
+    builder.add(*(
+        InlineKeyboardButton(
+            text=f"{product.name(lang)} - {product.price:,} сўм",
+            callback_data=f"product_{product.id}"
+        )
+        for product in products
+    ))
+    if products:
+        builder.add(
+            InlineKeyboardButton(
+                text=get_text('btn_favourites_to_cart', lang),
+                callback_data="favourites_to_cart"
+            )
+        )
+    builder.add(
+        InlineKeyboardButton(text=get_text('btn_back', lang), callback_data="back_to_menu")
+    )
+    builder.adjust(1)
+    return builder.as_markup()
+
 def get_categories_management_keyboard() -> InlineKeyboardMarkup:
     """Categories management keyboard"""
     builder = InlineKeyboardBuilder()
@@ -181,7 +230,35 @@ def get_orders_management_keyboard() -> InlineKeyboardMarkup:
         InlineKeyboardButton(text="✅ Подтвержденные", callback_data="confirmed_orders"),
         InlineKeyboardButton(text="🚚 В доставке", callback_data="delivering_orders"),
         InlineKeyboardButton(text="📊 Статистика", callback_data="orders_stats"),
+        InlineKeyboardButton(text="✅ Подтвердить все новые", callback_data="bulk_confirm"),
+        InlineKeyboardButton(text="👨‍🍳 Все подтвержденные в работу", callback_data="bulk_prepare"),
+        InlineKeyboardButton(text="📦 Все готовящиеся готовы", callback_data="bulk_ready"),
         InlineKeyboardButton(text="⬅️ Назад", callback_data="back_to_admin")
     )
-    builder.adjust(2)
+    builder.adjust(2, 2, 1, 1, 1, 1)
+    return builder.as_markup()
+
+def get_pay_keyboard(pay_url: str, lang: str = 'uz') -> InlineKeyboardMarkup:
+    """Link to the payment provider's checkout page"""
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text=get_text('btn_pay', lang), url=pay_url))
+    return builder.as_markup()
+
+def get_courier_order_keyboard(order: Dict, lang: str = 'uz') -> InlineKeyboardMarkup:
+    """Keyboard for an order assigned to a courier"""
+    builder = InlineKeyboardBuilder()
+    if order.get('latitude') is not None and order.get('longitude') is not None:
+        builder.add(
+            InlineKeyboardButton(
+                text=get_text('courier_open_map', lang),
+                url=f"https://maps.google.com/?q={order['latitude']},{order['longitude']}"
+            )
+        )
+    builder.add(
+        InlineKeyboardButton(
+            text=get_text('courier_delivered_btn', lang),
+            callback_data=f"delivered_{order['id']}"
+        )
+    )
+    builder.adjust(1)
     return builder.as_markup()
\ No newline at end of file
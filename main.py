@@ -7,7 +7,19 @@ from aiogram.fsm.storage.memory import MemoryStorage
 
 from config import Config
 from database.models import db
-from handlers import start, catalog, cart, referral, admin, profile
+from handlers import start, catalog, cart, referral, admin, profile, search, inline, courier
+from utils.metrics import metrics, HandlerTimingMiddleware, TelegramTimingMiddleware
+from utils.webserver import web_server
+from utils.dispatch import dispatch_engine
+from utils.eta import eta_model
+from utils.idempotency import CallbackDeduplicationMiddleware
+from utils.inventory import inventory_monitor
+from utils.catalog_cache import catalog_cache
+from utils.scheduler import scheduler
+from utils.cart_lifecycle import run_cart_lifecycle
+from utils import notifications
+from utils.payments import payment_gateway
+from utils.events import event_tracker, EventTrackingMiddleware
 
 # Configure logging
 logging.basicConfig(
@@ -94,29 +106,82 @@ async def init_database():
             logger.info("Sample data added to database")
 
 
-async def on_startup():
+async def send_daily_stats():
+    if notifications.notification_service:
+        await notifications.notification_service.send_daily_stats()
+
+
+def schedule_jobs():
+    """Register periodic background jobs."""
+    scheduler.add_job('daily_stats', send_daily_stats, cron=Config.DAILY_STATS_CRON, timeout=120)
+    scheduler.add_job('cart_lifecycle', run_cart_lifecycle, interval=900, jitter=60, timeout=600)
+    # Postgres analyzes tables itself and its readers never block writers
+    if db.backend.name == 'sqlite':
+        # ANALYZE and index merges are blocking sqlite3 work: run in the executor
+        scheduler.add_job('db_maintenance', db.maintain, cron='30 4 * * *', blocking=True,
+                          timeout=1800, catch_up=True)
+        if Config.ANALYTICS_SNAPSHOT_INTERVAL:
+            # Reports read this copy, so long scans stay off the checkout database
+            scheduler.add_job('analytics_snapshot', db.refresh_snapshot,
+                              interval=Config.ANALYTICS_SNAPSHOT_INTERVAL, blocking=True,
+                              timeout=600)
+    # Reload the inline search snapshot before it expires, off the request path
+    scheduler.add_job('warm_catalog_cache', catalog_cache.refresh,
+                      interval=catalog_cache.ttl * 0.8, jitter=10, timeout=60)
+
+
+async def on_startup(bot: Bot):
     """Actions on bot startup."""
     logger.info("Initializing database...")
     await init_database()
     logger.info("Database initialized successfully!")
 
+    await eta_model.load()
 
-async def on_shutdown():
-    """Actions on bot shutdown."""
-    logger.info("Bot is shutting down...")
+    # Payment webhooks are routes of the web server, so register them first
+    payment_gateway.setup(bot)
+    if Config.WEB_SERVER_PORT:
+        await web_server.start(Config.WEB_SERVER_PORT)
 
+    notifications.init_notification_service(bot)
+    inventory_monitor.attach()
+    dispatch_engine.start(bot)
+    schedule_jobs()
+    scheduler.start()
 
-async def main():
-    """Main function to run the bot."""
-    if not Config.BOT_TOKEN:
-        logger.error("BOT_TOKEN not found in environment variables")
-        return
 
-    # Initialize bot and dispatcher
-    bot = Bot(token=Config.BOT_TOKEN)
+async def on_shutdown():
+    """Actions on bot shutdown."""
+    logger.info("Bot is shutting down...")
+    await scheduler.stop()
+    await dispatch_engine.stop()
+    await inventory_monitor.close()
+    if notifications.notification_service:
+        await notifications.notification_service.close()
+    await web_server.stop()
+    await payment_gateway.close()
+    await event_tracker.close()
+    await db.close()
+
+
+def create_dispatcher() -> Dispatcher:
+    """Build dispatcher with middlewares and all routers registered."""
     storage = MemoryStorage()
     dp = Dispatcher(storage=storage)
 
+    # Hot-path instrumentation
+    metrics.enabled = Config.METRICS_ENABLED
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
+    dp.inline_query.middleware(HandlerTimingMiddleware())
+    dp.edited_message.middleware(HandlerTimingMiddleware())
+    # Redelivered callback queries are dropped before any handler runs
+    dp.callback_query.outer_middleware(CallbackDeduplicationMiddleware())
+    # Funnel events of handled messages and callback queries
+    if Config.EVENTS_FLUSH_INTERVAL:
+        dp.message.middleware(EventTrackingMiddleware(event_tracker))
+        dp.callback_query.middleware(EventTrackingMiddleware(event_tracker))
+
     # Set startup and shutdown handlers
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
@@ -128,6 +193,24 @@ async def main():
     dp.include_router(referral.router)
     dp.include_router(admin.router)
     dp.include_router(profile.router)
+    dp.include_router(inline.router)
+    dp.include_router(courier.router)
+    # Catches otherwise unhandled text, so it must stay last
+    dp.include_router(search.router)
+
+    return dp
+
+
+async def main():
+    """Main function to run the bot."""
+    if not Config.BOT_TOKEN:
+        logger.error("BOT_TOKEN not found in environment variables")
+        return
+
+    # Initialize bot and dispatcher
+    bot = Bot(token=Config.BOT_TOKEN)
+    bot.session.middleware(TelegramTimingMiddleware())
+    dp = create_dispatcher()
 
     logger.info("Bot started successfully!")
 
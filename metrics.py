@@ -0,0 +1,296 @@
+"""In-process latency histograms and counters for the Arzon bot.
+
+Everything is recorded into HDR-style log-linear histograms: values are kept
+in integer microseconds, exact below 128us and with <1% relative error above,
+so recording costs a few integer operations and a dict update.
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Histograms keep 2**SUB_BUCKET_BITS sub-buckets per power of two
+SUB_BUCKET_BITS = 7
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+
+# Histogram kinds whose values are latencies (recorded in microseconds)
+LATENCY_KINDS = ('handler', 'db', 'telegram', 'openai', 'dispatch', 'payment', 'job', 'write_behind')
+
+
+class Histogram:
+    """Log-linear histogram of non-negative integers"""
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.min = 0
+        self.max = 0
+
+    @staticmethod
+    def _index(value: int) -> int:
+        if value < SUB_BUCKET_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BUCKET_BITS
+        return shift * SUB_BUCKET_HALF + (value >> shift)
+
+    @staticmethod
+    def _value(index: int) -> int:
+        """Midpoint of the range covered by a bucket index"""
+        if index < SUB_BUCKET_COUNT:
+            return index
+        shift = index // SUB_BUCKET_HALF - 1
+        mantissa = index - shift * SUB_BUCKET_HALF
+        return (mantissa << shift) + (1 << (shift - 1))
+
+    def record(self, value: int):
+        """Record a single value"""
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        if not self.count or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: 'Histogram'):
+        """Add all values of another histogram to this one"""
+        if not other.count:
+            return
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.min = other.min if not self.count else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, percent: float) -> int:
+        """Get value at the given percentile (0-100)"""
+        if not self.count:
+            return 0
+        threshold = max(1, int(self.count * percent / 100.0 + 0.5))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def percentiles(self, percents=(50, 95, 99)) -> List[int]:
+        """Get values for several percentiles in one pass"""
+        if not self.count:
+            return [0 for _ in percents]
+        thresholds = [max(1, int(self.count * p / 100.0 + 0.5)) for p in percents]
+        result = [self.max] * len(percents)
+        pending = sorted(range(len(percents)), key=lambda i: thresholds[i])
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while pending and seen >= thresholds[pending[0]]:
+                position = pending.pop(0)
+                result[position] = min(max(self._value(index), self.min), self.max)
+            if not pending:
+                break
+        return result
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class _Timer:
+    """Context manager that records elapsed time into a histogram"""
+
+    __slots__ = ('_histogram', '_start')
+
+    def __init__(self, histogram: Histogram):
+        self._histogram = histogram
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._histogram.record(int((time.perf_counter() - self._start) * 1_000_000))
+        return False
+
+
+class Metrics:
+    """Registry of histograms, counters and gauges"""
+
+    def __init__(self):
+        self.enabled = True
+        self.started_at = time.time()
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, float] = {}
+
+    def histogram(self, kind: str, name: str) -> Histogram:
+        """Get or create histogram for (kind, name)"""
+        key = (kind, name)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        return histogram
+
+    def observe(self, kind: str, name: str, seconds: float):
+        """Record a latency in seconds"""
+        if self.enabled:
+            self.histogram(kind, name).record(int(seconds * 1_000_000))
+
+    def observe_value(self, kind: str, name: str, value: int):
+        """Record a plain integer value (row counts, sizes)"""
+        if self.enabled:
+            self.histogram(kind, name).record(value)
+
+    def timer(self, kind: str, name: str) -> _Timer:
+        """Time a block: ``with metrics.timer('openai', 'chat'):``"""
+        return _Timer(self.histogram(kind, name) if self.enabled else Histogram())
+
+    def incr(self, name: str, value: int = 1):
+        """Increment a counter"""
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        """Set a gauge to the current value"""
+        self._gauges[name] = value
+
+    def histograms(self, kind: Optional[str] = None) -> Dict[Tuple[str, str], Histogram]:
+        """Get histograms, optionally filtered by kind"""
+        if kind is None:
+            return dict(self._histograms)
+        return {key: h for key, h in self._histograms.items() if key[0] == kind}
+
+    def counters(self) -> Dict[str, int]:
+        return dict(self._counters)
+
+    def gauges(self) -> Dict[str, float]:
+        return dict(self._gauges)
+
+    def reset(self):
+        """Drop all recorded data"""
+        self._histograms.clear()
+        self._counters.clear()
+        self.started_at = time.time()
+
+    def format_report(self, kind: str, limit: int = 10) -> str:
+        """Plain text table of the slowest entries of a kind by p99"""
+        rows = sorted(
+            self.histograms(kind).items(),
+            key=lambda item: item[1].percentile(99),
+            reverse=True
+        )[:limit]
+        if not rows:
+            return "—"
+
+        unit_scale = 1000.0 if kind in LATENCY_KINDS else 1.0
+        lines = []
+        for (_, name), histogram in rows:
+            p50, p95, p99 = histogram.percentiles((50, 95, 99))
+            lines.append(
+                f"{name[:40]}: n={histogram.count} "
+                f"p50={p50 / unit_scale:.1f} p95={p95 / unit_scale:.1f} "
+                f"p99={p99 / unit_scale:.1f}"
+            )
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in Prometheus text exposition format"""
+        lines = []
+        by_kind: Dict[str, List[Tuple[str, Histogram]]] = {}
+        for (kind, name), histogram in sorted(self._histograms.items()):
+            by_kind.setdefault(kind, []).append((name, histogram))
+
+        for kind, entries in by_kind.items():
+            if kind in LATENCY_KINDS:
+                metric, scale = f"arzon_{kind}_latency_seconds", 1_000_000.0
+            else:
+                metric, scale = f"arzon_{_sanitize(kind)}", 1.0
+            lines.append(f"# TYPE {metric} summary")
+            for name, histogram in entries:
+                label = _escape_label(name)
+                values = histogram.percentiles((50, 95, 99))
+                for quantile, value in zip(('0.5', '0.95', '0.99'), values):
+                    lines.append(
+                        f'{metric}{{name="{label}",quantile="{quantile}"}} {value / scale:g}'
+                    )
+                lines.append(f'{metric}_sum{{name="{label}"}} {histogram.total / scale:g}')
+                lines.append(f'{metric}_count{{name="{label}"}} {histogram.count}')
+
+        for name, value in sorted(self._counters.items()):
+            metric = f"arzon_{_sanitize(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+
+        for name, value in sorted(self._gauges.items()):
+            metric = f"arzon_{_sanitize(name)}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _sanitize(name: str) -> str:
+    return ''.join(ch if ch.isalnum() else '_' for ch in name).lower()
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+_statement_labels: Dict[str, Tuple[str, bool]] = {}
+
+
+def statement_label(sql: str) -> Tuple[str, bool]:
+    """Get (short label, returns_rows) for an SQL statement, cached per string"""
+    cached = _statement_labels.get(sql)
+    if cached is None:
+        normalized = ' '.join(sql.split())
+        keyword = normalized.split(' ', 1)[0].upper() if normalized else ''
+        if keyword == 'WITH':
+            # A common table expression can also lead an INSERT or UPDATE
+            upper = normalized.upper()
+            keyword = next((verb for verb in ('INSERT', 'UPDATE', 'DELETE')
+                            if f' {verb} ' in upper), keyword)
+        cached = (normalized[:80], keyword in ('SELECT', 'WITH', 'PRAGMA'))
+        if len(_statement_labels) < 2048:
+            _statement_labels[sql] = cached
+    return cached
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Inner middleware recording latency per handler function"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        name = getattr(getattr(handler_object, 'callback', None), '__name__', 'unknown')
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.observe('handler', name, time.perf_counter() - start)
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    """Bot session middleware recording latency per Telegram API method"""
+
+    async def __call__(self, make_request, bot, method):
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            metrics.observe('telegram', type(method).__name__, time.perf_counter() - start)
+
+
+# Global metrics registry
+metrics = Metrics()
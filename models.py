@@ -1,21 +1,290 @@
+import asyncio
+import contextvars
+import functools
+import os
 import sqlite3
+from collections import OrderedDict
+from pathlib import Path
 import aiosqlite
 import uuid
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Set, Tuple, Callable, AsyncIterator, Sequence, Union
 import json
+import math
+import time
+
+from config import Config
+from database import queries
+from database.backends import INTEGRITY_ERRORS, POSTGRES_SCHEMA, POSTGRES_SEARCH_VECTOR, create_backend
+from database.queries import Product, Query
+from database.write_behind import WriteBehind
+from utils.metrics import metrics, statement_label
+from utils.translit import normalize, tokenize
+
+# Seconds between refreshes of the in-memory product popularity counts
+POPULARITY_TTL = 900
+# Users whose favourite product ids are kept in memory
+FAVOURITES_CACHE_SIZE = 1024
+# Payment columns a status change may set along with the status
+PAYMENT_DETAIL_COLUMNS = ('perform_time', 'cancel_time', 'cancel_reason')
+
+# True while an analytics function runs: its connections go to the snapshot
+_analytics_scope = contextvars.ContextVar('analytics_scope', default=False)
+
+
+def analytics(func):
+    """Run the queries of a coroutine function against the analytics
+    snapshot (see ``Database.refresh_snapshot``) instead of the live database"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _analytics_scope.set(True)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _analytics_scope.reset(token)
+    return wrapper
+
+
+class InstrumentedCursor:
+    """Cursor proxy that records statement latency and returned rows"""
+
+    __slots__ = ('_cursor', '_label', '_elapsed', '_recorded')
+
+    def __init__(self, cursor, label: str, elapsed: float):
+        self._cursor = cursor
+        self._label = label
+        self._elapsed = elapsed
+        self._recorded = False
+
+    def _record(self, elapsed: float, rows: int):
+        if not self._recorded:
+            self._recorded = True
+            metrics.observe('db', self._label, self._elapsed + elapsed)
+            metrics.observe_value('db_rows', self._label, rows)
+
+    async def fetchone(self):
+        start = time.perf_counter()
+        row = await self._cursor.fetchone()
+        self._record(time.perf_counter() - start, 1 if row is not None else 0)
+        return row
+
+    async def fetchall(self):
+        start = time.perf_counter()
+        rows = await self._cursor.fetchall()
+        self._record(time.perf_counter() - start, len(rows))
+        return rows
+
+    async def fetchmany(self, size: int = None):
+        start = time.perf_counter()
+        rows = await (self._cursor.fetchmany(size) if size else self._cursor.fetchmany())
+        self._record(time.perf_counter() - start, len(rows))
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Backend connection proxy that records per-statement metrics"""
+
+    __slots__ = ('_conn', '_row_factory')
+
+    def __init__(self, conn, row_factory=None):
+        self._conn = conn
+        self._row_factory = row_factory
+
+    async def __aenter__(self):
+        await self._conn.__aenter__()
+        if self._row_factory is not None:
+            self._conn.row_factory = self._row_factory
+        if isinstance(self._conn, aiosqlite.Connection):
+            # Used by the product search index triggers
+            await self._conn.create_function('translit', 1, normalize, deterministic=True)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return await self._conn.__aexit__(exc_type, exc, tb)
+
+    @property
+    def row_factory(self):
+        return self._conn.row_factory
+
+    @row_factory.setter
+    def row_factory(self, factory):
+        self._conn.row_factory = factory
+
+    async def execute(self, sql: str, parameters=None):
+        label, returns_rows = statement_label(sql)
+        return await self._execute(sql, parameters, label, returns_rows)
+    
+    async def _execute(self, sql: str, parameters, label: str, returns_rows: bool):
+        start = time.perf_counter()
+        cursor = await self._conn.execute(sql, parameters)
+        elapsed = time.perf_counter() - start
+        if returns_rows:
+            return InstrumentedCursor(cursor, label, elapsed)
+        metrics.observe('db', label, elapsed)
+        metrics.observe_value('db_rows', label, max(cursor.rowcount, 0))
+        return cursor
+    
+    async def execute_query(self, query: Query, parameters: Sequence = ()):
+        """Execute a registered query; metrics are labelled with its name"""
+        sql = query.statement(len(parameters))
+        return await self._execute(sql, parameters, query.name, query.returns_rows)
+    
+    async def fetch_all(self, query: Query, parameters: Sequence = ()) -> List:
+        cursor = await self.execute_query(query, parameters)
+        return [query.decode(row) for row in await cursor.fetchall()]
+    
+    async def fetch_one(self, query: Query, parameters: Sequence = ()):
+        cursor = await self.execute_query(query, parameters)
+        row = await cursor.fetchone()
+        return query.decode(row) if row is not None else None
+    
+    async def fetch_value(self, query: Query, parameters: Sequence = ()):
+        """First column of the first row, None without rows"""
+        cursor = await self.execute_query(query, parameters)
+        row = await cursor.fetchone()
+        return row[0] if row is not None else None
+
+    async def executemany(self, sql: str, parameters):
+        label, _ = statement_label(sql)
+        return await self._executemany(sql, parameters, label)
+    
+    async def execute_query_many(self, query: Query, parameters: Sequence[Sequence]):
+        """Execute a registered query once per parameter row"""
+        return await self._executemany(query.statement(), parameters, query.name)
+    
+    async def _executemany(self, sql: str, parameters, label: str):
+        start = time.perf_counter()
+        cursor = await self._conn.executemany(sql, parameters)
+        metrics.observe('db', label, time.perf_counter() - start)
+        metrics.observe_value('db_rows', label, max(cursor.rowcount, 0))
+        return cursor
+
+    async def commit(self):
+        metrics.incr('db_commits')
+        await self._conn.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class OutOfStockError(Exception):
+    """The cart asks for more of some products than is left in stock"""
+
+    def __init__(self, product_ids: List[int]):
+        super().__init__(f"Not enough stock for products {product_ids}")
+        self.product_ids = product_ids
+
+
+class PriceChangedError(Exception):
+    """The cart no longer costs what the customer was shown: a price or a
+    line changed after the total was computed"""
+
+    def __init__(self, expected: int, actual: int):
+        super().__init__(f"Cart subtotal is {actual}, expected {expected}")
+        self.expected = expected
+        self.actual = actual
+
+
+class RedemptionError(Exception):
+    """A promotion or the bonus balance used by the cart cannot be redeemed;
+    ``reason`` is 'promotion' or 'bonus'"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Cannot redeem {reason}")
+        self.reason = reason
+
+
+# Receives (product_id, stock left) of tracked products whose stock changed
+# and whether any of them became available or unavailable
+StockListener = Callable[[List[Tuple[int, int]], bool], None]
+
 
 class Database:
-    def __init__(self, db_path: str = "arzon_bot.db"):
-        self.db_path = db_path
+    def __init__(self, url: str = Config.DATABASE_URL):
+        self.configure(url)
+        self._popularity: Dict[int, int] = {}
+        self._popularity_loaded_at = 0.0
+        self._favourites: 'OrderedDict[int, List[int]]' = OrderedDict()
+        self.stock_listener: Optional[StockListener] = None
+        # Profile, language and recommendation writes are committed in batches
+        self.write_behind = WriteBehind(
+            self._connect_primary, Config.WRITE_BEHIND_MS / 1000, Config.WRITE_BEHIND_BATCH
+        )
+    
+    def configure(self, url: str):
+        """Use the database at ``url`` (see ``database.backends.create_backend``)"""
+        self.backend = create_backend(url, Config.DATABASE_POOL_SIZE)
+        # File of a SQLite database, None on other backends
+        self.db_path: Optional[str] = getattr(self.backend, 'path', None)
+    
+    async def close(self):
+        """Commit queued writes and close pooled connections"""
+        await self.write_behind.flush()
+        await self.backend.close()
+    
+    def _connect(self) -> InstrumentedConnection:
+        """Open an instrumented connection"""
+        if _analytics_scope.get():
+            return self._connect_analytics()
+        return self._connect_primary()
+    
+    def _connect_primary(self) -> InstrumentedConnection:
+        """Connection to the live database, also inside report scopes (the
+        write-behind task inherits the context of whoever started it)"""
+        return InstrumentedConnection(self.backend.connect())
+    
+    @property
+    def snapshot_path(self) -> str:
+        return f'{self.db_path}.snapshot'
     
-    async def get_connection(self):
+    def _connect_analytics(self) -> InstrumentedConnection:
+        """Read-only connection to the snapshot, or to the live database
+        (a WAL reader that does not block writers) until the first snapshot
+        exists. Rows support both ``row[0]`` and ``dict(row)``. Postgres
+        readers never block writers, so there reports use the live database."""
+        if self.backend.name != 'sqlite':
+            return InstrumentedConnection(self.backend.connect())
+        path = self.snapshot_path if os.path.exists(self.snapshot_path) else self.db_path
+        uri = Path(path).resolve().as_uri() + '?mode=ro'
+        return InstrumentedConnection(aiosqlite.connect(uri, uri=True), aiosqlite.Row)
+    
+    def refresh_snapshot(self):
+        """Copy the database to the analytics snapshot with the online backup
+        API and swap it in atomically. Blocking: run it in an executor"""
+        temp_path = f'{self.snapshot_path}.tmp'
+        source = sqlite3.connect(self.db_path, timeout=30)
+        target = sqlite3.connect(temp_path)
+        try:
+            # In WAL mode the copy reads one consistent state without
+            # blocking writers
+            source.backup(target)
+            # A plain journal lets read-only connections open it without a -shm file
+            target.execute('PRAGMA journal_mode = DELETE')
+        finally:
+            target.close()
+            source.close()
+        os.replace(temp_path, self.snapshot_path)
+    
+    def get_connection(self) -> InstrumentedConnection:
         """Get database connection"""
-        return aiosqlite.connect(self.db_path)
+        return self._connect()
     
     async def init_db(self):
         """Initialize database with all required tables"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
+            if self.backend.name == 'postgres':
+                await db.executescript(POSTGRES_SCHEMA)
+                await self._init_sales_buckets(db)
+                await self._init_promotion_users(db)
+                await db.commit()
+                return
+            
+            # Readers (reports, the analytics snapshot) never block writers in WAL mode
+            await db.execute('PRAGMA journal_mode = WAL')
+            
             # Users table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -64,6 +333,8 @@ class Database:
                     image_url TEXT,
                     is_available BOOLEAN DEFAULT 1,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    stock INTEGER,
+                    sku TEXT,
                     FOREIGN KEY (category_id) REFERENCES categories (id)
                 )
             ''')
@@ -85,6 +356,9 @@ class Database:
                     notes TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    idempotency_key TEXT,
+                    discount_amount INTEGER DEFAULT 0,
+                    bonus_used INTEGER DEFAULT 0,
                     FOREIGN KEY (user_id) REFERENCES users (telegram_id),
                     FOREIGN KEY (courier_id) REFERENCES users (telegram_id)
                 )
@@ -103,6 +377,45 @@ class Database:
                 )
             ''')
             
+            # Last run of every scheduled background job
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS scheduled_jobs (
+                    name TEXT PRIMARY KEY,
+                    last_run TIMESTAMP NOT NULL,
+                    last_status TEXT NOT NULL,
+                    last_duration REAL
+                )
+            ''')
+            
+            # Online payment invoices
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS payments (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id INTEGER NOT NULL,
+                    provider TEXT NOT NULL,
+                    invoice_id TEXT NOT NULL,
+                    amount INTEGER NOT NULL,
+                    status TEXT DEFAULT 'pending',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (provider, invoice_id),
+                    FOREIGN KEY (order_id) REFERENCES orders (id)
+                )
+            ''')
+            
+            # Order status history (append-only)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS order_events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    order_id INTEGER NOT NULL,
+                    from_status TEXT,
+                    to_status TEXT NOT NULL,
+                    actor_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (order_id) REFERENCES orders (id)
+                )
+            ''')
+            
             # Cart table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS cart (
@@ -111,11 +424,25 @@ class Database:
                     product_id INTEGER,
                     quantity INTEGER NOT NULL DEFAULT 1,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    reminded BOOLEAN DEFAULT 0,
                     FOREIGN KEY (user_id) REFERENCES users (telegram_id),
                     FOREIGN KEY (product_id) REFERENCES products (id)
                 )
             ''')
             
+            # Favourite products, one row per user and product
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS favourites (
+                    user_id INTEGER NOT NULL,
+                    product_id INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, product_id),
+                    FOREIGN KEY (user_id) REFERENCES users (telegram_id),
+                    FOREIGN KEY (product_id) REFERENCES products (id)
+                ) WITHOUT ROWID
+            ''')
+            
             # AI recommendations table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS ai_recommendations (
@@ -130,6 +457,53 @@ class Database:
                 )
             ''')
             
+            # Discount rules; rows with a code apply only when it is entered
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS promotions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    code TEXT UNIQUE,
+                    kind TEXT NOT NULL,
+                    value INTEGER NOT NULL,
+                    product_id INTEGER,
+                    category_id INTEGER,
+                    min_quantity INTEGER DEFAULT 1,
+                    min_total INTEGER DEFAULT 0,
+                    max_uses INTEGER,
+                    used_count INTEGER DEFAULT 0,
+                    once_per_user BOOLEAN DEFAULT 0,
+                    starts_at TIMESTAMP,
+                    ends_at TIMESTAMP,
+                    is_active BOOLEAN DEFAULT 1,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (product_id) REFERENCES products (id),
+                    FOREIGN KEY (category_id) REFERENCES categories (id)
+                )
+            ''')
+            
+            # Promotions applied to each order
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS promotion_redemptions (
+                    promotion_id INTEGER NOT NULL,
+                    order_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (promotion_id, order_id),
+                    FOREIGN KEY (promotion_id) REFERENCES promotions (id),
+                    FOREIGN KEY (order_id) REFERENCES orders (id)
+                )
+            ''')
+            
+            # Users who redeemed a once-per-user promotion; the key makes a
+            # second redemption fail even when two checkouts race
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS promotion_users (
+                    promotion_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    PRIMARY KEY (promotion_id, user_id),
+                    FOREIGN KEY (promotion_id) REFERENCES promotions (id)
+                )
+            ''')
+            
             # Referrals table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS referrals (
@@ -143,19 +517,223 @@ class Database:
                 )
             ''')
             
+            # Append-only user events (see utils.events)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS events (
+                    created_at TIMESTAMP NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    object_id INTEGER
+                )
+            ''')
+            
+            # Units and revenue per product and hour/day (see utils.sales)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS sales_hourly (
+                    hour TEXT NOT NULL,
+                    product_id INTEGER NOT NULL,
+                    orders INTEGER NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    revenue INTEGER NOT NULL,
+                    PRIMARY KEY (hour, product_id)
+                )
+            ''')
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS sales_daily (
+                    day TEXT NOT NULL,
+                    product_id INTEGER NOT NULL,
+                    orders INTEGER NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    revenue INTEGER NOT NULL,
+                    PRIMARY KEY (day, product_id)
+                )
+            ''')
+            
+            # Columns added after the first release
+            await self._ensure_column(db, 'orders', 'idempotency_key', 'TEXT')
+            await self._ensure_column(db, 'orders', 'discount_amount', 'INTEGER DEFAULT 0')
+            await self._ensure_column(db, 'orders', 'bonus_used', 'INTEGER DEFAULT 0')
+            # NULL stock means the product is not tracked and never runs out
+            await self._ensure_column(db, 'products', 'stock', 'INTEGER')
+            await self._ensure_column(db, 'products', 'sku', 'TEXT')
+            # ALTER TABLE cannot add a CURRENT_TIMESTAMP default: backfill instead
+            if await self._ensure_column(db, 'cart', 'updated_at', 'TIMESTAMP'):
+                await db.execute('UPDATE cart SET updated_at = created_at')
+            await self._ensure_column(db, 'cart', 'reminded', 'BOOLEAN DEFAULT 0')
+            # Provider-side transaction of a payment (Payme Merchant API) and
+            # its times in milliseconds, repeated in answers to retried calls
+            await self._ensure_column(db, 'payments', 'transaction_id', 'TEXT')
+            await self._ensure_column(db, 'payments', 'create_time', 'INTEGER')
+            await self._ensure_column(db, 'payments', 'perform_time', 'INTEGER')
+            await self._ensure_column(db, 'payments', 'cancel_time', 'INTEGER')
+            await self._ensure_column(db, 'payments', 'cancel_reason', 'INTEGER')
+            
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (order_status, courier_id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (order_status, created_at)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_order_events_order ON order_events (order_id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_payments_order ON payments (order_id)'
+            )
+            await db.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_transaction ON payments (provider, transaction_id)'
+            )
+            await db.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_idempotency ON orders (idempotency_key)'
+            )
+            await db.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products (sku)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_cart_user ON cart (user_id, product_id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_redemptions_user ON promotion_redemptions (user_id, promotion_id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_redemptions_order ON promotion_redemptions (order_id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_promotion_users_user ON promotion_users (user_id)'
+            )
+            # Covers the idle cart scans of the cart lifecycle job
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_cart_updated ON cart (updated_at, reminded, user_id)'
+            )
+            # Funnels scan a day in time order; retention looks up cohort users
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_events_created ON events (created_at, name, user_id)'
+            )
+            await db.execute(
+                'CREATE INDEX IF NOT EXISTS idx_events_user ON events (user_id, created_at)'
+            )
+            
+            await self._init_search_index(db)
+            await self._init_sales_buckets(db)
+            await self._init_promotion_users(db)
+            
+            await db.commit()
+    
+    @staticmethod
+    async def _ensure_column(db, table: str, column: str, definition: str) -> bool:
+        """Add a column to a table created by an older version; True if it was added"""
+        cursor = await db.execute(f'PRAGMA table_info({table})')
+        if column in {row[1] for row in await cursor.fetchall()}:
+            return False
+        await db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+    
+    @staticmethod
+    async def _init_sales_buckets(db):
+        """Fill the sales buckets of a database whose orders predate them"""
+        cursor = await db.execute('SELECT 1 FROM sales_daily LIMIT 1')
+        if await cursor.fetchone():
+            return
+        cursor = await db.execute('SELECT 1 FROM orders LIMIT 1')
+        if await cursor.fetchone():
+            await db.execute_query(queries.REBUILD_HOURLY_SALES)
+            await db.execute_query(queries.REBUILD_DAILY_SALES)
+    
+    @staticmethod
+    async def _init_promotion_users(db):
+        """Record once-per-user redemptions made before promotion_users existed"""
+        cursor = await db.execute('SELECT 1 FROM promotion_users LIMIT 1')
+        if await cursor.fetchone():
+            return
+        await db.execute('''
+            INSERT INTO promotion_users (promotion_id, user_id)
+            SELECT DISTINCT r.promotion_id, r.user_id
+            FROM promotion_redemptions r JOIN promotions p ON p.id = r.promotion_id
+            WHERE p.once_per_user = 1
+            ON CONFLICT DO NOTHING
+        ''')
+    
+    async def rebuild_sales_buckets(self):
+        """Recompute the sales buckets from all orders (after bulk loads)"""
+        async with self._connect_primary() as db:
+            await db.execute('DELETE FROM sales_hourly')
+            await db.execute('DELETE FROM sales_daily')
+            await db.execute_query(queries.REBUILD_HOURLY_SALES)
+            await db.execute_query(queries.REBUILD_DAILY_SALES)
             await db.commit()
     
+    async def _init_search_index(self, db):
+        """Create FTS5 product search index kept in sync by triggers"""
+        await db.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, description,
+                tokenize = 'unicode61 remove_diacritics 2',
+                prefix = '1 2 3'
+            )
+        ''')
+        
+        # rowid of products_fts is the product id; text is stored as translit keys
+        await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products
+            BEGIN
+                INSERT INTO products_fts (rowid, name, description) VALUES (
+                    new.id,
+                    translit(new.name_uz || ' ' || new.name_ru),
+                    translit(COALESCE(new.description_uz, '') || ' ' || COALESCE(new.description_ru, ''))
+                );
+            END
+        ''')
+        await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS products_fts_update
+            AFTER UPDATE OF name_uz, name_ru, description_uz, description_ru ON products
+            BEGIN
+                UPDATE products_fts SET
+                    name = translit(new.name_uz || ' ' || new.name_ru),
+                    description = translit(COALESCE(new.description_uz, '') || ' ' || COALESCE(new.description_ru, ''))
+                WHERE rowid = new.id;
+            END
+        ''')
+        await db.execute('''
+            CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products
+            BEGIN
+                DELETE FROM products_fts WHERE rowid = old.id;
+            END
+        ''')
+        
+        # Backfill products created before the index existed
+        await db.execute('''
+            INSERT INTO products_fts (rowid, name, description)
+            SELECT id,
+                   translit(name_uz || ' ' || name_ru),
+                   translit(COALESCE(description_uz, '') || ' ' || COALESCE(description_ru, ''))
+            FROM products
+            WHERE id NOT IN (SELECT rowid FROM products_fts)
+        ''')
+    
     async def create_user(self, telegram_id: int, username: str = None, 
                          first_name: str = None, last_name: str = None,
                          language_code: str = 'uz', referred_by: str = None) -> str:
         """Create new user and return referral code"""
         referral_code = str(uuid.uuid4())[:8].upper()
         
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute('''
-                INSERT OR REPLACE INTO users 
+                INSERT INTO users 
                 (telegram_id, username, first_name, last_name, language_code, referral_code, referred_by)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (telegram_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    language_code = excluded.language_code,
+                    referral_code = excluded.referral_code,
+                    referred_by = excluded.referred_by
             ''', (telegram_id, username, first_name, last_name, language_code, referral_code, referred_by))
             
             # If user was referred, create referral record
@@ -169,72 +747,201 @@ class Database:
         
         return referral_code
     
-    async def get_user(self, telegram_id: int) -> Optional[Dict]:
-        """Get user by telegram_id"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
-                'SELECT * FROM users WHERE telegram_id = ?', (telegram_id,)
-            )
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    async def get_user(self, telegram_id: int) -> Optional[queries.User]:
+        """Get user by telegram_id, with their queued profile changes"""
+        async with self._connect() as db:
+            user = await db.fetch_one(queries.USER, (telegram_id,))
+        return self.write_behind.apply(telegram_id, user)
     
     async def update_user_profile(self, telegram_id: int, phone: str = None, address: str = None):
-        """Update user profile information"""
-        async with aiosqlite.connect(self.db_path) as db:
-            if phone and address:
-                await db.execute('''
-                    UPDATE users SET phone = ?, address = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE telegram_id = ?
-                ''', (phone, address, telegram_id))
-            elif phone:
-                await db.execute('''
-                    UPDATE users SET phone = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE telegram_id = ?
-                ''', (phone, telegram_id))
-            elif address:
-                await db.execute('''
-                    UPDATE users SET address = ?, updated_at = CURRENT_TIMESTAMP
-                    WHERE telegram_id = ?
-                ''', (address, telegram_id))
-            
+        """Update user profile information (queued, see ``write_behind``)"""
+        fields = {}
+        if phone:
+            fields['phone'] = phone
+        if address:
+            fields['address'] = address
+        if not fields:
+            return
+        await self.write_behind.submit(
+            queries.UPDATE_PROFILE, (phone or None, address or None, telegram_id),
+            telegram_id, fields
+        )
+    
+    async def set_language(self, telegram_id: int, language_code: str):
+        """Change the user's language (queued, see ``write_behind``)"""
+        await self.write_behind.submit(
+            queries.SET_LANGUAGE, (language_code, telegram_id),
+            telegram_id, {'language_code': language_code}
+        )
+    
+    async def count_referrals(self, referrer_id: int) -> int:
+        async with self._connect() as db:
+            return await db.fetch_value(queries.REFERRAL_COUNT, (referrer_id,))
+    
+    async def award_referral_bonus(self, referrer_id: int, required: int, amount: int) -> bool:
+        """Credit ``amount`` once the referrer has ``required`` active referrals;
+        True if it was credited now (at most once per referrer)"""
+        async with self._connect() as db:
+            active = await db.fetch_value(queries.ACTIVE_REFERRAL_COUNT, (referrer_id,))
+            if active < required:
+                return False
+            cursor = await db.execute_query(queries.MARK_REFERRAL_BONUS, (referrer_id, referrer_id))
+            if cursor.rowcount <= 0:
+                return False
+            await db.execute_query(queries.ADD_BONUS, (amount, referrer_id))
             await db.commit()
+            return True
     
-    async def get_categories(self) -> List[Dict]:
+    async def get_categories(self) -> List[queries.Category]:
         """Get all active categories"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
-                'SELECT * FROM categories WHERE is_active = 1 ORDER BY name_uz'
-            )
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        async with self._connect() as db:
+            return await db.fetch_all(queries.CATEGORIES)
     
-    async def get_products_by_category(self, category_id: int) -> List[Dict]:
+    async def get_products_by_category(self, category_id: int) -> List[queries.Product]:
         """Get products by category"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
+            return await db.fetch_all(queries.CATEGORY_PRODUCTS, (category_id,))
+    
+    async def get_product(self, product_id: int) -> Optional[queries.Product]:
+        """Get product by id"""
+        async with self._connect() as db:
+            return await db.fetch_one(queries.PRODUCT, (product_id,))
+    
+    async def upsert_products(self, products: List[Dict]) -> Tuple[int, int]:
+        """Create or update products keyed by SKU in one transaction. Categories are
+        matched by Uzbek name and created when missing. Returns (created, updated);
+        nothing is written if a SKU conflict raises an integrity error."""
+        async with self._connect() as db:
+            try:
+                # Products created without a SKU take the one they are exported with
+                await db.execute("UPDATE products SET sku = 'P' || id WHERE sku IS NULL")
+                cursor = await db.execute('SELECT COUNT(*) FROM products')
+                before = (await cursor.fetchone())[0]
+                
+                categories = {}
+                for product in products:
+                    categories.setdefault(product['category_uz'], product['category_ru'])
+                await db.executemany('''
+                    INSERT INTO categories (name_uz, name_ru)
+                    SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM categories WHERE name_uz = ?)
+                ''', [(name_uz, name_ru, name_uz) for name_uz, name_ru in categories.items()])
+                cursor = await db.execute('SELECT name_uz, id FROM categories')
+                category_ids = dict(await cursor.fetchall())
+                
+                await db.executemany('''
+                    INSERT INTO products
+                    (sku, category_id, name_uz, name_ru, description_uz, description_ru,
+                     price, image_url, is_available, stock)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (sku) DO UPDATE SET
+                        category_id = excluded.category_id,
+                        name_uz = excluded.name_uz,
+                        name_ru = excluded.name_ru,
+                        description_uz = excluded.description_uz,
+                        description_ru = excluded.description_ru,
+                        price = excluded.price,
+                        image_url = excluded.image_url,
+                        is_available = excluded.is_available,
+                        stock = excluded.stock
+                ''', [
+                    (p['sku'], category_ids[p['category_uz']], p['name_uz'], p['name_ru'],
+                     p['description_uz'], p['description_ru'], p['price'], p['image_url'],
+                     p['is_available'], p['stock'])
+                    for p in products
+                ])
+                
+                cursor = await db.execute('SELECT COUNT(*) FROM products')
+                created = (await cursor.fetchone())[0] - before
+                await db.commit()
+                return created, len(products) - created
+            except INTEGRITY_ERRORS:
+                # A SKU given to a product created without one ('P' || id) is taken
+                await db.rollback()
+                raise
+    
+    async def get_catalog_products(self) -> List[queries.Product]:
+        """All available products"""
+        async with self._connect() as db:
+            return await db.fetch_all(queries.CATALOG_PRODUCTS)
+    
+    async def get_product_names(self, product_ids: List[int]) -> Dict[int, str]:
+        """Russian names of products by id"""
+        if not product_ids:
+            return {}
+        async with self._connect() as db:
+            rows = await db.fetch_all(queries.PRODUCT_NAMES, tuple(product_ids))
+        return {row.id: row.name_ru for row in rows}
+    
+    async def iter_catalog(self, chunk_size: int = 500) -> AsyncIterator[List[Tuple]]:
+        """Yield all products as export rows, ``chunk_size`` at a time"""
+        async with self._connect() as db:
             cursor = await db.execute('''
-                SELECT * FROM products 
-                WHERE category_id = ? AND is_available = 1 
-                ORDER BY name_uz
-            ''', (category_id,))
+                SELECT COALESCE(p.sku, 'P' || p.id), c.name_uz, c.name_ru, p.name_uz, p.name_ru,
+                       p.description_uz, p.description_ru, p.price, p.image_url,
+                       p.is_available, p.stock
+                FROM products p
+                LEFT JOIN categories c ON c.id = p.category_id
+                ORDER BY p.category_id, p.id
+            ''')
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+    
+    async def search_products(self, query: str, limit: int = 10,
+                              offset: int = 0) -> List[queries.Product]:
+        """Full-text product search ranked by bm25 relevance and popularity"""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        
+        # Take a wider bm25 candidate pool and re-rank it by popularity
+        pool = min(max((offset + limit) * 3, 30), 200)
+        
+        async with self._connect() as db:
+            if self.backend.name == 'postgres':
+                # Same prefix match over the translit keys; ts_rank is negated
+                # and scaled to sort like bm25
+                cursor = await db.execute(f'''
+                    SELECT {queries.columns(Product)}, -10 * ts_rank({POSTGRES_SEARCH_VECTOR}, query) AS relevance
+                    FROM products, to_tsquery('simple', ?) query
+                    WHERE {POSTGRES_SEARCH_VECTOR} @@ query AND is_available = 1
+                    ORDER BY relevance
+                    LIMIT ?
+                ''', (' & '.join(f'{token}:*' for token in tokens), pool))
+            else:
+                cursor = await db.execute(f'''
+                    SELECT {queries.columns(Product, 'p')}, bm25(products_fts, 10.0, 1.0) AS relevance
+                    FROM products_fts
+                    JOIN products p ON p.id = products_fts.rowid
+                    WHERE products_fts MATCH ? AND p.is_available = 1
+                    ORDER BY relevance
+                    LIMIT ?
+                ''', (match, pool))
             rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        
+        popularity = await self.get_product_popularity()
+        # bm25 is negative (lower is better), relevance is the last column;
+        # popularity adds a logarithmic boost
+        rows = sorted(rows, key=lambda row: row[-1] - math.log1p(popularity.get(row[0], 0)))
+        return [Product._make(row[:-1]) for row in rows[offset:offset + limit]]
     
-    async def get_product(self, product_id: int) -> Optional[Dict]:
-        """Get product by id"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute(
-                'SELECT * FROM products WHERE id = ?', (product_id,)
-            )
-            row = await cursor.fetchone()
-            return dict(row) if row else None
+    async def get_product_popularity(self) -> Dict[int, int]:
+        """Get cached order counts per product, refreshing when stale"""
+        if time.monotonic() - self._popularity_loaded_at > POPULARITY_TTL:
+            self._popularity_loaded_at = time.monotonic()
+            async with self._connect() as db:
+                cursor = await db.execute(
+                    'SELECT product_id, COUNT(*) FROM order_items GROUP BY product_id'
+                )
+                self._popularity = {row[0]: row[1] for row in await cursor.fetchall()}
+        return self._popularity
     
     async def add_to_cart(self, user_id: int, product_id: int, quantity: int = 1):
         """Add product to cart"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             # Check if product already in cart
             cursor = await db.execute('''
                 SELECT id, quantity FROM cart WHERE user_id = ? AND product_id = ?
@@ -252,56 +959,871 @@ class Database:
                     INSERT INTO cart (user_id, product_id, quantity) VALUES (?, ?, ?)
                 ''', (user_id, product_id, quantity))
             
+            # All items of a cart share its last activity time, so idle carts
+            # are found with one range scan over idx_cart_updated
+            await db.execute('''
+                UPDATE cart SET updated_at = datetime('now'), reminded = 0 WHERE user_id = ?
+            ''', (user_id,))
+            
             await db.commit()
     
-    async def get_cart(self, user_id: int) -> List[Dict]:
-        """Get user's cart with product details"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            cursor = await db.execute('''
-                SELECT c.*, p.name_uz, p.name_ru, p.price, p.image_url
-                FROM cart c
-                JOIN products p ON c.product_id = p.id
-                WHERE c.user_id = ?
-                ORDER BY c.created_at
-            ''', (user_id,))
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    async def get_cart(self, user_id: int) -> List[queries.CartItem]:
+        """Get user's cart lines with product details and line totals"""
+        async with self._connect() as db:
+            return await db.fetch_all(queries.CART_ITEMS, (user_id,))
+    
+    async def get_cart_summary(self, user_id: int) -> Dict:
+        """Get cart lines (one query) and the cart total, summed from their line totals"""
+        items = await self.get_cart(user_id)
+        return {
+            'items': items,
+            'total': sum(item.line_total for item in items),
+        }
     
     async def clear_cart(self, user_id: int):
         """Clear user's cart"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
             await db.commit()
     
+    @staticmethod
+    async def _merge_into_cart(db, user_id: int, wanted: str, params: tuple) -> int:
+        """Add the rows selected by ``wanted`` (columns product_id and
+        quantity) to the cart: one UPDATE for products already there, one INSERT ... SELECT
+        for the rest. Returns the number of products added."""
+        cursor = await db.execute(f'''
+            UPDATE cart SET quantity = cart.quantity + w.quantity
+            FROM ({wanted}) AS w
+            WHERE cart.user_id = ? AND cart.product_id = w.product_id
+        ''', params + (user_id,))
+        added = cursor.rowcount
+        cursor = await db.execute(f'''
+            INSERT INTO cart (user_id, product_id, quantity)
+            SELECT ?, w.product_id, w.quantity
+            FROM ({wanted}) AS w
+            WHERE NOT EXISTS (
+                SELECT 1 FROM cart c WHERE c.user_id = ? AND c.product_id = w.product_id
+            )
+        ''', (user_id,) + params + (user_id,))
+        added += cursor.rowcount
+        await db.execute('''
+            UPDATE cart SET updated_at = datetime('now'), reminded = 0 WHERE user_id = ?
+        ''', (user_id,))
+        return added
+    
+    async def repeat_order(self, user_id: int, order_id: int) -> Tuple[int, int]:
+        """Copy a past order of the user into the cart; returns the number of
+        products added and of products skipped as unavailable. Prices are not
+        copied: the cart always shows current prices."""
+        async with self._connect() as db:
+            cursor = await db.execute('''
+                SELECT COUNT(DISTINCT oi.product_id)
+                FROM orders o JOIN order_items oi ON oi.order_id = o.id
+                WHERE o.id = ? AND o.user_id = ?
+            ''', (order_id, user_id))
+            ordered = (await cursor.fetchone())[0]
+            if not ordered:
+                return 0, 0
+            
+            # Tracked products get at most what is left in stock
+            added = await self._merge_into_cart(db, user_id, '''
+                SELECT oi.product_id,
+                       CASE WHEN p.stock < SUM(oi.quantity) THEN p.stock
+                            ELSE SUM(oi.quantity) END AS quantity
+                FROM orders o
+                JOIN order_items oi ON oi.order_id = o.id
+                JOIN products p ON p.id = oi.product_id
+                WHERE o.id = ? AND o.user_id = ? AND p.is_available = 1
+                      AND (p.stock IS NULL OR p.stock > 0)
+                GROUP BY oi.product_id, p.stock
+            ''', (order_id, user_id))
+            await db.commit()
+        return added, ordered - added
+    
+    async def get_favourites(self, user_id: int) -> List[int]:
+        """Ids of the user's favourite products, most recent first"""
+        favourites = self._favourites.get(user_id)
+        if favourites is not None:
+            self._favourites.move_to_end(user_id)
+            return favourites
+        
+        async with self._connect() as db:
+            cursor = await db.execute('''
+                SELECT product_id FROM favourites WHERE user_id = ? ORDER BY created_at DESC
+            ''', (user_id,))
+            favourites = [row[0] for row in await cursor.fetchall()]
+        
+        self._favourites[user_id] = favourites
+        if len(self._favourites) > FAVOURITES_CACHE_SIZE:
+            self._favourites.popitem(last=False)
+        return favourites
+    
+    async def toggle_favourite(self, user_id: int, product_id: int) -> bool:
+        """Add the product to favourites or remove it; returns True if it is
+        a favourite now"""
+        async with self._connect() as db:
+            cursor = await db.execute(
+                'DELETE FROM favourites WHERE user_id = ? AND product_id = ?',
+                (user_id, product_id)
+            )
+            added = cursor.rowcount == 0
+            if added:
+                await db.execute(
+                    'INSERT INTO favourites (user_id, product_id) VALUES (?, ?)',
+                    (user_id, product_id)
+                )
+            await db.commit()
+        
+        self._favourites.pop(user_id, None)
+        return added
+    
+    async def add_favourites_to_cart(self, user_id: int) -> int:
+        """Put one of each available favourite product into the cart"""
+        async with self._connect() as db:
+            added = await self._merge_into_cart(db, user_id, '''
+                SELECT f.product_id, 1 AS quantity
+                FROM favourites f JOIN products p ON p.id = f.product_id
+                WHERE f.user_id = ? AND p.is_available = 1 AND (p.stock IS NULL OR p.stock > 0)
+            ''', (user_id,))
+            await db.commit()
+        return added
+    
+    async def get_idle_carts(self, idle_hours: float, limit: int) -> List[Tuple[int, str, int, int]]:
+        """Carts untouched for ``idle_hours`` and not reminded about yet:
+        (user_id, language_code, items, total)"""
+        async with self._connect() as db:
+            cursor = await db.execute('''
+                SELECT c.user_id, COALESCE(u.language_code, 'uz'), SUM(c.quantity),
+                       SUM(c.quantity * p.price)
+                FROM cart c
+                JOIN products p ON p.id = c.product_id
+                LEFT JOIN users u ON u.telegram_id = c.user_id
+                WHERE c.updated_at < datetime('now', ?) AND c.reminded = 0
+                GROUP BY c.user_id, u.language_code
+                LIMIT ?
+            ''', (f'-{idle_hours} hours', limit))
+            return [tuple(row) for row in await cursor.fetchall()]
+    
+    async def mark_carts_reminded(self, user_ids: List[int]):
+        if not user_ids:
+            return
+        async with self._connect() as db:
+            await db.execute(
+                f"UPDATE cart SET reminded = 1 WHERE user_id IN ({','.join('?' * len(user_ids))})",
+                user_ids
+            )
+            await db.commit()
+    
+    async def purge_expired_carts(self, days: int, chunk_size: int = 500) -> int:
+        """Delete carts idle for more than ``days`` days, ``chunk_size`` rows per
+        transaction so the write lock is never held for long; returns rows removed"""
+        removed = 0
+        while True:
+            async with self._connect() as db:
+                cursor = await db.execute('''
+                    DELETE FROM cart WHERE id IN (
+                        SELECT id FROM cart WHERE updated_at < datetime('now', ?) LIMIT ?
+                    )
+                ''', (f'-{days} days', chunk_size))
+                await db.commit()
+            removed += cursor.rowcount
+            if cursor.rowcount < chunk_size:
+                return removed
+            # Let checkouts waiting for the lock go first
+            await asyncio.sleep(0.01)
+    
+    async def get_cart_size(self) -> Tuple[int, int]:
+        """(cart rows, users with a cart)"""
+        async with self._connect() as db:
+            cursor = await db.execute('SELECT COUNT(*), COUNT(DISTINCT user_id) FROM cart')
+            return tuple(await cursor.fetchone())
+    
     async def create_order(self, user_id: int, total_amount: int, delivery_address: str,
                           phone: str, payment_method: str, latitude: float = None,
-                          longitude: float = None, notes: str = None) -> int:
-        """Create new order and return order_id"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute('''
-                INSERT INTO orders 
-                (user_id, total_amount, delivery_address, phone, latitude, longitude, 
-                 payment_method, notes)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (user_id, total_amount, delivery_address, phone, latitude, longitude,
-                  payment_method, notes))
+                          longitude: float = None, notes: str = None,
+                          idempotency_key: str = None, discount_amount: int = 0,
+                          bonus_used: int = 0, promotion_ids: List[int] = ()) -> Optional[int]:
+        """Create new order from the user's cart and return order_id (None if cart is empty).
+        
+        An order already created with the same ``idempotency_key`` is returned
+        instead of creating another one. ``promotion_ids`` and ``bonus_used``
+        are redeemed in the same transaction; RedemptionError is raised if
+        that is no longer possible. ``total_amount`` plus the discount and
+        bonus must equal the cart at current prices, otherwise
+        PriceChangedError is raised and nothing is ordered.
+        """
+        async with self._connect() as db:
+            try:
+                cursor = await db.execute('''
+                    INSERT INTO orders 
+                    (user_id, total_amount, delivery_address, phone, latitude, longitude, 
+                     payment_method, notes, idempotency_key, discount_amount, bonus_used)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (user_id, total_amount, delivery_address, phone, latitude, longitude,
+                      payment_method, notes, idempotency_key, discount_amount, bonus_used))
+            except INTEGRITY_ERRORS:
+                await db.rollback()
+                cursor = await db.execute(
+                    'SELECT id FROM orders WHERE idempotency_key = ?', (idempotency_key,)
+                )
+                row = await cursor.fetchone()
+                return row[0] if row else None
             
             order_id = cursor.lastrowid
             
-            # Move cart items to order_items
-            cart_items = await self.get_cart(user_id)
-            for item in cart_items:
-                await db.execute('''
-                    INSERT INTO order_items (order_id, product_id, quantity, price)
-                    VALUES (?, ?, ?, ?)
-                ''', (order_id, item['product_id'], item['quantity'], item['price']))
+            # Usage limits, the promotion window and the bonus balance are
+            # checked here, under the write lock, so concurrent checkouts
+            # cannot exceed them. Once-per-user codes are claimed through the
+            # promotion_users key, which also holds when checkouts race on
+            # PostgreSQL.
+            for promotion_id in promotion_ids:
+                cursor = await db.execute('''
+                    UPDATE promotions SET used_count = used_count + 1
+                    WHERE id = ? AND is_active = 1
+                      AND (max_uses IS NULL OR used_count < max_uses)
+                      AND (starts_at IS NULL OR starts_at <= datetime('now', 'localtime'))
+                      AND (ends_at IS NULL OR ends_at > datetime('now', 'localtime'))
+                ''', (promotion_id,))
+                if cursor.rowcount <= 0:
+                    await db.rollback()
+                    raise RedemptionError('promotion')
+                try:
+                    await db.execute('''
+                        INSERT INTO promotion_users (promotion_id, user_id)
+                        SELECT id, ? FROM promotions WHERE id = ? AND once_per_user = 1
+                    ''', (user_id, promotion_id))
+                except INTEGRITY_ERRORS:
+                    await db.rollback()
+                    raise RedemptionError('promotion')
+            if promotion_ids:
+                await db.executemany('''
+                    INSERT INTO promotion_redemptions (promotion_id, order_id, user_id)
+                    VALUES (?, ?, ?)
+                ''', [(promotion_id, order_id, user_id) for promotion_id in promotion_ids])
+            if bonus_used:
+                cursor = await db.execute('''
+                    UPDATE users SET bonus_balance = bonus_balance - ?
+                    WHERE telegram_id = ? AND bonus_balance >= ?
+                ''', (bonus_used, user_id, bonus_used))
+                if cursor.rowcount <= 0:
+                    await db.rollback()
+                    raise RedemptionError('bonus')
+            
+            # Reserve stock of tracked products; the insert above holds the
+            # write lock, so concurrent checkouts cannot oversell
+            cursor = await db.execute('''
+                UPDATE products
+                SET stock = stock - (
+                    SELECT SUM(c.quantity) FROM cart c
+                    WHERE c.user_id = ? AND c.product_id = products.id
+                )
+                WHERE stock IS NOT NULL
+                  AND id IN (SELECT product_id FROM cart WHERE user_id = ?)
+                  AND stock >= (
+                    SELECT SUM(c.quantity) FROM cart c
+                    WHERE c.user_id = ? AND c.product_id = products.id
+                  )
+            ''', (user_id, user_id, user_id))
+            reserved = cursor.rowcount
+            cursor = await db.execute('''
+                SELECT id, stock FROM products
+                WHERE stock IS NOT NULL AND id IN (SELECT product_id FROM cart WHERE user_id = ?)
+            ''', (user_id,))
+            levels = [tuple(row) for row in await cursor.fetchall()]
+            if reserved < len(levels):
+                await db.rollback()
+                raise OutOfStockError(await self._stock_shortages(db, user_id))
+            
+            sold_out = False
+            if any(stock <= 0 for _, stock in levels):
+                cursor = await db.execute('''
+                    UPDATE products SET is_available = 0
+                    WHERE stock <= 0 AND is_available = 1
+                      AND id IN (SELECT product_id FROM cart WHERE user_id = ?)
+                ''', (user_id,))
+                sold_out = cursor.rowcount > 0
+            
+            # Move cart items to order_items at current prices
+            cursor = await db.execute('''
+                INSERT INTO order_items (order_id, product_id, quantity, price)
+                SELECT ?, c.product_id, c.quantity, p.price
+                FROM cart c
+                JOIN products p ON c.product_id = p.id
+                WHERE c.user_id = ?
+                ORDER BY c.created_at
+            ''', (order_id, user_id))
+            
+            if cursor.rowcount <= 0:
+                # Cart was emptied meanwhile (e.g. cleared in another chat)
+                await db.rollback()
+                return None
+            
+            # The total was computed when the cart was shown; a price or cart
+            # line changed since then must not be charged at the old amount
+            cursor = await db.execute(
+                'SELECT SUM(quantity * price) FROM order_items WHERE order_id = ?', (order_id,)
+            )
+            subtotal = (await cursor.fetchone())[0]
+            expected = total_amount + discount_amount + bonus_used
+            if subtotal != expected:
+                await db.rollback()
+                raise PriceChangedError(expected, subtotal)
+            
+            await db.execute(
+                "INSERT INTO order_events (order_id, to_status, actor_id) VALUES (?, 'new', ?)",
+                (order_id, user_id)
+            )
+            await db.execute_query(queries.RECORD_HOURLY_SALES, (order_id,))
+            await db.execute_query(queries.RECORD_DAILY_SALES, (order_id,))
             
             # Clear cart
             await db.execute('DELETE FROM cart WHERE user_id = ?', (user_id,))
             
             await db.commit()
-            return order_id
+        
+        if levels and self.stock_listener:
+            self.stock_listener(levels, sold_out)
+        return order_id
+    
+    @staticmethod
+    async def _stock_shortages(db, user_id: int) -> List[int]:
+        """Products in the user's cart with less stock than requested"""
+        cursor = await db.execute('''
+            SELECT p.id FROM products p
+            JOIN (
+                SELECT product_id, SUM(quantity) AS quantity FROM cart
+                WHERE user_id = ? GROUP BY product_id
+            ) c ON c.product_id = p.id
+            WHERE p.stock IS NOT NULL AND p.stock < c.quantity
+        ''', (user_id,))
+        return [row[0] for row in await cursor.fetchall()]
+    
+    async def set_stock(self, product_id: int, stock: Optional[int]) -> bool:
+        """Set stock of a product (None stops tracking it); a product with stock is
+        available, one without is not. Returns False if the product does not exist"""
+        available = stock is None or stock > 0
+        async with self._connect() as db:
+            cursor = await db.execute(
+                'UPDATE products SET stock = ?, is_available = ? WHERE id = ?',
+                (stock, int(available), product_id)
+            )
+            await db.commit()
+            found = cursor.rowcount > 0
+        
+        if found and self.stock_listener:
+            self.stock_listener([(product_id, stock)] if stock is not None else [], True)
+        return found
+    
+    async def get_low_stock(self, threshold: int) -> List[Dict]:
+        """Tracked products with at most ``threshold`` items left, scarcest first"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute('''
+                SELECT id, name_ru, stock, is_available FROM products
+                WHERE stock IS NOT NULL AND stock <= ?
+                ORDER BY stock, id
+            ''', (threshold,))
+            return [dict(row) for row in await cursor.fetchall()]
+
+    async def get_order(self, order_id: int) -> Optional[Dict]:
+        """Get order by id"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute('SELECT * FROM orders WHERE id = ?', (order_id,))
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
+    async def get_order_notice(self, order_id: int) -> Optional[queries.OrderNotice]:
+        """Order with its customer's name and phone, for the admin alert"""
+        async with self._connect() as db:
+            return await db.fetch_one(queries.ORDER_NOTICE, (order_id,))
+    
+    async def get_user_orders(self, user_id: int, limit: int = 10) -> List[queries.UserOrder]:
+        """Newest orders of a user"""
+        async with self._connect() as db:
+            return await db.fetch_all(queries.USER_ORDERS, (user_id, limit))
+    
+    async def get_user_order_totals(self, user_id: int) -> queries.OrderTotals:
+        """Number of orders of a user and the sum of the paid ones"""
+        async with self._connect() as db:
+            return await db.fetch_one(queries.USER_ORDER_TOTALS, (user_id,))
+    
+    async def get_active_orders(self, limit: int = 10) -> List[queries.ActiveOrder]:
+        """Newest orders not handed to a courier yet, with their customer"""
+        async with self._connect() as db:
+            return await db.fetch_all(queries.ACTIVE_ORDERS, (limit,))
+    
+    async def transition_orders(self, order_ids: Optional[List[int]], from_statuses: List[str],
+                                to_status: str, actor_id: Optional[int] = None,
+                                limit: int = 100) -> List[Tuple[int, int, str]]:
+        """Move orders currently in one of from_statuses to to_status, logging an event
+        for each; order_ids=None takes the oldest such orders. Returns (id, user_id,
+        previous status) of the orders that actually changed."""
+        status_marks = ','.join('?' * len(from_statuses))
+        if order_ids is None:
+            where = f'''id IN (
+                SELECT id FROM orders WHERE order_status IN ({status_marks})
+                ORDER BY created_at LIMIT ?
+            )'''
+            params = (*from_statuses, limit)
+        else:
+            where = f"id IN ({','.join('?' * len(order_ids))}) AND order_status IN ({status_marks})"
+            params = (*order_ids, *from_statuses)
+        
+        async with self._connect() as db:
+            # The first write locks the orders it logs (SQLite: the whole
+            # database), so the SELECT and UPDATE below see exactly the rows
+            # the events were written for
+            cursor = await db.execute(f'''
+                INSERT INTO order_events (order_id, from_status, to_status, actor_id)
+                SELECT id, order_status, ?, ? FROM orders WHERE {where}{self.backend.for_update}
+            ''', (to_status, actor_id, *params))
+            if cursor.rowcount <= 0:
+                await db.rollback()
+                return []
+            
+            cursor = await db.execute(
+                f'SELECT id, user_id, order_status FROM orders WHERE {where}', params
+            )
+            changed = [tuple(row) for row in await cursor.fetchall()]
+            await db.execute(f'''
+                UPDATE orders SET order_status = ?, updated_at = datetime('now')
+                WHERE {where}
+            ''', (to_status, *params))
+            levels = []
+            if to_status == 'cancelled':
+                cancelled = [order_id for order_id, _, _ in changed]
+                levels = await self._release_stock(db, cancelled)
+                await self._release_redemptions(db, cancelled)
+            await db.commit()
+        
+        if levels and self.stock_listener:
+            self.stock_listener(levels, any(stock > 0 for _, stock in levels))
+        return changed
+    
+    @staticmethod
+    async def _release_stock(db, order_ids: List[int]) -> List[Tuple[int, int]]:
+        """Return stock reserved by cancelled orders; sold out products become
+        available again. Returns (product_id, stock) of the tracked products"""
+        order_marks = ','.join('?' * len(order_ids))
+        items = f'SELECT product_id FROM order_items WHERE order_id IN ({order_marks})'
+        await db.execute(f'''
+            UPDATE products
+            SET stock = stock + (
+                    SELECT SUM(i.quantity) FROM order_items i
+                    WHERE i.order_id IN ({order_marks}) AND i.product_id = products.id
+                ),
+                is_available = CASE WHEN stock <= 0 THEN 1 ELSE is_available END
+            WHERE stock IS NOT NULL AND id IN ({items})
+        ''', (*order_ids, *order_ids))
+        cursor = await db.execute(
+            f'SELECT id, stock FROM products WHERE stock IS NOT NULL AND id IN ({items})',
+            order_ids
+        )
+        return [tuple(row) for row in await cursor.fetchall()]
+    
+    @staticmethod
+    async def _release_redemptions(db, order_ids: List[int]):
+        """Give back the bonus and promotion uses of cancelled orders"""
+        order_marks = ','.join('?' * len(order_ids))
+        await db.execute(f'''
+            UPDATE users SET bonus_balance = bonus_balance + (
+                SELECT SUM(o.bonus_used) FROM orders o
+                WHERE o.user_id = users.telegram_id AND o.id IN ({order_marks})
+            )
+            WHERE telegram_id IN (
+                SELECT user_id FROM orders WHERE id IN ({order_marks}) AND bonus_used > 0
+            )
+        ''', (*order_ids, *order_ids))
+        await db.execute(f'''
+            UPDATE promotions SET used_count = used_count - (
+                SELECT COUNT(*) FROM promotion_redemptions r
+                WHERE r.promotion_id = promotions.id AND r.order_id IN ({order_marks})
+            )
+            WHERE id IN (
+                SELECT promotion_id FROM promotion_redemptions WHERE order_id IN ({order_marks})
+            )
+        ''', (*order_ids, *order_ids))
+        await db.execute(f'''
+            DELETE FROM promotion_users WHERE EXISTS (
+                SELECT 1 FROM promotion_redemptions r
+                WHERE r.promotion_id = promotion_users.promotion_id
+                  AND r.user_id = promotion_users.user_id AND r.order_id IN ({order_marks})
+            )
+        ''', order_ids)
+        await db.execute(
+            f'DELETE FROM promotion_redemptions WHERE order_id IN ({order_marks})', order_ids
+        )
+    
+    async def get_promotions(self, active_only: bool = False) -> List[Dict]:
+        """Promotions, newest first; active_only drops disabled, expired and used up ones"""
+        where = ''
+        if active_only:
+            where = '''
+                WHERE is_active = 1 AND (max_uses IS NULL OR used_count < max_uses)
+                  AND (ends_at IS NULL OR ends_at > datetime('now', 'localtime'))
+            '''
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(f'SELECT * FROM promotions {where} ORDER BY id DESC')
+            return [dict(row) for row in await cursor.fetchall()]
+    
+    async def add_promotion(self, kind: str, value: int, code: str = None,
+                            product_id: int = None, category_id: int = None,
+                            min_quantity: int = 1, min_total: int = 0,
+                            max_uses: int = None, once_per_user: bool = False,
+                            starts_at: str = None, ends_at: str = None) -> Optional[int]:
+        """Create a promotion; returns its id, or None if the code is taken"""
+        async with self._connect() as db:
+            try:
+                cursor = await db.execute('''
+                    INSERT INTO promotions
+                    (code, kind, value, product_id, category_id, min_quantity, min_total,
+                     max_uses, once_per_user, starts_at, ends_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (code, kind, value, product_id, category_id, min_quantity, min_total,
+                      max_uses, once_per_user, starts_at, ends_at))
+            except INTEGRITY_ERRORS:
+                return None
+            await db.commit()
+            return cursor.lastrowid
+    
+    async def set_promotion_active(self, promotion_id: int, active: bool) -> bool:
+        async with self._connect() as db:
+            cursor = await db.execute(
+                'UPDATE promotions SET is_active = ? WHERE id = ?', (active, promotion_id)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def get_redeemed_promotions(self, user_id: int) -> Set[int]:
+        """Ids of the once-per-user promotions the user redeemed"""
+        async with self._connect() as db:
+            cursor = await db.execute(
+                'SELECT promotion_id FROM promotion_users WHERE user_id = ?', (user_id,)
+            )
+            return {row[0] for row in await cursor.fetchall()}
+    
+    async def has_redeemed(self, promotion_id: int, user_id: int) -> bool:
+        async with self._connect() as db:
+            cursor = await db.execute(
+                'SELECT 1 FROM promotion_users WHERE promotion_id = ? AND user_id = ?',
+                (promotion_id, user_id)
+            )
+            return await cursor.fetchone() is not None
+    
+    async def get_order_events(self, order_id: int) -> List[Dict]:
+        """Get status history of an order, oldest first"""
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute('''
+                SELECT from_status, to_status, actor_id, created_at
+                FROM order_events WHERE order_id = ?
+                ORDER BY id
+            ''', (order_id,))
+            return [dict(row) for row in await cursor.fetchall()]
+    
+    async def add_payment(self, order_id: int, provider: str, invoice_id: str, amount: int):
+        """Record an invoice created with a payment provider"""
+        async with self._connect() as db:
+            await db.execute('''
+                INSERT INTO payments (order_id, provider, invoice_id, amount)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT DO NOTHING
+            ''', (order_id, provider, invoice_id, amount))
+            await db.commit()
+    
+    async def get_payment(self, provider: str, invoice_id: str = None, order_id: int = None,
+                          transaction_id: str = None) -> Optional[Dict]:
+        """Get payment by provider invoice id, order id or provider transaction id"""
+        key_column, key = self._payment_key(invoice_id, order_id, transaction_id)
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cursor = await db.execute(
+                f'SELECT * FROM payments WHERE provider = ? AND {key_column} = ? ORDER BY id DESC',
+                (provider, key)
+            )
+            row = await cursor.fetchone()
+            return dict(row) if row else None
+    
+    @staticmethod
+    def _payment_key(invoice_id: str = None, order_id: int = None,
+                     transaction_id: str = None) -> Tuple[str, Union[str, int]]:
+        if invoice_id is not None:
+            return 'invoice_id', invoice_id
+        if transaction_id is not None:
+            return 'transaction_id', transaction_id
+        return 'order_id', order_id
+    
+    async def start_payment_transaction(self, payment_id: int, transaction_id: str,
+                                        create_time: int) -> bool:
+        """Bind a provider transaction to a pending payment that has none yet"""
+        async with self._connect() as db:
+            cursor = await db.execute('''
+                UPDATE payments SET transaction_id = ?, create_time = ?, updated_at = datetime('now')
+                WHERE id = ? AND status = 'pending' AND transaction_id IS NULL
+            ''', (transaction_id, create_time, payment_id))
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    async def update_payment_status(self, provider: str, status: str, invoice_id: str = None,
+                                    order_id: int = None, transaction_id: str = None,
+                                    from_status: str = 'pending',
+                                    details: Optional[Dict[str, int]] = None
+                                    ) -> Optional[Tuple[int, int]]:
+        """Move a payment in ``from_status`` and its order to ``status``; the
+        payment is found by invoice, order or transaction id. ``details`` sets
+        the transaction time columns. Returns (order_id, user_id), or None if
+        no payment was in ``from_status``."""
+        key_column, key = self._payment_key(invoice_id, order_id, transaction_id)
+        where = f'provider = ? AND {key_column} = ?'
+        details = details or {}
+        assignments = ''.join(f', {column} = ?' for column in details
+                              if column in PAYMENT_DETAIL_COLUMNS)
+        values = [value for column, value in details.items() if column in PAYMENT_DETAIL_COLUMNS]
+        
+        async with self._connect() as db:
+            cursor = await db.execute(f'''
+                UPDATE payments SET status = ?, updated_at = datetime('now'){assignments}
+                WHERE {where} AND status = ?
+            ''', (status, *values, provider, key, from_status))
+            if cursor.rowcount <= 0:
+                await db.rollback()
+                return None
+            
+            cursor = await db.execute('''
+                SELECT o.id, o.user_id FROM orders o
+                WHERE o.id = (SELECT order_id FROM payments WHERE {} LIMIT 1)
+            '''.format(where), (provider, key))
+            row = await cursor.fetchone()
+            if row is None:
+                await db.rollback()
+                return None
+            
+            await db.execute('''
+                UPDATE orders SET payment_status = ?, updated_at = datetime('now')
+                WHERE id = ? AND payment_status = ?
+            ''', (status, row[0], from_status))
+            await db.commit()
+            return row[0], row[1]
+    
+    async def get_job_runs(self) -> Dict[str, str]:
+        """Last run time of every scheduled job"""
+        async with self._connect() as db:
+            cursor = await db.execute('SELECT name, last_run FROM scheduled_jobs')
+            return dict(await cursor.fetchall())
+    
+    async def record_job_run(self, name: str, started_at: str, status: str, duration: float):
+        async with self._connect() as db:
+            await db.execute('''
+                INSERT INTO scheduled_jobs (name, last_run, last_status, last_duration)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET
+                    last_run = excluded.last_run,
+                    last_status = excluded.last_status,
+                    last_duration = excluded.last_duration
+            ''', (name, started_at, status, duration))
+            await db.commit()
+    
+    def maintain(self):
+        """Refresh query planner statistics and merge search index segments.
+        Blocking: run it in an executor"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("INSERT INTO products_fts (products_fts) VALUES ('optimize')")
+            conn.commit()
+            conn.execute('ANALYZE')
+            conn.commit()
+        finally:
+            conn.close()
+    
+    async def set_user_role(self, telegram_id: int, role: str) -> bool:
+        """Set user role; returns False if user does not exist"""
+        async with self._connect() as db:
+            cursor = await db.execute(
+                "UPDATE users SET role = ?, updated_at = datetime('now') WHERE telegram_id = ?",
+                (role, telegram_id)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    
+    @analytics
+    async def get_bot_stats(self) -> Dict[str, int]:
+        """User, order, revenue and product totals for the admin panel"""
+        async with self._connect() as db:
+            cursor = await db.execute('''
+                SELECT
+                    (SELECT COUNT(*) FROM users) AS total_users,
+                    (SELECT COUNT(*) FROM users
+                     WHERE created_at >= date('now', '-7 days')) AS new_users_week,
+                    (SELECT COUNT(*) FROM orders) AS total_orders,
+                    (SELECT COUNT(*) FROM orders
+                     WHERE created_at >= date('now', '-7 days')) AS orders_week,
+                    (SELECT COALESCE(SUM(total_amount), 0) FROM orders
+                     WHERE payment_status = 'completed') AS total_revenue,
+                    (SELECT COUNT(*) FROM products WHERE is_available = 1) AS active_products
+            ''')
+            return dict(await cursor.fetchone())
+    
+    async def get_daily_stats(self) -> queries.DailyStats:
+        """Orders, revenue and new users of today (UTC)"""
+        async with self._connect() as db:
+            return await db.fetch_one(queries.DAILY_STATS)
+    
+    @analytics
+    async def get_user_activity(self) -> List[queries.UserActivity]:
+        """Order count, spending and last order of every customer"""
+        async with self._connect() as db:
+            return await db.fetch_all(queries.USER_ACTIVITY)
+    
+    async def get_purchase_history(self, user_id: int, limit: int = 20) -> List[queries.PurchasedItem]:
+        """Newest ordered items of a user"""
+        async with self._connect() as db:
+            return await db.fetch_all(queries.PURCHASE_HISTORY, (user_id, limit))
+    
+    async def get_popular_products(self, limit: int = 10) -> List[queries.PopularProduct]:
+        """Available products with the most order lines"""
+        async with self._connect() as db:
+            return await db.fetch_all(queries.POPULAR_PRODUCTS, (limit,))
+    
+    async def add_recommendations(self, user_id: int,
+                                  recommendations: List[Tuple[Optional[int], str, float]]):
+        """Store (product_id, type, confidence) recommendations for a user (queued)"""
+        for product_id, recommendation_type, confidence in recommendations:
+            await self.write_behind.submit(
+                queries.ADD_RECOMMENDATION, (user_id, product_id, recommendation_type, confidence)
+            )
+    
+    @analytics
+    async def get_daily_sales(self, start: str, end: str) -> List[queries.DailySales]:
+        """Sales buckets of each product and day from ``start`` to before ``end`` (YYYY-MM-DD)"""
+        async with self._connect() as db:
+            return await db.fetch_all(queries.DAILY_SALES, (start, end))
+    
+    @analytics
+    async def get_hourly_sales(self, start: str, end: str) -> List[queries.HourlySales]:
+        """Units and revenue per hour of the day (UTC) from ``start`` to before ``end``"""
+        async with self._connect() as db:
+            return await db.fetch_all(queries.HOURLY_SALES, (start, end))
+    
+    @analytics
+    async def get_product_performance(self) -> List[queries.ProductPerformance]:
+        """Times ordered, units and revenue of every product"""
+        async with self._connect() as db:
+            return await db.fetch_all(queries.PRODUCT_PERFORMANCE)
+    
+    async def add_events(self, events: List[Tuple[str, int, str, Optional[int]]]):
+        """Append (created_at, user_id, name, object_id) events in one transaction"""
+        async with self._connect_primary() as db:
+            if self.backend.name == 'postgres':
+                await db.copy_records('events', ('created_at', 'user_id', 'name', 'object_id'), events)
+            else:
+                await db.execute_query_many(queries.ADD_EVENT, events)
+            await db.commit()
+    
+    @analytics
+    async def get_funnel(self, steps: Sequence[str], start: str, end: str) -> List[int]:
+        """Users who reached each of ``steps`` in order between ``start`` and
+        ``end``; a step counts the first time it follows the previous one"""
+        progress: Dict[int, int] = {}
+        async with self._connect() as db:
+            cursor = await db.execute_query(queries.FUNNEL_EVENTS, (start, end, *steps))
+            while True:
+                rows = await cursor.fetchmany(10000)
+                if not rows:
+                    break
+                for user_id, name in rows:
+                    reached = progress.get(user_id, 0)
+                    if reached < len(steps) and steps[reached] == name:
+                        progress[user_id] = reached + 1
+        
+        counts = [0] * (len(steps) + 1)
+        for reached in progress.values():
+            counts[reached] += 1
+        # Users stopping at a later step also passed the earlier ones
+        for step in range(len(steps) - 1, 0, -1):
+            counts[step] += counts[step + 1]
+        return counts[1:]
+    
+    @analytics
+    async def get_retention(self, cohort_day: str, days: int = 7) -> Tuple[int, List[int]]:
+        """Number of users registered on ``cohort_day`` (YYYY-MM-DD) and how
+        many of them were active on that day and each of the next ``days``"""
+        first_day = datetime.strptime(cohort_day, '%Y-%m-%d')
+        bounds = [(first_day + timedelta(days=offset)).strftime('%Y-%m-%d')
+                  for offset in range(days + 2)]
+        async with self._connect() as db:
+            size = await db.fetch_value(queries.COHORT_SIZE, (bounds[0], bounds[1]))
+            rows = await db.fetch_all(
+                queries.RETENTION, (bounds[0], bounds[-1], bounds[0], bounds[1])
+            )
+        active = {row.day: row.users for row in rows}
+        return size, [active.get(day, 0) for day in bounds[:-1]]
+    
+    async def get_queue_depth(self) -> int:
+        """Count orders not yet handed to a courier"""
+        async with self._connect() as db:
+            cursor = await db.execute('''
+                SELECT COUNT(*) FROM orders
+                WHERE order_status IN ('new', 'confirmed', 'preparing')
+            ''')
+            return (await cursor.fetchone())[0]
+    
+    async def get_delivery_history(self, days: int, limit: int) -> List[Tuple]:
+        """Recent completed orders as (id, created_at, completed_at, latitude, longitude,
+        category ids), oldest first. Completion time is that of the order's
+        'completed' event; updated_at also changes on later payment updates."""
+        async with self._connect() as db:
+            cursor = await db.execute('''
+                WITH recent AS (
+                    SELECT o.id, o.created_at, e.created_at AS completed_at,
+                           o.latitude, o.longitude
+                    FROM orders o
+                    JOIN order_events e ON e.order_id = o.id AND e.to_status = 'completed'
+                    WHERE o.order_status = 'completed' AND o.created_at >= datetime('now', ?)
+                    ORDER BY o.created_at DESC
+                    LIMIT ?
+                )
+                SELECT r.id, r.created_at, r.completed_at, r.latitude, r.longitude,
+                       GROUP_CONCAT(DISTINCT p.category_id)
+                FROM recent r
+                JOIN order_items oi ON oi.order_id = r.id
+                JOIN products p ON p.id = oi.product_id
+                GROUP BY r.id, r.created_at, r.completed_at, r.latitude, r.longitude
+                ORDER BY r.created_at
+            ''', (f'-{days} days', limit))
+            rows = await cursor.fetchall()
+        
+        return [
+            (*row[:5], tuple(int(c) for c in row[5].split(',')) if row[5] else ())
+            for row in rows
+        ]
+    
+    async def get_dispatchable_orders(self, limit: int = 500) -> List[Tuple[int, float, float]]:
+        """Get (id, latitude, longitude) of ready orders without courier, oldest first"""
+        async with self._connect() as db:
+            cursor = await db.execute('''
+                SELECT id, latitude, longitude FROM orders
+                WHERE order_status = 'ready' AND courier_id IS NULL
+                  AND latitude IS NOT NULL AND longitude IS NOT NULL
+                ORDER BY created_at
+                LIMIT ?
+            ''', (limit,))
+            return [tuple(row) for row in await cursor.fetchall()]
+    
+    async def assign_couriers(self, assignments: List[Tuple[int, int]]) -> Set[int]:
+        """Assign (courier_id, order_id) pairs in one transaction; returns assigned order ids"""
+        assigned = set()
+        async with self._connect() as db:
+            for courier_id, order_id in assignments:
+                cursor = await db.execute('''
+                    UPDATE orders SET courier_id = ?, updated_at = datetime('now')
+                    WHERE id = ? AND courier_id IS NULL
+                ''', (courier_id, order_id))
+                if cursor.rowcount > 0:
+                    assigned.add(order_id)
+            await db.commit()
+        return assigned
 
 # Initialize database instance
 db = Database()
\ No newline at end of file
@@ -1,15 +1,41 @@
 import asyncio
+import time
+from datetime import datetime
 from aiogram import Bot
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from database.models import db
 from config import Config
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Status changes of one order within this many seconds become one message
+STATUS_COALESCE_WINDOW = 3.0
+# Messages per second to different chats; Telegram allows about 30
+BROADCAST_RATE = 25.0
+
+class RateLimiter:
+    """Spaces calls evenly to at most ``rate`` per second"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+    
+    async def wait(self):
+        now = time.monotonic()
+        # Reserve the slot before sleeping so concurrent callers queue up behind it
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
 class NotificationService:
     def __init__(self, bot: Bot):
         self.bot = bot
+        self.limiter = RateLimiter(BROADCAST_RATE)
+        # order_id -> (user_id, latest status) waiting to be sent
+        self._pending_status: Dict[int, Tuple[int, str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
     
     async def notify_admins(self, message: str, parse_mode: Optional[str] = None):
         """Send notification to all admins"""
@@ -25,23 +51,16 @@ class NotificationService:
     
     async def notify_new_order(self, order_id: int):
         """Notify admins about new order"""
-        async with db.get_connection() as conn:
-            cursor = await conn.execute('''
-                SELECT o.*, u.first_name, u.phone
-                FROM orders o
-                JOIN users u ON o.user_id = u.telegram_id
-                WHERE o.id = ?
-            ''', (order_id,))
-            order = await cursor.fetchone()
+        order = await db.get_order_notice(order_id)
         
         if order:
-            message = f"""🆕 **Новый заказ #{order[0]}**
+            message = f"""🆕 **Новый заказ #{order.id}**
 
-👤 Клиент: {order[12]} ({order[13]})
-💰 Сумма: {order[2]:,} сум
-📍 Адрес: {order[3]}
-💳 Оплата: {order[6]}
-📅 Время: {order[9]}
+👤 Клиент: {order.first_name} ({order.phone})
+💰 Сумма: {order.total_amount:,} сум
+📍 Адрес: {order.delivery_address}
+💳 Оплата: {order.payment_method}
+📅 Время: {order.created_at}
 
 Требует подтверждения!"""
             
@@ -70,18 +89,66 @@ class NotificationService:
         except Exception as e:
             logger.error(f"Failed to notify user {user_id} about order status: {e}")
     
+    def queue_status_change(self, order_id: int, new_status: str, user_id: int):
+        """Notify customer about a status change after a short delay; later changes
+        of the same order replace earlier ones"""
+        self._pending_status[order_id] = (user_id, new_status)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_status_changes_later())
+    
+    async def _flush_status_changes_later(self):
+        try:
+            await asyncio.sleep(STATUS_COALESCE_WINDOW)
+        finally:
+            self._flush_task = None
+        await self.flush_status_changes()
+    
+    async def flush_status_changes(self):
+        """Send all queued status notifications now"""
+        pending, self._pending_status = self._pending_status, {}
+        for order_id, (user_id, status) in pending.items():
+            await self.notify_order_status_change(order_id, status, user_id)
+    
+    async def close(self):
+        """Deliver queued notifications before shutdown"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush_status_changes()
+    
     async def notify_low_stock(self, product_id: int, current_stock: int):
         """Notify admins about low stock"""
-        async with db.get_connection() as conn:
-            cursor = await conn.execute(
-                'SELECT name_ru FROM products WHERE id = ?',
-                (product_id,)
-            )
-            product = await cursor.fetchone()
+        await self.notify_low_stock_batch({product_id: current_stock})
+    
+    async def notify_low_stock_batch(self, levels: Dict[int, int]):
+        """Notify admins about several low stock products in one message"""
+        if not levels:
+            return
+        names = await db.get_product_names(list(levels))
         
-        if product:
-            message = f"⚠️ **Низкий остаток товара**\n\n📦 {product[0]}\n📊 Остаток: {current_stock} шт."
-            await self.notify_admins(message, parse_mode='Markdown')
+        lines = [
+            f"📦 {names[product_id]}\n📊 Остаток: {levels[product_id]} шт."
+            for product_id in sorted(levels, key=levels.get) if product_id in names
+        ]
+        if lines:
+            # Plain text: product names may contain Markdown characters
+            message = "⚠️ Низкий остаток товара\n\n" + "\n\n".join(lines)
+            await self.notify_admins(message)
+    
+    async def send_many(self, messages: List[Tuple[int, str]]) -> int:
+        """Send (user_id, text) messages concurrently within the broadcast rate
+        limit; returns the number delivered"""
+        async def send(user_id: int, text: str) -> bool:
+            await self.limiter.wait()
+            try:
+                await self.bot.send_message(chat_id=user_id, text=text)
+                return True
+            except Exception as e:
+                logger.error(f"Failed to send message to user {user_id}: {e}")
+                return False
+        
+        results = await asyncio.gather(*(send(user_id, text) for user_id, text in messages))
+        return sum(results)
     
     async def send_promotional_message(self, user_ids: List[int], message: str):
         """Send promotional message to users"""
@@ -130,29 +197,13 @@ class NotificationService:
     
     async def send_daily_stats(self):
         """Send daily statistics to admins"""
-        async with db.get_connection() as conn:
-            # Get today's statistics
-            cursor = await conn.execute('''
-                SELECT 
-                    COUNT(*) as orders_count,
-                    COALESCE(SUM(total_amount), 0) as revenue
-                FROM orders 
-                WHERE DATE(created_at) = DATE('now')
-            ''')
-            today_stats = await cursor.fetchone()
-            
-            cursor = await conn.execute('''
-                SELECT COUNT(*) 
-                FROM users 
-                WHERE DATE(created_at) = DATE('now')
-            ''')
-            new_users = (await cursor.fetchone())[0]
+        stats = await db.get_daily_stats()
         
         message = f"""📊 **Статистика за сегодня**
 
-📋 Заказов: {today_stats[0]}
-💰 Выручка: {today_stats[1]:,} сум
-👥 Новых пользователей: {new_users}
+📋 Заказов: {stats.orders_count}
+💰 Выручка: {stats.revenue:,} сум
+👥 Новых пользователей: {stats.new_users}
 
 📅 {datetime.now().strftime('%d.%m.%Y')}"""
         
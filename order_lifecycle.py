@@ -0,0 +1,70 @@
+"""Order lifecycle: allowed status transitions and how they are applied.
+
+Every status change goes through ``transition``, which updates the orders
+and appends to ``order_events`` in one transaction, in bulk when given
+several orders. Customers are told about changes through the notification
+queue, which merges quick successive changes of one order into a single
+message. Completed orders train the ETA model; cancelled ones are dropped
+from it.
+"""
+from typing import Dict, List, Optional, Set
+
+from database.models import db
+from utils import notifications
+from utils.eta import eta_model
+
+ORDER_STATUSES = ['new', 'confirmed', 'preparing', 'ready', 'delivering', 'completed', 'cancelled']
+
+# status -> statuses it may move to
+TRANSITIONS: Dict[str, Set[str]] = {
+    'new': {'confirmed', 'cancelled'},
+    'confirmed': {'preparing', 'cancelled'},
+    'preparing': {'ready', 'cancelled'},
+    'ready': {'delivering', 'cancelled'},
+    'delivering': {'completed'},
+    'completed': set(),
+    'cancelled': set(),
+}
+
+# Inverse table: status -> statuses it may be reached from
+_SOURCES: Dict[str, List[str]] = {
+    status: [source for source in ORDER_STATUSES if status in TRANSITIONS[source]]
+    for status in ORDER_STATUSES
+}
+
+
+def can_transition(from_status: str, to_status: str) -> bool:
+    return to_status in TRANSITIONS.get(from_status, ())
+
+
+async def transition(order_ids: Optional[List[int]], to_status: str,
+                     actor_id: Optional[int] = None, from_status: Optional[str] = None,
+                     limit: int = 100) -> List[int]:
+    """Move orders to ``to_status`` where the transition table allows it.
+
+    With ``order_ids=None`` up to ``limit`` oldest orders in ``from_status``
+    are moved. Orders in a status that cannot reach ``to_status`` are left
+    untouched. Returns ids of the orders that changed.
+    """
+    if to_status not in _SOURCES:
+        raise ValueError(f"Unknown order status: {to_status}")
+    sources = _SOURCES[to_status]
+    if from_status is not None:
+        if from_status not in sources:
+            raise ValueError(f"Transition {from_status} -> {to_status} is not allowed")
+        sources = [from_status]
+    if not sources or order_ids == []:
+        return []
+
+    changed = await db.transition_orders(order_ids, sources, to_status, actor_id, limit)
+
+    service = notifications.notification_service
+    if service:
+        for order_id, user_id, _ in changed:
+            service.queue_status_change(order_id, to_status, user_id)
+    changed_ids = [order_id for order_id, _, _ in changed]
+    if to_status == 'completed':
+        eta_model.observe(changed_ids)
+    elif to_status == 'cancelled':
+        eta_model.forget(changed_ids)
+    return changed_ids
@@ -0,0 +1,400 @@
+"""Online payments through Payme and Click.
+
+Checkout creates an invoice with the chosen provider over one shared,
+pooled HTTP session and sends the customer its payment link. Providers
+report the outcome to webhooks served by ``utils.webserver``; a report
+moves a payment out of 'pending' at most once, so retried webhooks are
+answered but change nothing. Callbacks are checked against the stored
+payment: an unknown order or a different amount is refused before anything
+is marked paid.
+"""
+import base64
+import hashlib
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Optional, Tuple, Union
+
+import aiohttp
+from aiogram import Bot
+from aiohttp import web
+
+from config import Config
+from database.models import db
+from localization.texts import get_text
+from utils.metrics import metrics
+from utils.webserver import add_route
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a provider to create an invoice
+INVOICE_TIMEOUT = 10
+# Connections kept open to the providers
+HTTP_POOL_SIZE = 20
+
+# Outcome reported by a webhook:
+# ('invoice_id' | 'order_id' | 'transaction_id', key value, new status)
+PaymentEvent = Tuple[str, Union[str, int], str]
+
+# Payme transaction state of each payment status
+PAYME_STATES = {'pending': 1, 'completed': 2, 'cancelled': -1, 'refunded': -2}
+
+
+class PaymentError(Exception):
+    """Provider rejected a request or answered with something unexpected"""
+
+
+class Invoice:
+    def __init__(self, invoice_id: str, pay_url: str):
+        self.invoice_id = invoice_id
+        self.pay_url = pay_url
+
+
+class WebhookResult:
+    """Parsed provider callback: the answer to send and the outcome it reports"""
+
+    def __init__(self, response: web.Response, event: Optional[PaymentEvent] = None,
+                 not_found: Optional[web.Response] = None, from_status: str = 'pending',
+                 details: Optional[Dict[str, int]] = None):
+        self.response = response
+        self.event = event
+        # Answer when the event refers to an unknown payment; providers retry on it
+        self.not_found = response if not_found is None else not_found
+        # Status the payment must be in for the event to apply, and columns it sets
+        self.from_status = from_status
+        self.details = details
+
+
+class PaymentProvider(ABC):
+    """One payment service: invoice creation and webhook parsing"""
+
+    name: str
+
+    @abstractmethod
+    async def create_invoice(self, session: aiohttp.ClientSession, order_id: int,
+                             amount: int, phone: str) -> Invoice:
+        """Create an invoice for ``amount`` som"""
+
+    @abstractmethod
+    async def parse_webhook(self, request: web.Request) -> WebhookResult:
+        """Parse a provider callback"""
+
+
+class PaymeProvider(PaymentProvider):
+    """Payme receipts (Subscribe API) with Merchant API callbacks"""
+
+    name = 'payme'
+
+    def __init__(self, merchant_id: str, key: str, api_url: str, checkout_url: str):
+        self.merchant_id = merchant_id
+        self.key = key
+        self.api_url = api_url
+        self.checkout_url = checkout_url.rstrip('/')
+
+    async def create_invoice(self, session, order_id, amount, phone):
+        payload = {
+            'id': order_id,
+            'method': 'receipts.create',
+            # Payme amounts are in tiyin
+            'params': {'amount': amount * 100, 'account': {'order_id': str(order_id)}},
+        }
+        headers = {'X-Auth': f"{self.merchant_id}:{self.key}"}
+        async with session.post(self.api_url, json=payload, headers=headers) as response:
+            data = await response.json(content_type=None)
+        if 'error' in data:
+            raise PaymentError(f"Payme: {data['error']}")
+        receipt_id = data['result']['receipt']['_id']
+        return Invoice(receipt_id, f"{self.checkout_url}/{receipt_id}")
+
+    def _authorized(self, request: web.Request) -> bool:
+        expected = base64.b64encode(f"Paycom:{self.key}".encode()).decode()
+        return request.headers.get('Authorization') == f"Basic {expected}"
+
+    async def parse_webhook(self, request):
+        data = await request.json()
+        request_id = data.get('id')
+
+        def error(code: int, message: str) -> WebhookResult:
+            return WebhookResult(web.json_response({'id': request_id, 'error': {
+                'code': code, 'message': message
+            }}))
+
+        def result(**fields) -> web.Response:
+            return web.json_response({'id': request_id, 'result': fields})
+
+        if not self._authorized(request):
+            return error(-32504, 'Insufficient privileges')
+
+        method = data.get('method')
+        params = data.get('params') or {}
+        transaction = str(params.get('id', ''))
+        now = int(time.time() * 1000)
+
+        if method in ('CheckPerformTransaction', 'CreateTransaction'):
+            account = params.get('account') or {}
+            order_id = str(account.get('order_id', ''))
+            payment = await db.get_payment(self.name, order_id=int(order_id)) \
+                if order_id.isdigit() else None
+            if payment is None:
+                return error(-31050, 'Order not found')
+            if params.get('amount') != payment['amount'] * 100:
+                return error(-31001, 'Invalid amount')
+            if method == 'CheckPerformTransaction':
+                if payment['status'] != 'pending' or payment['transaction_id']:
+                    return error(-31008, 'Unable to perform operation')
+                return WebhookResult(result(allow=True))
+
+            # CreateTransaction: repeated calls for the same transaction get the same answer
+            if payment['transaction_id'] is None and payment['status'] == 'pending':
+                if await db.start_payment_transaction(payment['id'], transaction, now):
+                    return WebhookResult(result(create_time=now, transaction=transaction, state=1))
+                payment = await db.get_payment(self.name, order_id=int(order_id))
+            if payment['transaction_id'] != transaction or payment['status'] != 'pending':
+                # The order is paid, cancelled or awaits another transaction
+                return error(-31008, 'Unable to perform operation')
+            return WebhookResult(result(
+                create_time=payment['create_time'], transaction=transaction, state=1
+            ))
+
+        if method not in ('PerformTransaction', 'CancelTransaction', 'CheckTransaction'):
+            return error(-32601, 'Method not found')
+        payment = await db.get_payment(self.name, transaction_id=transaction) \
+            if transaction else None
+        if payment is None:
+            return error(-31003, 'Transaction not found')
+        status = payment['status']
+        state = PAYME_STATES.get(status, -1)
+
+        if method == 'CheckTransaction':
+            return WebhookResult(result(
+                create_time=payment['create_time'], perform_time=payment['perform_time'] or 0,
+                cancel_time=payment['cancel_time'] or 0, transaction=transaction,
+                state=state, reason=payment['cancel_reason']
+            ))
+
+        if method == 'PerformTransaction':
+            if status == 'completed':
+                return WebhookResult(result(
+                    perform_time=payment['perform_time'], transaction=transaction, state=2
+                ))
+            if status != 'pending':
+                return error(-31008, 'Unable to perform operation')
+            return WebhookResult(
+                result(perform_time=now, transaction=transaction, state=2),
+                ('transaction_id', transaction, 'completed'), details={'perform_time': now}
+            )
+
+        # CancelTransaction: before payment it cancels, after it refunds
+        if status in ('cancelled', 'refunded'):
+            return WebhookResult(result(
+                cancel_time=payment['cancel_time'], transaction=transaction, state=state
+            ))
+        cancelled = 'refunded' if status == 'completed' else 'cancelled'
+        return WebhookResult(
+            result(cancel_time=now, transaction=transaction, state=PAYME_STATES[cancelled]),
+            ('transaction_id', transaction, cancelled), from_status=status,
+            details={'cancel_time': now, 'cancel_reason': params.get('reason')}
+        )
+
+
+class ClickProvider(PaymentProvider):
+    """Click Merchant API invoices with Prepare/Complete callbacks"""
+
+    name = 'click'
+
+    def __init__(self, service_id: str, merchant_id: str, merchant_user_id: str,
+                 secret_key: str, api_url: str):
+        self.service_id = service_id
+        self.merchant_id = merchant_id
+        self.merchant_user_id = merchant_user_id
+        self.secret_key = secret_key
+        self.api_url = api_url.rstrip('/')
+
+    def _auth_header(self) -> str:
+        timestamp = str(int(time.time()))
+        digest = hashlib.sha1((timestamp + self.secret_key).encode()).hexdigest()
+        return f"{self.merchant_user_id}:{digest}:{timestamp}"
+
+    async def create_invoice(self, session, order_id, amount, phone):
+        payload = {
+            'service_id': int(self.service_id),
+            'amount': amount,
+            'phone_number': (phone or '').lstrip('+'),
+            'merchant_trans_id': str(order_id),
+        }
+        headers = {'Auth': self._auth_header(), 'Accept': 'application/json'}
+        async with session.post(f"{self.api_url}/invoice/create", json=payload,
+                                headers=headers) as response:
+            data = await response.json(content_type=None)
+        if data.get('error_code') != 0:
+            raise PaymentError(f"Click: {data.get('error_note')}")
+        pay_url = (f"https://my.click.uz/services/pay?service_id={self.service_id}"
+                   f"&merchant_id={self.merchant_id}&amount={amount}&transaction_param={order_id}")
+        return Invoice(str(data['invoice_id']), pay_url)
+
+    def sign(self, form) -> str:
+        """Signature of a Prepare (action 0) or Complete (action 1) request"""
+        prepare_id = form.get('merchant_prepare_id', '') if form.get('action') == '1' else ''
+        raw = (f"{form.get('click_trans_id')}{form.get('service_id')}{self.secret_key}"
+               f"{form.get('merchant_trans_id')}{prepare_id}{form.get('amount')}"
+               f"{form.get('action')}{form.get('sign_time')}")
+        return hashlib.md5(raw.encode()).hexdigest()
+
+    async def parse_webhook(self, request):
+        form = await request.post()
+        answer = {
+            'click_trans_id': form.get('click_trans_id'),
+            'merchant_trans_id': form.get('merchant_trans_id'),
+        }
+
+        def error(code: int, note: str) -> WebhookResult:
+            return WebhookResult(web.json_response({**answer, 'error': code, 'error_note': note}))
+
+        if form.get('sign_string') != self.sign(form):
+            return error(-1, 'SIGN CHECK FAILED')
+
+        order_id = int(form.get('merchant_trans_id'))
+        preparing = form.get('action') == '0'
+        payment = await db.get_payment(self.name, order_id=order_id)
+        if payment is None:
+            return error(-5 if preparing else -6,
+                         'User does not exist' if preparing else 'Transaction does not exist')
+        # The amount comes from the payment page, which the customer can edit
+        if abs(float(form.get('amount')) - payment['amount']) >= 0.01:
+            return error(-2, 'Incorrect parameter amount')
+        if payment['status'] == 'cancelled':
+            return error(-9, 'Transaction cancelled')
+
+        if preparing:
+            if payment['status'] != 'pending':
+                return error(-4, 'Already paid')
+            return WebhookResult(web.json_response({**answer, 'merchant_prepare_id': order_id,
+                                                    'error': 0, 'error_note': 'Success'}))
+
+        if form.get('merchant_prepare_id') != str(order_id):
+            return error(-6, 'Transaction does not exist')
+        status = 'completed' if form.get('error') == '0' else 'cancelled'
+        return WebhookResult(
+            web.json_response({**answer, 'merchant_confirm_id': order_id,
+                               'error': 0, 'error_note': 'Success'}),
+            ('order_id', order_id, status),
+            web.json_response({**answer, 'error': -6, 'error_note': 'Transaction does not exist'})
+        )
+
+
+class PaymentGateway:
+    def __init__(self):
+        self.providers: Dict[str, PaymentProvider] = {}
+        self.bot: Optional[Bot] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        # order_id -> monotonic time its invoice was created
+        self._invoiced_at: Dict[int, float] = {}
+
+    def setup(self, bot: Bot):
+        """Enable configured providers and register their webhooks;
+        must run before the web server starts"""
+        self.bot = bot
+        if Config.PAYME_MERCHANT_ID and Config.PAYME_KEY:
+            self.register(PaymeProvider(
+                Config.PAYME_MERCHANT_ID, Config.PAYME_KEY,
+                Config.PAYME_API_URL, Config.PAYME_CHECKOUT_URL
+            ))
+        if Config.CLICK_SERVICE_ID and Config.CLICK_SECRET_KEY:
+            self.register(ClickProvider(
+                Config.CLICK_SERVICE_ID, Config.CLICK_MERCHANT_ID,
+                Config.CLICK_MERCHANT_USER_ID, Config.CLICK_SECRET_KEY, Config.CLICK_API_URL
+            ))
+
+    def register(self, provider: PaymentProvider):
+        if provider.name in self.providers:
+            return
+        self.providers[provider.name] = provider
+
+        async def webhook(request: web.Request) -> web.Response:
+            return await self.handle_webhook(provider, request)
+        add_route('POST', f'/payments/{provider.name}', webhook)
+
+    def supports(self, method: str) -> bool:
+        return method in self.providers
+
+    def session(self) -> aiohttp.ClientSession:
+        """Shared HTTP session; keeps provider connections alive between checkouts"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=INVOICE_TIMEOUT)
+            )
+        return self._session
+
+    async def create_invoice(self, method: str, order_id: int, amount: int,
+                             phone: str) -> Optional[Invoice]:
+        """Create and store an invoice; None if the provider failed"""
+        provider = self.providers[method]
+        try:
+            with metrics.timer('payment', f'{method}_invoice'):
+                invoice = await provider.create_invoice(self.session(), order_id, amount, phone)
+        except (aiohttp.ClientError, PaymentError, KeyError, ValueError) as e:
+            logger.error(f"Invoice for order {order_id} via {method} failed: {e}")
+            metrics.incr(f'payment_{method}_errors')
+            return None
+
+        await db.add_payment(order_id, method, invoice.invoice_id, amount)
+        self._invoiced_at[order_id] = time.monotonic()
+        return invoice
+
+    async def handle_webhook(self, provider: PaymentProvider, request: web.Request) -> web.Response:
+        try:
+            result = await provider.parse_webhook(request)
+        except (json.JSONDecodeError, ValueError) as e:
+            logger.warning(f"Malformed {provider.name} webhook: {e}")
+            return web.Response(status=400)
+        if result.event is None:
+            return result.response
+
+        key, value, status = result.event
+
+        async def update():
+            return await db.update_payment_status(
+                provider.name, status, from_status=result.from_status,
+                details=result.details, **{key: value}
+            )
+
+        changed = await update()
+        if changed is None:
+            payment = await db.get_payment(provider.name, **{key: value})
+            if payment is None:
+                return result.not_found
+            if payment['status'] != result.from_status:
+                # Already processed: a redelivered webhook
+                return result.response
+            # The invoice was stored while the first attempt ran
+            changed = await update()
+            if changed is None:
+                return result.response
+
+        order_id, user_id = changed
+        invoiced_at = self._invoiced_at.pop(order_id, None)
+        if invoiced_at is not None and status == 'completed':
+            metrics.observe('payment', 'invoice_to_paid', time.monotonic() - invoiced_at)
+        metrics.incr(f'payment_{status}')
+        if self.bot and status == 'completed':
+            await self._notify_paid(order_id, user_id)
+        return result.response
+
+    async def _notify_paid(self, order_id: int, user_id: int):
+        user = await db.get_user(user_id)
+        lang = user.lang if user else 'uz'
+        try:
+            await self.bot.send_message(user_id, get_text('payment_received', lang).format(order_id))
+        except Exception as e:
+            logger.error(f"Failed to notify user {user_id} about payment: {e}")
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+
+# Global payment gateway instance
+payment_gateway = PaymentGateway()
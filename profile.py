@@ -4,8 +4,13 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 from database.models import db
-from keyboards.keyboards import get_profile_keyboard, get_main_menu_keyboard
+from handlers.cart import cart_view
+from keyboards.keyboards import (
+    get_profile_keyboard, get_main_menu_keyboard, get_my_orders_keyboard,
+    get_favourites_keyboard
+)
 from localization.texts import get_text
+from utils.catalog_cache import catalog_cache
 
 router = Router()
 
@@ -20,30 +25,19 @@ async def show_profile(message: Message):
     if not user:
         return
     
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     # Get user statistics
-    async with db.get_connection() as conn:
-        cursor = await conn.execute(
-            'SELECT COUNT(*) FROM orders WHERE user_id = ?',
-            (message.from_user.id,)
-        )
-        order_count = (await cursor.fetchone())[0]
-        
-        cursor = await conn.execute(
-            'SELECT COALESCE(SUM(total_amount), 0) FROM orders WHERE user_id = ? AND payment_status = "completed"',
-            (message.from_user.id,)
-        )
-        total_spent = (await cursor.fetchone())[0]
+    totals = await db.get_user_order_totals(message.from_user.id)
     
     profile_text = get_text('profile_info', lang).format(
-        user.get('first_name', 'N/A'),
-        user.get('phone', get_text('not_set', lang)),
-        user.get('address', get_text('not_set', lang)),
-        order_count,
-        f"{total_spent:,}",
-        f"{user.get('bonus_balance', 0):,}",
-        user.get('referral_code', 'N/A')
+        user.first_name or 'N/A',
+        user.phone or get_text('not_set', lang),
+        user.address or get_text('not_set', lang),
+        totals.order_count,
+        f"{totals.total_spent:,}",
+        f"{user.bonus_balance or 0:,}",
+        user.referral_code or 'N/A'
     )
     
     await message.answer(
@@ -56,7 +50,7 @@ async def show_profile(message: Message):
 async def edit_phone(callback: CallbackQuery, state: FSMContext):
     """Edit phone number"""
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     await callback.message.edit_text(
         get_text('enter_new_phone', lang),
@@ -69,7 +63,7 @@ async def edit_phone(callback: CallbackQuery, state: FSMContext):
 async def phone_updated(message: Message, state: FSMContext):
     """Handle phone update"""
     user = await db.get_user(message.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     phone = message.text
     await db.update_user_profile(message.from_user.id, phone=phone)
@@ -85,7 +79,7 @@ async def phone_updated(message: Message, state: FSMContext):
 async def edit_address(callback: CallbackQuery, state: FSMContext):
     """Edit address"""
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     await callback.message.edit_text(
         get_text('enter_new_address', lang),
@@ -98,7 +92,7 @@ async def edit_address(callback: CallbackQuery, state: FSMContext):
 async def address_updated(message: Message, state: FSMContext):
     """Handle address update"""
     user = await db.get_user(message.from_user.id)
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     address = message.text
     await db.update_user_profile(message.from_user.id, address=address)
@@ -114,17 +108,9 @@ async def address_updated(message: Message, state: FSMContext):
 async def show_my_orders(callback: CallbackQuery):
     """Show user's orders"""
     user = await db.get_user(callback.from_user.id)
-    lang = user.get('language_code', 'uz')
-    
-    async with db.get_connection() as conn:
-        cursor = await conn.execute('''
-            SELECT id, total_amount, order_status, created_at, delivery_address
-            FROM orders 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 10
-        ''', (callback.from_user.id,))
-        orders = await cursor.fetchall()
+    lang = user.lang
+    
+    orders = await db.get_user_orders(callback.from_user.id, 10)
     
     if not orders:
         await callback.message.edit_text(
@@ -143,15 +129,72 @@ async def show_my_orders(callback: CallbackQuery):
             'delivering': '🚚',
             'completed': '✅',
             'cancelled': '❌'
-        }.get(order[2], '❓')
+        }.get(order.order_status, '❓')
         
-        orders_text += f"{status_emoji} **Заказ #{order[0]}**\n"
-        orders_text += f"💰 {order[1]:,} сум\n"
-        orders_text += f"📍 {order[4]}\n"
-        orders_text += f"📅 {order[3]}\n\n"
+        orders_text += f"{status_emoji} **Заказ #{order.id}**\n"
+        orders_text += f"💰 {order.total_amount:,} сум\n"
+        orders_text += f"📍 {order.delivery_address}\n"
+        orders_text += f"📅 {order.created_at}\n\n"
     
     await callback.message.edit_text(
         orders_text,
-        reply_markup=get_profile_keyboard(lang),
+        reply_markup=get_my_orders_keyboard([order.id for order in orders], lang),
         parse_mode='Markdown'
-    )
\ No newline at end of file
+    )
+
+async def _show_cart(callback: CallbackQuery, state: FSMContext, user: dict):
+    """Replace the message with the cart, ready for checkout"""
+    view = await cart_view(user, state)
+    if view is not None:
+        text, keyboard = view
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode='Markdown')
+
+@router.callback_query(F.data.startswith("repeat_order_"))
+async def repeat_order(callback: CallbackQuery, state: FSMContext):
+    """Copy a past order into the cart"""
+    order_id = int(callback.data.split("_")[2])
+    
+    user = await db.get_user(callback.from_user.id)
+    lang = user.lang
+    
+    added, skipped = await db.repeat_order(callback.from_user.id, order_id)
+    if not added:
+        await callback.answer(get_text('repeat_order_unavailable', lang), show_alert=True)
+        return
+    
+    await _show_cart(callback, state, user)
+    if skipped:
+        await callback.answer(get_text('order_repeated_partly', lang).format(added, skipped), show_alert=True)
+    else:
+        await callback.answer(get_text('order_repeated', lang).format(added))
+
+@router.callback_query(F.data == "favourites")
+async def show_favourites(callback: CallbackQuery):
+    """Show user's favourite products"""
+    user = await db.get_user(callback.from_user.id)
+    lang = user.lang
+    
+    favourites = await db.get_favourites(callback.from_user.id)
+    # Served from the catalog snapshot, which only holds available products
+    await catalog_cache.ensure_loaded()
+    products = [catalog_cache.products[pid] for pid in favourites if pid in catalog_cache.products]
+    
+    await callback.message.edit_text(
+        get_text('favourites_list' if products else 'no_favourites', lang),
+        reply_markup=get_favourites_keyboard(products, lang),
+        parse_mode='Markdown'
+    )
+
+@router.callback_query(F.data == "favourites_to_cart")
+async def favourites_to_cart(callback: CallbackQuery, state: FSMContext):
+    """Put all available favourites into the cart"""
+    user = await db.get_user(callback.from_user.id)
+    lang = user.lang
+    
+    added = await db.add_favourites_to_cart(callback.from_user.id)
+    if not added:
+        await callback.answer(get_text('repeat_order_unavailable', lang), show_alert=True)
+        return
+    
+    await _show_cart(callback, state, user)
+    await callback.answer(get_text('order_repeated', lang).format(added))
\ No newline at end of file
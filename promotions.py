@@ -0,0 +1,268 @@
+"""Discounts at checkout: promo codes, automatic rules and bonus redemption.
+
+Active promotions are loaded from the ``promotions`` table and compiled
+into an index keyed by product and by category, so pricing a cart is one
+pass over its lines with a dictionary lookup each. A line gets the best
+single discount among the rules targeting its product or category; rules
+without a target then apply to what is left of the cart. A promo code
+adds its rule to the candidates only for the cart it was entered for.
+
+Bonus balance pays for at most ``Config.BONUS_MAX_PERCENT`` of the
+discounted total. Once-per-user rules the customer already redeemed are
+left out of the quote. Nothing is reserved here: usage limits, once-per-user
+rules and the balance are checked again and charged by
+``Database.create_order`` in the order transaction.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from config import Config
+from database.models import db
+from database.queries import CartItem
+
+class Rule:
+    """One promotion compiled for evaluation"""
+
+    __slots__ = ('id', 'code', 'kind', 'value', 'product_id', 'category_id',
+                 'min_quantity', 'min_total', 'once_per_user', 'starts_at', 'ends_at')
+
+    def __init__(self, row: Dict):
+        self.id = row['id']
+        self.code = row['code']
+        self.kind = row['kind']
+        self.value = row['value']
+        self.product_id = row['product_id']
+        self.category_id = row['category_id']
+        self.min_quantity = row['min_quantity'] or 1
+        self.min_total = row['min_total'] or 0
+        self.once_per_user = bool(row['once_per_user'])
+        self.starts_at = _parse_time(row['starts_at'])
+        self.ends_at = _parse_time(row['ends_at'])
+
+    @property
+    def is_cart_wide(self) -> bool:
+        return self.product_id is None and self.category_id is None
+
+    def is_live(self, now: datetime, subtotal: int) -> bool:
+        return ((self.starts_at is None or self.starts_at <= now)
+                and (self.ends_at is None or now < self.ends_at)
+                and subtotal >= self.min_total)
+
+    def targets(self, item: CartItem) -> bool:
+        if self.product_id is not None:
+            return item.product_id == self.product_id
+        return self.category_id is not None and item.category_id == self.category_id
+
+    def line_discount(self, price: int, quantity: int) -> int:
+        """Discount on one cart line"""
+        if self.kind == 'percent':
+            return price * quantity * self.value // 100
+        if self.kind == 'fixed':
+            return min(self.value, price) * quantity
+        # Bundle: ``value`` of every ``min_quantity`` units are free
+        return quantity // self.min_quantity * self.value * price
+
+    def cart_discount(self, amount: int) -> int:
+        """Discount on the whole cart"""
+        if self.kind == 'percent':
+            return amount * self.value // 100
+        if self.kind == 'fixed':
+            return min(self.value, amount)
+        return 0
+
+    def describe(self) -> str:
+        if self.kind == 'percent':
+            value = f"-{self.value}%"
+        elif self.kind == 'fixed':
+            value = f"-{self.value:,} сум"
+        else:
+            value = f"{self.min_quantity - self.value}+{self.value}"
+        if self.product_id is not None:
+            target = f"товар #{self.product_id}"
+        elif self.category_id is not None:
+            target = f"категория #{self.category_id}"
+        else:
+            target = "вся корзина"
+        return f"{self.code or 'авто'}: {value}, {target}"
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    return datetime.strptime(value, '%Y-%m-%d %H:%M:%S') if value else None
+
+
+def parse_promotion(args: List[str]) -> Dict:
+    """Keyword arguments of ``Database.add_promotion`` from admin command
+    arguments: ``<CODE|auto> <10%|5000|2+1> [p<id>|c<id>] [min=<sum>]
+    [uses=<n>] [once] [until=<YYYY-MM-DD>]``; raises ValueError"""
+    if len(args) < 2:
+        raise ValueError("code and value are required")
+    code, value, options = args[0], args[1], args[2:]
+    promotion: Dict = {'code': None if code.lower() == 'auto' else code.upper()}
+
+    if value.endswith('%') and value[:-1].isdigit() and 0 < int(value[:-1]) <= 100:
+        promotion.update(kind='percent', value=int(value[:-1]))
+    elif value.isdigit() and int(value) > 0:
+        promotion.update(kind='fixed', value=int(value))
+    elif '+' in value and all(part.isdigit() and int(part) > 0 for part in value.split('+', 1)):
+        paid, free = (int(part) for part in value.split('+', 1))
+        promotion.update(kind='bundle', value=free, min_quantity=paid + free)
+    else:
+        raise ValueError(f"bad value {value}")
+
+    for option in options:
+        if option[0] in 'pc' and option[1:].isdigit():
+            key = 'product_id' if option[0] == 'p' else 'category_id'
+            promotion[key] = int(option[1:])
+        elif option.startswith('min=') and option[4:].isdigit():
+            promotion['min_total'] = int(option[4:])
+        elif option.startswith('uses=') and option[5:].isdigit():
+            promotion['max_uses'] = int(option[5:])
+        elif option == 'once':
+            promotion['once_per_user'] = True
+        elif option.startswith('until='):
+            # Valid through the whole given day
+            ends_at = datetime.strptime(option[6:], '%Y-%m-%d') + timedelta(days=1)
+            promotion['ends_at'] = ends_at.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            raise ValueError(f"unknown option {option}")
+
+    if 'product_id' in promotion and 'category_id' in promotion:
+        raise ValueError("either a product or a category")
+    if promotion['kind'] == 'bundle' and 'product_id' not in promotion and 'category_id' not in promotion:
+        raise ValueError("bundles need a product or a category")
+    return promotion
+
+
+class Quote:
+    """Price of a cart after discounts and bonus"""
+
+    def __init__(self, subtotal: int, discount: int, bonus: int,
+                 promotion_ids: List[int], code_applied: bool):
+        self.subtotal = subtotal
+        self.discount = discount
+        self.bonus = bonus
+        self.total = subtotal - discount - bonus
+        self.promotion_ids = promotion_ids
+        self.code_applied = code_applied
+
+
+class PromotionEngine:
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._by_product: Dict[int, List[Rule]] = {}
+        self._by_category: Dict[int, List[Rule]] = {}
+        self._cart_rules: List[Rule] = []
+        self._codes: Dict[str, Rule] = {}
+        # Whether any rule is once per user; otherwise redemptions are not looked up
+        self._has_once_rules = False
+        self._loaded_at = 0.0
+        # Created lazily: on Python 3.9 a Lock binds to the loop current at creation
+        self._lock: Optional[asyncio.Lock] = None
+
+    def invalidate(self):
+        """Reload promotions on next access"""
+        self._loaded_at = 0.0
+
+    async def ensure_loaded(self):
+        if self._loaded_at and time.monotonic() - self._loaded_at < self.ttl:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self._loaded_at or time.monotonic() - self._loaded_at >= self.ttl:
+                await self._load()
+
+    async def _load(self):
+        by_product: Dict[int, List[Rule]] = {}
+        by_category: Dict[int, List[Rule]] = {}
+        cart_rules: List[Rule] = []
+        codes: Dict[str, Rule] = {}
+        has_once_rules = False
+        for row in await db.get_promotions(active_only=True):
+            rule = Rule(row)
+            has_once_rules = has_once_rules or rule.once_per_user
+            if rule.code:
+                # Code rules apply only when the code is entered
+                codes[rule.code] = rule
+            elif rule.product_id is not None:
+                by_product.setdefault(rule.product_id, []).append(rule)
+            elif rule.category_id is not None:
+                by_category.setdefault(rule.category_id, []).append(rule)
+            else:
+                cart_rules.append(rule)
+
+        self._by_product = by_product
+        self._by_category = by_category
+        self._cart_rules = cart_rules
+        self._codes = codes
+        self._has_once_rules = has_once_rules
+        self._loaded_at = time.monotonic()
+
+    async def find_code(self, code: str) -> Optional[Rule]:
+        """The live rule of a promo code, if any"""
+        await self.ensure_loaded()
+        rule = self._codes.get(code.strip().upper())
+        if rule is None or not rule.is_live(datetime.now(), rule.min_total):
+            return None
+        return rule
+
+    async def quote(self, items: List[CartItem], code: Optional[str] = None,
+                    bonus_balance: int = 0, user_id: Optional[int] = None) -> Quote:
+        """Price cart lines (as returned by ``Database.get_cart_summary``) for
+        ``user_id``, skipping once-per-user rules they already redeemed"""
+        await self.ensure_loaded()
+        now = datetime.now()
+        subtotal = sum(item.line_total for item in items)
+        redeemed: Set[int] = set()
+        if user_id is not None and self._has_once_rules:
+            redeemed = await db.get_redeemed_promotions(user_id)
+
+        def usable(rule: Rule) -> bool:
+            return (rule.is_live(now, subtotal)
+                    and not (rule.once_per_user and rule.id in redeemed))
+
+        code_rule = self._codes.get(code.upper()) if code else None
+        if code_rule is not None and not usable(code_rule):
+            code_rule = None
+
+        applied: List[int] = []
+        discount = 0
+        for item in items:
+            candidates = (self._by_product.get(item.product_id, [])
+                          + self._by_category.get(item.category_id, []))
+            if code_rule is not None and not code_rule.is_cart_wide and code_rule.targets(item):
+                candidates.append(code_rule)
+            best, best_rule = 0, None
+            for rule in candidates:
+                if usable(rule):
+                    line = rule.line_discount(item.price, item.quantity)
+                    if line > best:
+                        best, best_rule = line, rule
+            if best_rule is not None:
+                discount += best
+                if best_rule.id not in applied:
+                    applied.append(best_rule.id)
+
+        cart_candidates = self._cart_rules
+        if code_rule is not None and code_rule.is_cart_wide:
+            cart_candidates = cart_candidates + [code_rule]
+        best, best_rule = 0, None
+        for rule in cart_candidates:
+            if usable(rule):
+                amount = rule.cart_discount(subtotal - discount)
+                if amount > best:
+                    best, best_rule = amount, rule
+        if best_rule is not None:
+            discount += best
+            applied.append(best_rule.id)
+
+        discount = min(discount, subtotal)
+        bonus = min(max(bonus_balance, 0), (subtotal - discount) * Config.BONUS_MAX_PERCENT // 100)
+        code_applied = code_rule is not None and code_rule.id in applied
+        return Quote(subtotal, discount, bonus, applied, code_applied)
+
+
+# Global promotion engine instance
+promotion_engine = PromotionEngine()
@@ -0,0 +1,520 @@
+"""Named SQL queries of the handlers, notifications and reports.
+
+Handlers call ``Database`` methods; those run the queries registered here
+through ``InstrumentedConnection.fetch_all``/``fetch_one``/``fetch_value``,
+which record latency and row counts under the query name and decode rows
+into the query's ``NamedTuple`` type (``order.first_name`` instead of
+``order[12]``, which breaks when a column is added). The SQL text of a query
+never changes, so each pooled connection prepares it once and reuses it from
+its statement cache.
+
+``python -m database.queries [--db PATH]`` lists every query, with SQLite's
+query plan for each when a database is given, for index tuning.
+"""
+import argparse
+import sqlite3
+from typing import Dict, NamedTuple, Optional, Sequence, Type
+
+
+class Query:
+    """A named statement and the type its rows are decoded into"""
+
+    __slots__ = ('name', 'sql', 'row_type', 'returns_rows')
+
+    def __init__(self, name: str, sql: str, row_type: Optional[Type[tuple]] = None):
+        self.name = name
+        self.sql = sql
+        self.row_type = row_type
+        self.returns_rows = sql.lstrip().upper().startswith(('SELECT', 'WITH'))
+
+    def statement(self, count: int = 0) -> str:
+        """SQL text for ``count`` parameters: ``{values}`` expands to a
+        placeholder for each one not bound by the fixed placeholders"""
+        if '{values}' not in self.sql:
+            return self.sql
+        return self.sql.format(values=','.join('?' * (count - self.sql.count('?'))))
+
+    def decode(self, row):
+        return self.row_type._make(row) if self.row_type is not None else tuple(row)
+
+
+# Every registered query by name
+QUERIES: Dict[str, Query] = {}
+
+
+def register(name: str, sql: str, row_type: Optional[Type[tuple]] = None) -> Query:
+    if name in QUERIES:
+        raise ValueError(f"Query {name} is already registered")
+    query = QUERIES[name] = Query(name, sql, row_type)
+    return query
+
+
+def columns(row_type: Type[tuple], alias: str = '') -> str:
+    """Select list of a row type's fields, optionally qualified by a table alias"""
+    prefix = f'{alias}.' if alias else ''
+    return ', '.join(prefix + field for field in row_type._fields)
+
+
+# Rows handlers and caches keep around. Each is built from the cursor's tuple
+# without a per-row dict of column names; ``name(lang)`` picks the localized
+# column and falls back to Uzbek.
+
+class User(NamedTuple):
+    id: int
+    telegram_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    last_name: Optional[str]
+    phone: Optional[str]
+    address: Optional[str]
+    language_code: Optional[str]
+    role: Optional[str]
+    referral_code: Optional[str]
+    referred_by: Optional[str]
+    bonus_balance: Optional[int]
+    is_active: Optional[int]
+    created_at: Optional[str]
+    updated_at: Optional[str]
+
+    @property
+    def lang(self) -> str:
+        return self.language_code or 'uz'
+
+
+class Category(NamedTuple):
+    id: int
+    name_uz: str
+    name_ru: str
+    description_uz: Optional[str]
+    description_ru: Optional[str]
+    image_url: Optional[str]
+
+    def name(self, lang: str) -> str:
+        return (self.name_ru if lang == 'ru' else None) or self.name_uz
+
+
+class Product(NamedTuple):
+    id: int
+    category_id: int
+    name_uz: str
+    name_ru: str
+    description_uz: Optional[str]
+    description_ru: Optional[str]
+    price: int
+    image_url: Optional[str]
+    is_available: int
+    stock: Optional[int]
+
+    def name(self, lang: str) -> str:
+        return (self.name_ru if lang == 'ru' else None) or self.name_uz
+
+    def description(self, lang: str) -> Optional[str]:
+        return (self.description_ru if lang == 'ru' else None) or self.description_uz
+
+
+class CartItem(NamedTuple):
+    product_id: int
+    quantity: int
+    name_uz: str
+    name_ru: str
+    price: int
+    category_id: int
+    line_total: int
+
+    def name(self, lang: str) -> str:
+        return (self.name_ru if lang == 'ru' else None) or self.name_uz
+
+
+class ActiveOrder(NamedTuple):
+    id: int
+    user_id: int
+    total_amount: int
+    order_status: str
+    created_at: str
+    first_name: Optional[str]
+    phone: Optional[str]
+
+
+class OrderNotice(NamedTuple):
+    id: int
+    total_amount: int
+    delivery_address: str
+    payment_method: str
+    created_at: str
+    first_name: Optional[str]
+    phone: Optional[str]
+
+
+class UserOrder(NamedTuple):
+    id: int
+    total_amount: int
+    order_status: str
+    created_at: str
+    delivery_address: str
+
+
+class OrderTotals(NamedTuple):
+    order_count: int
+    total_spent: int
+
+
+class DailyStats(NamedTuple):
+    orders_count: int
+    revenue: int
+    new_users: int
+
+
+class ProductName(NamedTuple):
+    id: int
+    name_ru: str
+
+
+class UserActivity(NamedTuple):
+    telegram_id: int
+    created_at: str
+    order_count: int
+    total_spent: int
+    last_order_date: Optional[str]
+
+
+class PurchasedItem(NamedTuple):
+    name_uz: str
+    name_ru: str
+    price: int
+    quantity: int
+    created_at: str
+    category_uz: str
+    category_ru: str
+
+
+class PopularProduct(NamedTuple):
+    id: int
+    name_uz: str
+    name_ru: str
+    price: int
+    order_count: int
+    category_uz: str
+    category_ru: str
+
+
+class DailySales(NamedTuple):
+    day: str
+    product_id: int
+    orders: int
+    quantity: int
+    revenue: int
+
+
+class HourlySales(NamedTuple):
+    hour: str
+    quantity: int
+    revenue: int
+
+
+class ActiveDay(NamedTuple):
+    day: str
+    users: int
+
+
+class ProductPerformance(NamedTuple):
+    id: int
+    name_uz: str
+    price: int
+    times_ordered: int
+    total_quantity: int
+    total_revenue: int
+
+
+# Orders
+
+ACTIVE_ORDERS = register('active_orders', '''
+    SELECT o.id, o.user_id, o.total_amount, o.order_status, o.created_at,
+           u.first_name, u.phone
+    FROM orders o
+    JOIN users u ON o.user_id = u.telegram_id
+    WHERE o.order_status IN ('new', 'confirmed', 'preparing')
+    ORDER BY o.created_at DESC
+    LIMIT ?
+''', ActiveOrder)
+
+ORDER_NOTICE = register('order_notice', '''
+    SELECT o.id, o.total_amount, o.delivery_address, o.payment_method, o.created_at,
+           u.first_name, u.phone
+    FROM orders o
+    JOIN users u ON o.user_id = u.telegram_id
+    WHERE o.id = ?
+''', OrderNotice)
+
+USER_ORDERS = register('user_orders', '''
+    SELECT id, total_amount, order_status, created_at, delivery_address
+    FROM orders
+    WHERE user_id = ?
+    ORDER BY created_at DESC
+    LIMIT ?
+''', UserOrder)
+
+USER_ORDER_TOTALS = register('user_order_totals', '''
+    SELECT COUNT(*),
+           COALESCE(SUM(CASE WHEN payment_status = 'completed' THEN total_amount END), 0)
+    FROM orders
+    WHERE user_id = ?
+''', OrderTotals)
+
+# Today's rows as a range of text timestamps: a lone date('now') would be a
+# cast to the date type on Postgres
+DAILY_STATS = register('daily_stats', '''
+    SELECT COUNT(*),
+           COALESCE(SUM(total_amount), 0),
+           (SELECT COUNT(*) FROM users WHERE created_at >= date(datetime('now')))
+    FROM orders
+    WHERE created_at >= date(datetime('now'))
+''', DailyStats)
+
+# Users and referrals
+
+USER = register('user', f'''
+    SELECT {columns(User)} FROM users WHERE telegram_id = ?
+''', User)
+
+SET_LANGUAGE = register('set_language', '''
+    UPDATE users SET language_code = ? WHERE telegram_id = ?
+''')
+
+# NULL keeps the current value
+UPDATE_PROFILE = register('update_profile', '''
+    UPDATE users
+    SET phone = COALESCE(?, phone), address = COALESCE(?, address), updated_at = datetime('now')
+    WHERE telegram_id = ?
+''')
+
+REFERRAL_COUNT = register('referral_count', '''
+    SELECT COUNT(*) FROM referrals WHERE referrer_id = ?
+''')
+
+ACTIVE_REFERRAL_COUNT = register('active_referral_count', '''
+    SELECT COUNT(*)
+    FROM referrals r
+    JOIN users u ON r.referred_id = u.telegram_id
+    WHERE r.referrer_id = ? AND u.is_active = 1
+''')
+
+# Marks the referrals of a referrer unless the bonus was already awarded
+MARK_REFERRAL_BONUS = register('mark_referral_bonus', '''
+    UPDATE referrals SET bonus_awarded = 1
+    WHERE referrer_id = ?
+      AND NOT EXISTS (
+          SELECT 1 FROM referrals WHERE referrer_id = ? AND bonus_awarded = 1
+      )
+''')
+
+ADD_BONUS = register('add_bonus', '''
+    UPDATE users SET bonus_balance = bonus_balance + ? WHERE telegram_id = ?
+''')
+
+# Catalog
+
+CATEGORIES = register('categories', f'''
+    SELECT {columns(Category)} FROM categories WHERE is_active = 1 ORDER BY name_uz
+''', Category)
+
+PRODUCT = register('product', f'''
+    SELECT {columns(Product)} FROM products WHERE id = ?
+''', Product)
+
+CATEGORY_PRODUCTS = register('category_products', f'''
+    SELECT {columns(Product)} FROM products
+    WHERE category_id = ? AND is_available = 1
+    ORDER BY name_uz
+''', Product)
+
+CATALOG_PRODUCTS = register('catalog_products', f'''
+    SELECT {columns(Product)} FROM products WHERE is_available = 1
+''', Product)
+
+PRODUCT_NAMES = register('product_names', '''
+    SELECT id, name_ru FROM products WHERE id IN ({values})
+''', ProductName)
+
+CART_ITEMS = register('cart_items', '''
+    SELECT c.product_id, c.quantity, p.name_uz, p.name_ru, p.price,
+           p.category_id, p.price * c.quantity AS line_total
+    FROM cart c
+    JOIN products p ON c.product_id = p.id
+    WHERE c.user_id = ?
+    ORDER BY c.created_at
+''', CartItem)
+
+# Events (see utils.events)
+
+ADD_EVENT = register('add_event', '''
+    INSERT INTO events (created_at, user_id, name, object_id) VALUES (?, ?, ?, ?)
+''')
+
+# In time order, so one pass finds each user's progress through the steps
+FUNNEL_EVENTS = register('funnel_events', '''
+    SELECT user_id, name FROM events
+    WHERE created_at >= ? AND created_at < ? AND name IN ({values})
+    ORDER BY created_at
+''')
+
+COHORT_SIZE = register('cohort_size', '''
+    SELECT COUNT(*) FROM users WHERE created_at >= ? AND created_at < ?
+''')
+
+# Users of a registration cohort active on each day of a range
+RETENTION = register('retention', '''
+    SELECT substr(e.created_at, 1, 10) AS day, COUNT(DISTINCT e.user_id) AS users
+    FROM users u
+    JOIN events e ON e.user_id = u.telegram_id AND e.created_at >= ? AND e.created_at < ?
+    WHERE u.created_at >= ? AND u.created_at < ?
+    GROUP BY substr(e.created_at, 1, 10)
+    ORDER BY day
+''', ActiveDay)
+
+# Recommendations and reports
+
+USER_ACTIVITY = register('user_activity', '''
+    SELECT
+        u.telegram_id,
+        u.created_at,
+        COUNT(o.id) as order_count,
+        COALESCE(SUM(o.total_amount), 0) as total_spent,
+        MAX(o.created_at) as last_order_date
+    FROM users u
+    LEFT JOIN orders o ON u.telegram_id = o.user_id
+    WHERE u.role = 'customer'
+    GROUP BY u.telegram_id, u.created_at
+''', UserActivity)
+
+PURCHASE_HISTORY = register('purchase_history', '''
+    SELECT
+        p.name_uz, p.name_ru, p.price, oi.quantity,
+        o.created_at, c.name_uz as category_uz, c.name_ru as category_ru
+    FROM order_items oi
+    JOIN orders o ON oi.order_id = o.id
+    JOIN products p ON oi.product_id = p.id
+    JOIN categories c ON p.category_id = c.id
+    WHERE o.user_id = ?
+    ORDER BY o.created_at DESC
+    LIMIT ?
+''', PurchasedItem)
+
+POPULAR_PRODUCTS = register('popular_products', '''
+    SELECT
+        p.id, p.name_uz, p.name_ru, p.price,
+        COUNT(oi.id) as order_count,
+        c.name_uz as category_uz, c.name_ru as category_ru
+    FROM products p
+    LEFT JOIN order_items oi ON p.id = oi.product_id
+    JOIN categories c ON p.category_id = c.id
+    WHERE p.is_available = 1
+    GROUP BY p.id, c.id
+    ORDER BY order_count DESC
+    LIMIT ?
+''', PopularProduct)
+
+ADD_RECOMMENDATION = register('add_recommendation', '''
+    INSERT INTO ai_recommendations
+    (user_id, product_id, recommendation_type, confidence_score)
+    VALUES (?, ?, ?, ?)
+''')
+
+# Sales buckets (see utils.sales). An order is added to the buckets of the
+# hour and day it is placed in, in the transaction that creates it; line
+# revenue is before order discounts.
+
+RECORD_HOURLY_SALES = register('record_hourly_sales', '''
+    INSERT INTO sales_hourly (hour, product_id, orders, quantity, revenue)
+    SELECT substr(datetime('now'), 1, 13), product_id, 1, SUM(quantity), SUM(quantity * price)
+    FROM order_items WHERE order_id = ?
+    GROUP BY product_id
+    ON CONFLICT (hour, product_id) DO UPDATE SET
+        orders = sales_hourly.orders + excluded.orders,
+        quantity = sales_hourly.quantity + excluded.quantity,
+        revenue = sales_hourly.revenue + excluded.revenue
+''')
+
+RECORD_DAILY_SALES = register('record_daily_sales', '''
+    INSERT INTO sales_daily (day, product_id, orders, quantity, revenue)
+    SELECT substr(datetime('now'), 1, 10), product_id, 1, SUM(quantity), SUM(quantity * price)
+    FROM order_items WHERE order_id = ?
+    GROUP BY product_id
+    ON CONFLICT (day, product_id) DO UPDATE SET
+        orders = sales_daily.orders + excluded.orders,
+        quantity = sales_daily.quantity + excluded.quantity,
+        revenue = sales_daily.revenue + excluded.revenue
+''')
+
+# Buckets of orders created without create_order (older versions, generate_data)
+REBUILD_HOURLY_SALES = register('rebuild_hourly_sales', '''
+    INSERT INTO sales_hourly (hour, product_id, orders, quantity, revenue)
+    SELECT substr(o.created_at, 1, 13), oi.product_id, COUNT(DISTINCT o.id),
+           SUM(oi.quantity), SUM(oi.quantity * oi.price)
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.id
+    GROUP BY substr(o.created_at, 1, 13), oi.product_id
+''')
+
+REBUILD_DAILY_SALES = register('rebuild_daily_sales', '''
+    INSERT INTO sales_daily (day, product_id, orders, quantity, revenue)
+    SELECT substr(o.created_at, 1, 10), oi.product_id, COUNT(DISTINCT o.id),
+           SUM(oi.quantity), SUM(oi.quantity * oi.price)
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.id
+    GROUP BY substr(o.created_at, 1, 10), oi.product_id
+''')
+
+# At most one row per product and day of the range, however many orders it had
+DAILY_SALES = register('daily_sales', '''
+    SELECT day, product_id, orders, quantity, revenue FROM sales_daily
+    WHERE day >= ? AND day < ?
+''', DailySales)
+
+HOURLY_SALES = register('hourly_sales', '''
+    SELECT substr(hour, 12, 2) AS hour, SUM(quantity) AS quantity, SUM(revenue) AS revenue
+    FROM sales_hourly
+    WHERE hour >= ? AND hour < ?
+    GROUP BY substr(hour, 12, 2)
+    ORDER BY hour
+''', HourlySales)
+
+PRODUCT_PERFORMANCE = register('product_performance', '''
+    SELECT
+        p.id, p.name_uz, p.price,
+        COUNT(oi.id) as times_ordered,
+        COALESCE(SUM(oi.quantity), 0) as total_quantity,
+        COALESCE(SUM(oi.quantity * oi.price), 0) as total_revenue
+    FROM products p
+    LEFT JOIN order_items oi ON p.id = oi.product_id
+    GROUP BY p.id
+    ORDER BY total_revenue DESC
+''', ProductPerformance)
+
+
+def explain(path: str, query: Query) -> str:
+    """SQLite's plan for a query, one step per line"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        # Placeholders are bound to NULL: the plan does not depend on values
+        sql = query.statement(query.sql.count('?') + 1)
+        rows = conn.execute(f'EXPLAIN QUERY PLAN {sql}', (None,) * sql.count('?')).fetchall()
+    finally:
+        conn.close()
+    return '\n'.join(f"    {row[-1]}" for row in rows)
+
+
+def main(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+    parser.add_argument('--db', help='SQLite file to show query plans from')
+    args = parser.parse_args(argv)
+
+    for query in QUERIES.values():
+        print(f"{query.name}:")
+        print('    ' + ' '.join(query.sql.split()))
+        if args.db:
+            print(explain(args.db, query))
+        print()
+
+
+if __name__ == '__main__':
+    main()
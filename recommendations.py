@@ -3,6 +3,8 @@ import asyncio
 from typing import List, Dict, Optional
 from config import Config
 from database.models import db
+from utils.metrics import metrics
+from utils.sales import sales_report
 
 # Try to import OpenAI, but handle if not available
 try:
@@ -31,15 +33,16 @@ class AIRecommendationEngine:
             # Create prompt for AI
             prompt = self._create_recommendation_prompt(user_history, popular_products)
             
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a product recommendation AI for an Uzbek delivery service."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=500,
-                temperature=0.7
-            )
+            with metrics.timer('openai', 'generate_product_suggestions'):
+                response = await openai.ChatCompletion.acreate(
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {"role": "system", "content": "You are a product recommendation AI for an Uzbek delivery service."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=500,
+                    temperature=0.7
+                )
             
             # Parse AI response
             recommendations = self._parse_ai_response(response.choices[0].message.content)
@@ -75,15 +78,16 @@ class AIRecommendationEngine:
             Format response as JSON.
             """
             
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a business analyst AI."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=800,
-                temperature=0.3
-            )
+            with metrics.timer('openai', 'analyze_sales_trends'):
+                response = await openai.ChatCompletion.acreate(
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {"role": "system", "content": "You are a business analyst AI."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=800,
+                    temperature=0.3
+                )
             
             return json.loads(response.choices[0].message.content)
             
@@ -117,15 +121,16 @@ class AIRecommendationEngine:
             Format as JSON.
             """
             
-            response = await openai.ChatCompletion.acreate(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a marketing strategist AI for Uzbek market."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=1000,
-                temperature=0.8
-            )
+            with metrics.timer('openai', 'recommend_promo_campaign'):
+                response = await openai.ChatCompletion.acreate(
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {"role": "system", "content": "You are a marketing strategist AI for Uzbek market."},
+                        {"role": "user", "content": prompt}
+                    ],
+                    max_tokens=1000,
+                    temperature=0.8
+                )
             
             return json.loads(response.choices[0].message.content)
             
@@ -135,82 +140,34 @@ class AIRecommendationEngine:
     
     async def segment_users(self) -> Dict:
         """Segment users based on behavior"""
-        async with db.get_connection() as conn:
-            # Get user behavior data
-            cursor = await conn.execute('''
-                SELECT 
-                    u.telegram_id,
-                    u.created_at,
-                    COUNT(o.id) as order_count,
-                    COALESCE(SUM(o.total_amount), 0) as total_spent,
-                    MAX(o.created_at) as last_order_date
-                FROM users u
-                LEFT JOIN orders o ON u.telegram_id = o.user_id
-                WHERE u.role = 'customer'
-                GROUP BY u.telegram_id
-            ''')
-            
-            users = await cursor.fetchall()
-            
-            segments = {
-                "vip": [],      # High value customers
-                "active": [],   # Regular customers
-                "inactive": [], # Haven't ordered recently
-                "new": []       # New users
-            }
-            
-            for user in users:
-                user_dict = dict(user)
-                
-                if user_dict['total_spent'] > 100000:  # 100k som
-                    segments["vip"].append(user_dict['telegram_id'])
-                elif user_dict['order_count'] >= 3:
-                    segments["active"].append(user_dict['telegram_id'])
-                elif user_dict['order_count'] == 0:
-                    segments["new"].append(user_dict['telegram_id'])
-                else:
-                    segments["inactive"].append(user_dict['telegram_id'])
-            
-            return segments
+        users = await db.get_user_activity()
+        
+        segments = {
+            "vip": [],      # High value customers
+            "active": [],   # Regular customers
+            "inactive": [], # Haven't ordered recently
+            "new": []       # New users
+        }
+        
+        for user in users:
+            if user.total_spent > 100000:  # 100k som
+                segments["vip"].append(user.telegram_id)
+            elif user.order_count >= 3:
+                segments["active"].append(user.telegram_id)
+            elif user.order_count == 0:
+                segments["new"].append(user.telegram_id)
+            else:
+                segments["inactive"].append(user.telegram_id)
+        
+        return segments
     
     async def _get_user_history(self, user_id: int) -> List[Dict]:
         """Get user's order history"""
-        async with db.get_connection() as conn:
-            cursor = await conn.execute('''
-                SELECT 
-                    p.name_uz, p.name_ru, p.price, oi.quantity,
-                    o.created_at, c.name_uz as category_uz, c.name_ru as category_ru
-                FROM order_items oi
-                JOIN orders o ON oi.order_id = o.id
-                JOIN products p ON oi.product_id = p.id
-                JOIN categories c ON p.category_id = c.id
-                WHERE o.user_id = ?
-                ORDER BY o.created_at DESC
-                LIMIT 20
-            ''', (user_id,))
-            
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        return [item._asdict() for item in await db.get_purchase_history(user_id)]
     
     async def _get_popular_products(self, limit: int = 10) -> List[Dict]:
         """Get popular products"""
-        async with db.get_connection() as conn:
-            cursor = await conn.execute('''
-                SELECT 
-                    p.id, p.name_uz, p.name_ru, p.price,
-                    COUNT(oi.id) as order_count,
-                    c.name_uz as category_uz, c.name_ru as category_ru
-                FROM products p
-                LEFT JOIN order_items oi ON p.id = oi.product_id
-                JOIN categories c ON p.category_id = c.id
-                WHERE p.is_available = 1
-                GROUP BY p.id
-                ORDER BY order_count DESC
-                LIMIT ?
-            ''', (limit,))
-            
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        return [product._asdict() for product in await db.get_popular_products(limit)]
     
     async def _fallback_recommendations(self, user_id: int, limit: int) -> List[Dict]:
         """Fallback recommendations when AI is not available"""
@@ -255,40 +212,14 @@ class AIRecommendationEngine:
     
     async def _store_recommendations(self, user_id: int, recommendations: List[Dict], rec_type: str):
         """Store recommendations in database"""
-        async with db.get_connection() as conn:
-            for rec in recommendations:
-                await conn.execute('''
-                    INSERT INTO ai_recommendations 
-                    (user_id, product_id, recommendation_type, confidence_score)
-                    VALUES (?, ?, ?, ?)
-                ''', (
-                    user_id, 
-                    rec.get('product_id'), 
-                    rec_type, 
-                    rec.get('confidence', 0.5)
-                ))
-            await conn.commit()
+        await db.add_recommendations(user_id, [
+            (rec.get('product_id'), rec_type, rec.get('confidence', 0.5))
+            for rec in recommendations
+        ])
     
     async def _get_sales_data(self) -> Dict:
         """Get sales data for analysis"""
-        async with db.get_connection() as conn:
-            cursor = await conn.execute('''
-                SELECT 
-                    DATE(o.created_at) as date,
-                    COUNT(o.id) as order_count,
-                    SUM(o.total_amount) as revenue,
-                    p.name_uz as product_name,
-                    SUM(oi.quantity) as quantity_sold
-                FROM orders o
-                JOIN order_items oi ON o.id = oi.order_id
-                JOIN products p ON oi.product_id = p.id
-                WHERE o.created_at >= date('now', '-30 days')
-                GROUP BY DATE(o.created_at), p.id
-                ORDER BY date DESC
-            ''')
-            
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        return await sales_report()
     
     async def _get_user_segments(self) -> Dict:
         """Get user segment data"""
@@ -300,21 +231,7 @@ class AIRecommendationEngine:
     
     async def _get_product_performance(self) -> List[Dict]:
         """Get product performance data"""
-        async with db.get_connection() as conn:
-            cursor = await conn.execute('''
-                SELECT 
-                    p.id, p.name_uz, p.price,
-                    COUNT(oi.id) as times_ordered,
-                    SUM(oi.quantity) as total_quantity,
-                    SUM(oi.quantity * oi.price) as total_revenue
-                FROM products p
-                LEFT JOIN order_items oi ON p.id = oi.product_id
-                GROUP BY p.id
-                ORDER BY total_revenue DESC
-            ''')
-            
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+        return [row._asdict() for row in await db.get_product_performance()]
 
 # Initialize AI engine
 ai_engine = AIRecommendationEngine()
\ No newline at end of file
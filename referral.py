@@ -3,6 +3,7 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
+from config import Config
 from database.models import db
 from keyboards.keyboards import get_main_menu_keyboard
 from localization.texts import get_text
@@ -28,20 +29,13 @@ async def show_referral_info(message: Message):
     if not user:
         return
     
-    lang = user.get('language_code', 'uz')
+    lang = user.lang
     
     # Get referral statistics
-    async with db.get_connection() as conn:
-        cursor = await conn.execute('''
-            SELECT COUNT(*) as referred_count 
-            FROM referrals 
-            WHERE referrer_id = ?
-        ''', (message.from_user.id,))
-        result = await cursor.fetchone()
-        referred_count = result[0] if result else 0
+    referred_count = await db.count_referrals(message.from_user.id)
     
-    referral_code = user.get('referral_code', 'N/A')
-    bonus_balance = user.get('bonus_balance', 0)
+    referral_code = user.referral_code or 'N/A'
+    bonus_balance = user.bonus_balance or 0
     
     # Create referral link
     bot_username = (await message.bot.get_me()).username
@@ -88,42 +82,6 @@ async def show_referral_info(message: Message):
 
 async def check_referral_bonus(referrer_id: int):
     """Check and award referral bonus if conditions are met"""
-    async with db.get_connection() as conn:
-        # Count active referrals
-        cursor = await conn.execute('''
-            SELECT COUNT(*) as count 
-            FROM referrals r
-            JOIN users u ON r.referred_id = u.telegram_id
-            WHERE r.referrer_id = ? AND u.is_active = 1
-        ''', (referrer_id,))
-        result = await cursor.fetchone()
-        active_referrals = result[0] if result else 0
-        
-        # Award bonus if reached threshold
-        if active_referrals >= 5:  # REFERRAL_REQUIRED_FRIENDS from config
-            # Check if bonus already awarded
-            cursor = await conn.execute('''
-                SELECT bonus_awarded FROM referrals 
-                WHERE referrer_id = ? AND bonus_awarded = 1
-                LIMIT 1
-            ''', (referrer_id,))
-            
-            if not await cursor.fetchone():
-                # Award bonus
-                await conn.execute('''
-                    UPDATE users 
-                    SET bonus_balance = bonus_balance + ? 
-                    WHERE telegram_id = ?
-                ''', (5000, referrer_id))  # REFERRAL_BONUS_AMOUNT
-                
-                # Mark as awarded
-                await conn.execute('''
-                    UPDATE referrals 
-                    SET bonus_awarded = 1 
-                    WHERE referrer_id = ?
-                ''', (referrer_id,))
-                
-                await conn.commit()
-                return True
-    
-    return False
\ No newline at end of file
+    return await db.award_referral_bonus(
+        referrer_id, Config.REFERRAL_REQUIRED_FRIENDS, Config.REFERRAL_BONUS_AMOUNT
+    )
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""Multi-stop route planning for couriers.
+
+Ready orders are grouped onto nearby free couriers (at most ``max_stops``
+each, all within ``radius_km`` of the group's first order), then each
+courier's stops are put in order with a nearest-neighbour tour improved by
+2-opt. Planning is bounded by a time budget: once it runs out, remaining
+tours keep their nearest-neighbour order and the plan is returned as is.
+"""
+import math
+import time
+from typing import Dict, List, Sequence, Set, Tuple
+
+from utils.geo import (
+    CELL_SIZE, EARTH_RADIUS_KM, NUMPY_AVAILABLE, GridIndex, haversine_km
+)
+
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+# Average courier speed in the city, including traffic lights
+AVERAGE_SPEED_KMH = 20.0
+# Handover time spent at every stop
+STOP_MINUTES = 3.0
+MAX_STOPS = 4
+MAX_CLUSTER_RADIUS_KM = 2.5
+PLANNING_BUDGET = 0.2
+
+Point = Tuple[float, float]
+
+
+class Route:
+    """Ordered stops for one courier"""
+
+    def __init__(self, courier_id: int, start: Point):
+        self.courier_id = courier_id
+        self.start = start
+        # (order_id, leg_km, eta_minutes) in visiting order
+        self.stops: List[Tuple[int, float, float]] = []
+
+    @property
+    def distance_km(self) -> float:
+        return sum(leg for _, leg, _ in self.stops)
+
+    @property
+    def order_ids(self) -> List[int]:
+        return [order_id for order_id, _, _ in self.stops]
+
+
+def distance_matrix(points: Sequence[Point]) -> List[List[float]]:
+    """Pairwise haversine distances in kilometers"""
+    if NUMPY_AVAILABLE:
+        coords = np.radians(np.asarray(points, dtype=np.float64))
+        lat, lon = coords[:, 0:1], coords[:, 1:2]
+        a = (np.sin((lat.T - lat) / 2) ** 2
+             + np.cos(lat) * np.cos(lat.T) * np.sin((lon.T - lon) / 2) ** 2)
+        matrix = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+        # Plain lists index faster than ndarrays in the small loops below
+        return matrix.tolist()
+    return [[haversine_km(*p, *q) for q in points] for p in points]
+
+
+def nearest_neighbour_tour(matrix: List[List[float]]) -> List[int]:
+    """Open tour starting at point 0, always visiting the closest unvisited point"""
+    unvisited = set(range(1, len(matrix)))
+    tour = [0]
+    while unvisited:
+        row = matrix[tour[-1]]
+        closest = min(unvisited, key=row.__getitem__)
+        unvisited.remove(closest)
+        tour.append(closest)
+    return tour
+
+
+def two_opt(tour: List[int], matrix: List[List[float]], deadline: float) -> List[int]:
+    """Improve an open tour with a fixed start by reversing segments"""
+    size = len(tour)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(1, size - 1):
+            a, b = tour[i - 1], tour[i]
+            for k in range(i + 1, size):
+                c = tour[k]
+                delta = matrix[a][c] - matrix[a][b]
+                if k + 1 < size:
+                    d = tour[k + 1]
+                    delta += matrix[b][d] - matrix[c][d]
+                if delta < -1e-9:
+                    tour[i:k + 1] = tour[i:k + 1][::-1]
+                    b = tour[i]
+                    improved = True
+    return tour
+
+
+def cluster_orders(orders: List[Tuple[int, float, float]], couriers: GridIndex,
+                   max_stops: int = MAX_STOPS,
+                   radius_km: float = MAX_CLUSTER_RADIUS_KM) -> Dict[int, List[Tuple[int, float, float]]]:
+    """Group (order_id, lat, lon) in queue order onto free couriers"""
+    groups: Dict[int, List[Tuple[int, float, float]]] = {}
+    taken: Set[int] = set()
+    # First order of every group that still has room, keyed by courier id
+    anchors = GridIndex()
+    rings = max(1, math.ceil(radius_km / (CELL_SIZE * 111.0)))
+
+    for order in orders:
+        _, lat, lon = order
+        match = anchors.nearest(lat, lon, max_rings=rings) if len(anchors) else None
+        if match is not None and match[1] <= radius_km:
+            courier_id = match[0]
+        else:
+            found = couriers.nearest(lat, lon, exclude=taken)
+            if found is None:
+                continue
+            courier_id = found[0]
+            taken.add(courier_id)
+            groups[courier_id] = []
+            anchors.update(courier_id, lat, lon)
+
+        groups[courier_id].append(order)
+        if len(groups[courier_id]) >= max_stops:
+            anchors.remove(courier_id)
+    return groups
+
+
+def build_route(courier_id: int, start: Point, stops: List[Tuple[int, float, float]],
+                deadline: float) -> Route:
+    """Order a courier's stops and compute leg distances and arrival ETAs"""
+    route = Route(courier_id, start)
+    points = [start] + [(lat, lon) for _, lat, lon in stops]
+    matrix = distance_matrix(points)
+    tour = nearest_neighbour_tour(matrix)
+    if len(tour) > 3:
+        tour = two_opt(tour, matrix, deadline)
+
+    minutes = 0.0
+    for previous, current in zip(tour, tour[1:]):
+        leg = matrix[previous][current]
+        minutes += leg / AVERAGE_SPEED_KMH * 60
+        route.stops.append((stops[current - 1][0], leg, round(minutes, 1)))
+        minutes += STOP_MINUTES
+    return route
+
+
+def plan_routes(orders: List[Tuple[int, float, float]], couriers: GridIndex,
+                max_stops: int = MAX_STOPS, radius_km: float = MAX_CLUSTER_RADIUS_KM,
+                budget: float = PLANNING_BUDGET) -> List[Route]:
+    """Routes for ready orders, computed within ``budget`` seconds"""
+    deadline = time.perf_counter() + budget
+    groups = cluster_orders(orders, couriers, max_stops, radius_km)
+
+    routes = []
+    for courier_id, stops in groups.items():
+        lat, lon, _ = couriers.positions[courier_id]
+        routes.append(build_route(courier_id, (lat, lon), stops, deadline))
+    return routes
@@ -0,0 +1,154 @@
+"""Sales reports built from hourly and daily sales buckets.
+
+``Database.create_order`` adds the lines of each order to per-product buckets
+for the hour and the day it was placed (``sales_hourly`` and ``sales_daily``).
+A report therefore reads at most one row per product and day of its window,
+and its cost does not grow with order history. The rows are laid out as a
+products x days matrix. Top sellers, trends, moving averages and weekday
+profiles are computed on it with NumPy when available, plain Python otherwise.
+"""
+import heapq
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from database.models import db
+from database.queries import DailySales
+from utils.geo import NUMPY_AVAILABLE
+
+if NUMPY_AVAILABLE:
+    import numpy as np
+
+REPORT_DAYS = 30
+MOVING_AVERAGE_DAYS = 7
+# Products selling less than this many units a day have no meaningful trend
+MIN_TREND_UNITS_PER_DAY = 1.0
+
+
+def sales_matrices(rows: Sequence[DailySales], first_day: date, days: int):
+    """Product ids and their units, revenue and orders per day (one row per
+    product, one column per day from ``first_day``)"""
+    columns = {(first_day + timedelta(days=offset)).isoformat(): offset for offset in range(days)}
+    product_ids = sorted({row.product_id for row in rows})
+    index = {product_id: position for position, product_id in enumerate(product_ids)}
+    if NUMPY_AVAILABLE:
+        shape = (len(product_ids), days)
+        units, revenue, orders = (np.zeros(shape, dtype=np.int64) for _ in range(3))
+        if rows:
+            cells = ([index[row.product_id] for row in rows], [columns[row.day] for row in rows])
+            # Buckets are unique per product and day: plain assignment, no accumulation
+            units[cells] = [row.quantity for row in rows]
+            revenue[cells] = [row.revenue for row in rows]
+            orders[cells] = [row.orders for row in rows]
+        return product_ids, units, revenue, orders
+
+    units, revenue, orders = ([[0] * days for _ in product_ids] for _ in range(3))
+    for row in rows:
+        position, column = index[row.product_id], columns[row.day]
+        units[position][column] = row.quantity
+        revenue[position][column] = row.revenue
+        orders[position][column] = row.orders
+    return product_ids, units, revenue, orders
+
+
+def row_sums(matrix) -> List[int]:
+    if NUMPY_AVAILABLE:
+        return matrix.sum(axis=1).tolist()
+    return [sum(row) for row in matrix]
+
+
+def column_sums(matrix, days: int) -> List[int]:
+    if NUMPY_AVAILABLE:
+        return matrix.sum(axis=0).tolist()
+    return [sum(column) for column in zip(*matrix)] or [0] * days
+
+
+def trend_slopes(matrix, days: int) -> List[float]:
+    """Least-squares slope of every row against the day number (change per day)"""
+    x = [day - (days - 1) / 2 for day in range(days)]
+    sxx = sum(value * value for value in x) or 1.0
+    if NUMPY_AVAILABLE:
+        return (np.asarray(matrix) @ np.asarray(x) / sxx).tolist()
+    return [sum(value * offset for value, offset in zip(row, x)) / sxx for row in matrix]
+
+
+def moving_average(series: Sequence[float], window: int = MOVING_AVERAGE_DAYS) -> List[float]:
+    """Trailing mean over ``window`` days (over fewer at the start)"""
+    if NUMPY_AVAILABLE:
+        totals = np.cumsum(np.asarray(series, dtype=np.float64))
+        totals[window:] = totals[window:] - totals[:-window]
+        return (totals / np.minimum(np.arange(1, len(totals) + 1), window)).tolist()
+    averages, total = [], 0.0
+    for day, value in enumerate(series):
+        total += value
+        if day >= window:
+            total -= series[day - window]
+        averages.append(total / min(day + 1, window))
+    return averages
+
+
+def weekday_means(series: Sequence[float], first_day: date) -> List[float]:
+    """Mean of ``series`` per weekday, Monday first"""
+    weekdays = [(first_day.weekday() + day) % 7 for day in range(len(series))]
+    if NUMPY_AVAILABLE:
+        totals = np.bincount(weekdays, weights=series, minlength=7)
+        counts = np.bincount(weekdays, minlength=7)
+        return (totals / np.maximum(counts, 1)).tolist()
+    totals, counts = [0.0] * 7, [0] * 7
+    for weekday, value in zip(weekdays, series):
+        totals[weekday] += value
+        counts[weekday] += 1
+    return [total / max(count, 1) for total, count in zip(totals, counts)]
+
+
+async def sales_report(days: int = REPORT_DAYS, top: int = 10,
+                       today: Optional[date] = None) -> Dict:
+    """Top sellers, trends and daily, weekday and hourly revenue over the
+    ``days`` full days before ``today`` (UTC); values are plain JSON types"""
+    today = today or datetime.utcnow().date()
+    first_day = today - timedelta(days=days)
+    start, end = first_day.isoformat(), today.isoformat()
+    rows = await db.get_daily_sales(start, end)
+    hours = await db.get_hourly_sales(start, end)
+
+    product_ids, units, revenue, orders = sales_matrices(rows, first_day, days)
+    product_units, product_revenue = row_sums(units), row_sums(revenue)
+    product_orders = row_sums(orders)
+    daily_revenue = column_sums(revenue, days)
+    slopes = trend_slopes(units, days)
+
+    best = heapq.nlargest(top, range(len(product_ids)), key=product_revenue.__getitem__)
+    # Daily change relative to the product's mean daily units
+    changes: List[Tuple[float, int]] = [
+        (slope * days / total, position)
+        for position, (slope, total) in enumerate(zip(slopes, product_units))
+        if total >= MIN_TREND_UNITS_PER_DAY * days
+    ]
+    rising = [position for change, position in heapq.nlargest(5, changes) if change > 0]
+    falling = [position for change, position in heapq.nsmallest(5, changes) if change < 0]
+    shown = {*best, *rising, *falling}
+    names = await db.get_product_names([product_ids[position] for position in shown])
+
+    def product(position: int) -> Dict:
+        product_id = product_ids[position]
+        return {'product_id': product_id, 'name': names.get(product_id, f'#{product_id}'),
+                'orders': product_orders[position], 'units': product_units[position],
+                'revenue': product_revenue[position]}
+
+    def trend(position: int) -> Dict:
+        change = slopes[position] * days / product_units[position]
+        return {**product(position), 'change_per_day': round(change, 4)}
+
+    return {
+        'from': start,
+        'to': (today - timedelta(days=1)).isoformat(),
+        'units': sum(product_units),
+        'revenue': sum(product_revenue),
+        'daily_revenue': daily_revenue,
+        'moving_average': [round(value) for value in moving_average(daily_revenue)],
+        'revenue_trend_per_day': round(trend_slopes([daily_revenue], days)[0]),
+        'top_products': [product(position) for position in best],
+        'rising': [trend(position) for position in rising],
+        'falling': [trend(position) for position in falling],
+        'weekday_revenue': [round(value) for value in weekday_means(daily_revenue, first_day)],
+        'hourly_revenue': {row.hour: row.revenue for row in hours},
+    }
@@ -0,0 +1,248 @@
+"""In-process scheduler for periodic background jobs.
+
+Jobs run either every ``interval`` seconds or on a five-field cron
+expression (minute, hour, day of month, month, day of week) evaluated in
+server local time. Each run can be delayed by a random jitter, is cancelled
+after ``timeout`` seconds, and is skipped while the previous run of the same
+job is still going. Blocking jobs are plain functions run in the default
+executor, so they never hold up update handling.
+
+The time of every run is stored in the ``scheduled_jobs`` table: after a
+restart interval jobs keep their cadence, and cron jobs with ``catch_up``
+run once if their last occurrence was missed while the bot was down.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+
+from database.models import db
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Longest sleep between checks, so clock adjustments are noticed
+MAX_SLEEP = 60.0
+
+# (lowest, highest) value of each cron field
+_CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_cron_field(text: str, lowest: int, highest: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+        if part == '*':
+            start, end = lowest, highest
+        elif '-' in part:
+            start, end = (int(v) for v in part.split('-', 1))
+        else:
+            start = int(part)
+            end = highest if step > 1 else start
+        if not lowest <= start <= end <= highest or step < 1:
+            raise ValueError(f"Cron field out of range: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronSchedule:
+    """Five-field cron expression, e.g. ``'0 21 * * *'`` for 21:00 daily"""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_cron_field(text, *limits) for text, limits in zip(fields, _CRON_FIELDS)
+        )
+        # Cron counts weekdays from Sunday (0 or 7), Python from Monday
+        self.weekdays = {(day - 1) % 7 for day in weekdays}
+        self._any_day = fields[2].startswith('*')
+        self._any_weekday = fields[4].startswith('*')
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day = moment.day in self.days
+        weekday = moment.weekday() in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        # Like cron: with both restricted, either one is enough
+        return day or weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        """First matching minute strictly after ``moment``"""
+        t = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = t + timedelta(days=366 * 5)
+        while t < limit:
+            if t.month not in self.months:
+                t = (t.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(t):
+                t = t.replace(hour=0, minute=0) + timedelta(days=1)
+            elif t.hour not in self.hours:
+                t = t.replace(minute=0) + timedelta(hours=1)
+            elif t.minute not in self.minutes:
+                t += timedelta(minutes=1)
+            else:
+                return t
+        raise ValueError(f"Cron expression never matches: {self.expression}")
+
+
+class Job:
+    def __init__(self, name: str, func: Callable, interval: Optional[float] = None,
+                 cron: Optional[str] = None, jitter: float = 0.0,
+                 timeout: Optional[float] = None, blocking: bool = False,
+                 catch_up: bool = False):
+        if (interval is None) == (cron is None):
+            raise ValueError(f"Job {name} needs exactly one of interval and cron")
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.cron = CronSchedule(cron) if cron else None
+        self.jitter = jitter
+        self.timeout = timeout
+        self.blocking = blocking
+        self.catch_up = catch_up
+        self.last_run: Optional[datetime] = None
+        self.next_run: Optional[datetime] = None
+        # Current run; for blocking jobs the executor future outlives a timeout
+        self.running: Optional[asyncio.Future] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self.running is not None and not self.running.done()
+
+    def schedule(self, now: datetime, restored: bool = False):
+        """Set the next run time after a run at ``now`` (or after startup)"""
+        if self.interval is not None:
+            base = self.last_run if restored and self.last_run else now
+            next_run = max(now, base + timedelta(seconds=self.interval))
+        elif restored and self.catch_up and self.last_run is not None \
+                and self.cron.next_after(self.last_run) <= now:
+            next_run = now
+        else:
+            next_run = self.cron.next_after(now)
+        self.next_run = next_run + timedelta(seconds=random.uniform(0, self.jitter))
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._runs: Set[asyncio.Task] = set()
+        # Created lazily: on Python 3.9 an Event binds to the loop current at creation
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def add_job(self, name: str, func: Callable, **options) -> Job:
+        """Register a job; see ``Job`` for the options"""
+        job = Job(name, func, **options)
+        self.jobs[name] = job
+        if self._task is not None:
+            job.schedule(datetime.now())
+            self._wakeup.set()
+        return job
+
+    def start(self):
+        """Start running jobs in the background"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop scheduling and cancel runs in progress"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._runs):
+            task.cancel()
+        if self._runs:
+            await asyncio.gather(*self._runs, return_exceptions=True)
+
+    async def _restore(self):
+        try:
+            last_runs = await db.get_job_runs()
+        except Exception as e:
+            logger.error(f"Failed to load scheduled job history: {e}")
+            last_runs = {}
+        now = datetime.now()
+        for job in self.jobs.values():
+            if job.name in last_runs:
+                job.last_run = datetime.strptime(last_runs[job.name], TIMESTAMP_FORMAT)
+            job.schedule(now, restored=True)
+
+    async def _run(self):
+        await self._restore()
+        while True:
+            now = datetime.now()
+            for job in self.jobs.values():
+                if job.next_run is not None and job.next_run <= now:
+                    self._launch(job, now)
+
+            upcoming = [job.next_run for job in self.jobs.values() if job.next_run]
+            delay = min([(t - datetime.now()).total_seconds() for t in upcoming] + [MAX_SLEEP])
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(0.0, delay))
+            except asyncio.TimeoutError:
+                pass
+
+    def _launch(self, job: Job, now: datetime):
+        job.schedule(now)
+        if job.is_running:
+            logger.warning(f"Job {job.name} is still running, skipping this run")
+            metrics.incr(f'job_{job.name}_skipped')
+            return
+        task = asyncio.create_task(self._execute(job, now))
+        job.running = task
+        self._runs.add(task)
+        task.add_done_callback(self._runs.discard)
+
+    async def _execute(self, job: Job, started_at: datetime):
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            if job.blocking:
+                work = asyncio.get_running_loop().run_in_executor(None, job.func)
+                # A thread cannot be cancelled: keep its future so the next run waits
+                job.running = work
+                await asyncio.wait_for(asyncio.shield(work), job.timeout)
+            else:
+                await asyncio.wait_for(job.func(), job.timeout)
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            logger.error(f"Job {job.name} timed out after {job.timeout}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            status = 'error'
+            logger.exception(f"Job {job.name} failed: {e}")
+        elapsed = time.perf_counter() - start
+
+        metrics.observe('job', job.name, elapsed)
+        if status != 'ok':
+            metrics.incr(f'job_{job.name}_{status}')
+        job.last_run = started_at
+        try:
+            await db.record_job_run(job.name, started_at.strftime(TIMESTAMP_FORMAT),
+                                    status, elapsed)
+        except Exception as e:
+            logger.error(f"Failed to record run of job {job.name}: {e}")
+
+    def describe(self) -> List[str]:
+        """One line per job: schedule, last and next run"""
+        lines = []
+        for job in self.jobs.values():
+            schedule = job.cron.expression if job.cron else f"every {job.interval:g}s"
+            last = job.last_run.strftime('%d.%m %H:%M') if job.last_run else '—'
+            upcoming = job.next_run.strftime('%d.%m %H:%M') if job.next_run else '—'
+            lines.append(f"{job.name} ({schedule}): {last} → {upcoming}")
+        return lines
+
+
+# Global scheduler instance
+scheduler = Scheduler()
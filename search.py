@@ -0,0 +1,79 @@
+from aiogram import Router, F
+from aiogram.types import Message
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+from database.models import db
+from keyboards.keyboards import get_products_keyboard, get_main_menu_keyboard
+from localization.texts import get_text
+
+router = Router()
+
+SEARCH_RESULTS_LIMIT = 10
+
+class SearchStates(StatesGroup):
+    waiting_for_query = State()
+
+async def send_search_results(message: Message, query: str, lang: str):
+    """Run product search and answer with results keyboard"""
+    products = await db.search_products(query, limit=SEARCH_RESULTS_LIMIT)
+
+    if not products:
+        await message.answer(
+            get_text('search_no_results', lang).format(query),
+            reply_markup=get_main_menu_keyboard(lang)
+        )
+        return
+
+    await message.answer(
+        get_text('search_results', lang).format(query),
+        reply_markup=get_products_keyboard(products, lang)
+    )
+
+@router.message(Command("search"))
+async def search_command(message: Message, command: CommandObject, state: FSMContext):
+    """Handle /search [query]"""
+    user = await db.get_user(message.from_user.id)
+    if not user:
+        return
+
+    lang = user.lang
+
+    if command.args:
+        await send_search_results(message, command.args, lang)
+        return
+
+    await message.answer(get_text('enter_search_query', lang))
+    await state.set_state(SearchStates.waiting_for_query)
+
+@router.message(F.text.in_(['🔍 Қидирув', '🔍 Поиск']))
+async def search_button(message: Message, state: FSMContext):
+    """Ask for search query"""
+    user = await db.get_user(message.from_user.id)
+    if not user:
+        return
+
+    lang = user.lang
+    await message.answer(get_text('enter_search_query', lang))
+    await state.set_state(SearchStates.waiting_for_query)
+
+@router.message(SearchStates.waiting_for_query, F.text)
+async def search_query_received(message: Message, state: FSMContext):
+    """Handle search query typed after the search button"""
+    await state.clear()
+
+    user = await db.get_user(message.from_user.id)
+    if not user:
+        return
+
+    await send_search_results(message, message.text, user.lang)
+
+@router.message(StateFilter(None), F.text, ~F.text.startswith('/'))
+async def search_free_text(message: Message):
+    """Treat any other typed text as a product search (router is included last)"""
+    user = await db.get_user(message.from_user.id)
+    if not user:
+        return
+
+    await send_search_results(message, message.text, user.lang)
@@ -7,7 +7,7 @@ from aiogram.fsm.state import State, StatesGroup
 from database.models import db
 from keyboards.keyboards import (
     get_language_keyboard, get_contact_keyboard, 
-    get_main_menu_keyboard, get_back_keyboard
+    get_main_menu_keyboard, get_back_keyboard, get_product_detail_keyboard
 )
 from localization.texts import get_text
 import re
@@ -27,9 +27,16 @@ async def start_command(message: Message, state: FSMContext):
     
     # Extract referral code from start parameter
     referral_code = None
+    product_id = None
     if message.text and len(message.text.split()) > 1:
         referral_code = message.text.split()[1]
     
+    # Product links shared from inline mode look like /start product_<id>
+    if referral_code and referral_code.startswith('product_'):
+        product_ref = referral_code[len('product_'):]
+        product_id = int(product_ref) if product_ref.isdigit() else None
+        referral_code = None
+    
     if not user:
         # New user - show language selection
         await state.update_data(referral_code=referral_code)
@@ -40,11 +47,22 @@ async def start_command(message: Message, state: FSMContext):
         await state.set_state(RegistrationStates.waiting_for_language)
     else:
         # Existing user - show main menu
-        lang = user.get('language_code', 'uz')
+        lang = user.lang
         await message.answer(
             get_text('main_menu', lang),
             reply_markup=get_main_menu_keyboard(lang)
         )
+        
+        product = await db.get_product(product_id) if product_id else None
+        if product:
+            await message.answer(
+                get_text('product_details', lang).format(
+                    product.name(lang), f"{product.price:,}",
+                    product.description(lang) or "—"
+                ),
+                reply_markup=get_product_detail_keyboard(product_id, lang),
+                parse_mode='Markdown'
+            )
 
 @router.callback_query(F.data.startswith("lang_"))
 async def language_selected(callback: CallbackQuery, state: FSMContext):
@@ -125,12 +143,7 @@ async def update_language(callback: CallbackQuery):
     lang = callback.data.split("_")[1]
     
     # Update user language in database
-    async with db.get_connection() as conn:
-        await conn.execute(
-            'UPDATE users SET language_code = ? WHERE telegram_id = ?',
-            (lang, callback.from_user.id)
-        )
-        await conn.commit()
+    await db.set_language(callback.from_user.id, lang)
     
     await callback.message.edit_text(
         get_text('main_menu', lang),
@@ -26,22 +26,51 @@ TEXTS = {
         'product_details': "📦 **{}**\n\n💰 Нарх: {} сўм\n\n📝 Тафсилот: {}",
         'add_to_cart': "🛒 Саватчага қўшиш",
         'quantity': "Сони: {}",
+        'enter_search_query': "🔍 Маҳсулот номини киритинг:",
+        'search_results': "🔍 «{}» бўйича натижалар:",
+        'search_no_results': "😔 «{}» бўйича ҳеч нарса топилмади",
+        'inline_price': "💰 {} сўм",
+        'inline_open_in_bot': "🛒 Ботда буюртма бериш",
         
         # Cart
         'cart_empty': "🛒 Саватчангиз бўш",
         'cart_total': "💰 Жами: {} сўм",
         'checkout': "✅ Буюртма бериш",
         'clear_cart': "🗑 Саватчани тозалаш",
+        'cart_discount': "🎟 Чегирма: -{} сўм\n",
+        'cart_bonus': "🎁 Бонусдан: -{} сўм\n",
+        'btn_promo_code': "🎟 Промокод",
+        'btn_use_bonus': "🎁 Бонусдан тўлаш ({} сўм)",
+        'btn_skip_bonus': "✖️ Бонуссиз",
+        'enter_promo_code': "🎟 Промокодни киритинг:",
+        'promo_applied': "✅ Промокод қўлланилди",
+        'promo_invalid': "❌ Бундай промокод йўқ ёки унинг муддати тугаган",
+        'promo_used': "❌ Сиз бу промокоддан аллақачон фойдалангансиз",
+        'promo_not_applicable': "⚠️ Промокод саватчангиздаги маҳсулотларга тегишли эмас",
+        'redemption_failed': "😔 Чегирма ёки бонус энди мавжуд эмас. Янги суммани текшириб, буюртмани қайта расмийлаштиринг.",
         
         # Orders
         'no_orders': "📋 Сизда ҳали буюртмалар йўқ",
         'order_created': "✅ Буюртма #{} муваффақиятли яратилди!",
+        'order_already_created': "Буюртма #{} аллақачон қабул қилинган",
+        'cart_reminder': "🛒 Саватчангизда {} та маҳсулот сизни кутмоқда ({} сўм). Буюртмани расмийлаштириш учун «🛒 Саватча» тугмасини босинг.",
+        'out_of_stock': "😔 Кечирасиз, омборда етарли эмас: {}. Саватчани ўзгартириб, қайта уриниб кўринг.",
+        'cart_repriced': "💱 Саватчадаги нархлар ўзгарди. Янги суммани текшириб, буюртмани қайта расмийлаштиринг.",
+        'order_eta': "⏱ Тахминий етказиш вақти: {} (~{} дақиқа)",
         'choose_payment': "💳 Тўлов усулини танланг:",
         'payment_cash': "💵 Нақд",
         'payment_payme': "💳 Payme",
         'payment_click': "💳 Click",
         'payment_uzcard': "💳 UzCard",
+        'payment_link': "💳 Буюртмани онлайн тўлаш учун тугмани босинг:",
+        'payment_unavailable': "⚠️ Онлайн тўлов ҳозир ишламаяпти. Буюртмани етказиб берилганда тўлашингиз мумкин.",
+        'payment_received': "✅ Буюртма #{} учун тўлов қабул қилинди. Раҳмат!",
+        'btn_pay': "💳 Тўлаш",
         'my_orders_list': "📋 **Менинг буюртмаларим:**",
+        'btn_repeat_order': "🔁 #{} ни такрорлаш",
+        'order_repeated': "🔁 {} та маҳсулот саватчага қўшилди",
+        'order_repeated_partly': "🔁 {} та маҳсулот саватчага қўшилди, {} таси ҳозир мавжуд эмас",
+        'repeat_order_unavailable': "😔 Бу буюртмадаги маҳсулотлар ҳозир мавжуд эмас",
         
         # Location
         'send_location': "📍 Локацияни юбориш",
@@ -57,12 +86,31 @@ TEXTS = {
         'address_updated': "✅ Манзил янгиланди!",
         'not_set': "Белгиланмаган",
         
+        # Favourites
+        'favourites': "⭐ Севимлилар",
+        'favourites_list': "⭐ **Севимли маҳсулотларингиз:**",
+        'no_favourites': "⭐ Севимлилар рўйхати бўш. Маҳсулот саҳифасида ⭐ тугмасини босинг.",
+        'btn_favourite_add': "⭐ Севимлиларга",
+        'btn_favourite_remove': "✖️ Севимлилардан олиб ташлаш",
+        'favourite_added': "⭐ Севимлиларга қўшилди",
+        'favourite_removed': "Севимлилардан олиб ташланди",
+        'btn_favourites_to_cart': "🛒 Ҳаммасини саватчага",
+        
         # Referral
         'referral_info': "🎁 **Дўстларни таклиф қилинг ва бонус олинг!**\n\nСизнинг реферал кодингиз: `{}`\n\nБу кодни дўстларингизга юборинг. Улар ботга кирганда кодни киритсалар, сиз бонус оласиз!\n\n👥 Таклиф қилганлар: {}\n💰 Бонус баланси: {} сўм",
         'enter_referral_code': "🎁 Агар сизни кимдир таклиф қилган бўлса, реферал кодни киритинг:",
         'referral_code_applied': "✅ Реферал код қўлланилди! Сизни таклиф қилган одам бонус олади.",
         'invalid_referral_code': "❌ Нотўғри реферал код",
         
+        # Courier
+        'courier_shift_on': "✅ Смена бошланди!\n\n📍 Буюртмалар олиш учун жонли локациянгизни (Live Location) улашинг.",
+        'courier_shift_off': "⏸ Смена тугади. Янги буюртмалар юборилмайди.",
+        'courier_not_registered': "❌ Сиз курьер сифатида рўйхатдан ўтмагансиз",
+        'courier_new_order': "🚚 **Янги буюртма #{}** (манзил {}/{})\n\n📍 Манзил: {}\n📱 Телефон: {}\n💰 Сумма: {} сўм\n📏 Масофа: {} км\n⏱ Етиб бориш: ~{} дақиқа",
+        'courier_open_map': "🗺 Харитада очиш",
+        'courier_delivered_btn': "✅ Етказилди",
+        'courier_order_delivered': "✅ Буюртма #{} етказилди. Раҳмат!",
+        
         # Buttons
         'btn_categories': "📂 Категориялар",
         'btn_cart': "🛒 Саватча",
@@ -70,6 +118,7 @@ TEXTS = {
         'btn_profile': "👤 Профил",
         'btn_referral': "🎁 Реферал",
         'btn_language': "🌐 Тил",
+        'btn_search': "🔍 Қидирув",
         'btn_back': "⬅️ Орқага",
         'btn_main_menu': "🏠 Асосий меню",
     },
@@ -97,22 +146,51 @@ TEXTS = {
         'product_details': "📦 **{}**\n\n💰 Цена: {} сум\n\n📝 Описание: {}",
         'add_to_cart': "🛒 Добавить в корзину",
         'quantity': "Количество: {}",
+        'enter_search_query': "🔍 Введите название товара:",
+        'search_results': "🔍 Результаты по запросу «{}»:",
+        'search_no_results': "😔 По запросу «{}» ничего не найдено",
+        'inline_price': "💰 {} сум",
+        'inline_open_in_bot': "🛒 Заказать в боте",
         
         # Cart
         'cart_empty': "🛒 Ваша корзина пуста",
         'cart_total': "💰 Итого: {} сум",
         'checkout': "✅ Оформить заказ",
         'clear_cart': "🗑 Очистить корзину",
+        'cart_discount': "🎟 Скидка: -{} сум\n",
+        'cart_bonus': "🎁 Бонусами: -{} сум\n",
+        'btn_promo_code': "🎟 Промокод",
+        'btn_use_bonus': "🎁 Оплатить бонусами ({} сум)",
+        'btn_skip_bonus': "✖️ Без бонусов",
+        'enter_promo_code': "🎟 Введите промокод:",
+        'promo_applied': "✅ Промокод применён",
+        'promo_invalid': "❌ Такого промокода нет или срок его действия истёк",
+        'promo_used': "❌ Вы уже использовали этот промокод",
+        'promo_not_applicable': "⚠️ Промокод не действует на товары в вашей корзине",
+        'redemption_failed': "😔 Скидка или бонусы больше недоступны. Проверьте новую сумму и оформите заказ снова.",
         
         # Orders
         'no_orders': "📋 У вас пока нет заказов",
         'order_created': "✅ Заказ #{} успешно создан!",
+        'order_already_created': "Заказ #{} уже принят",
+        'cart_reminder': "🛒 В вашей корзине ждут товары: {} шт. на {} сум. Чтобы оформить заказ, нажмите «🛒 Корзина».",
+        'out_of_stock': "😔 Извините, на складе недостаточно: {}. Измените корзину и попробуйте снова.",
+        'cart_repriced': "💱 Цены в корзине изменились. Проверьте новую сумму и оформите заказ снова.",
+        'order_eta': "⏱ Ожидаемое время доставки: {} (~{} мин)",
         'choose_payment': "💳 Выберите способ оплаты:",
         'payment_cash': "💵 Наличные",
         'payment_payme': "💳 Payme",
         'payment_click': "💳 Click",
         'payment_uzcard': "💳 UzCard",
+        'payment_link': "💳 Нажмите кнопку, чтобы оплатить заказ онлайн:",
+        'payment_unavailable': "⚠️ Онлайн-оплата сейчас недоступна. Заказ можно оплатить при получении.",
+        'payment_received': "✅ Оплата заказа #{} получена. Спасибо!",
+        'btn_pay': "💳 Оплатить",
         'my_orders_list': "📋 **Мои заказы:**",
+        'btn_repeat_order': "🔁 Повторить #{}",
+        'order_repeated': "🔁 В корзину добавлено товаров: {}",
+        'order_repeated_partly': "🔁 В корзину добавлено товаров: {}, сейчас недоступно: {}",
+        'repeat_order_unavailable': "😔 Товаров из этого заказа сейчас нет в наличии",
         
         # Location
         'send_location': "📍 Отправить локацию",
@@ -128,12 +206,31 @@ TEXTS = {
         'address_updated': "✅ Адрес обновлен!",
         'not_set': "Не указано",
         
+        # Favourites
+        'favourites': "⭐ Избранное",
+        'favourites_list': "⭐ **Ваши избранные товары:**",
+        'no_favourites': "⭐ В избранном пока пусто. Нажмите ⭐ на странице товара.",
+        'btn_favourite_add': "⭐ В избранное",
+        'btn_favourite_remove': "✖️ Убрать из избранного",
+        'favourite_added': "⭐ Добавлено в избранное",
+        'favourite_removed': "Убрано из избранного",
+        'btn_favourites_to_cart': "🛒 Всё в корзину",
+        
         # Referral
         'referral_info': "🎁 **Приглашайте друзей и получайте бонусы!**\n\nВаш реферальный код: `{}`\n\nОтправьте этот код друзьям. Когда они войдут в бот и введут код, вы получите бонус!\n\n👥 Приглашено: {}\n💰 Бонусный баланс: {} сум",
         'enter_referral_code': "🎁 Если вас кто-то пригласил, введите реферальный код:",
         'referral_code_applied': "✅ Реферальный код применен! Пригласивший вас человек получит бонус.",
         'invalid_referral_code': "❌ Неверный реферальный код",
         
+        # Courier
+        'courier_shift_on': "✅ Смена начата!\n\n📍 Поделитесь трансляцией геопозиции (Live Location), чтобы получать заказы.",
+        'courier_shift_off': "⏸ Смена завершена. Новые заказы не будут приходить.",
+        'courier_not_registered': "❌ Вы не зарегистрированы как курьер",
+        'courier_new_order': "🚚 **Новый заказ #{}** (точка {}/{})\n\n📍 Адрес: {}\n📱 Телефон: {}\n💰 Сумма: {} сум\n📏 Расстояние: {} км\n⏱ Прибытие: ~{} мин",
+        'courier_open_map': "🗺 Открыть на карте",
+        'courier_delivered_btn': "✅ Доставлен",
+        'courier_order_delivered': "✅ Заказ #{} доставлен. Спасибо!",
+        
         # Buttons
         'btn_categories': "📂 Категории",
         'btn_cart': "🛒 Корзина",
@@ -141,6 +238,7 @@ TEXTS = {
         'btn_profile': "👤 Профиль",
         'btn_referral': "🎁 Реферал",
         'btn_language': "🌐 Язык",
+        'btn_search': "🔍 Поиск",
         'btn_back': "⬅️ Назад",
         'btn_main_menu': "🏠 Главное меню",
     }
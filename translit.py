@@ -0,0 +1,42 @@
+"""Search-key normalization for Uzbek/Russian text in Cyrillic and Latin script.
+
+Both indexed product text and user queries go through ``normalize`` so that
+"плов", "plov" and "PLOV" meet on the same key, as do "шашлык"/"shashlik" and
+"ўзбек"/"o'zbek". The result is a folded search key, not display text.
+"""
+import re
+from typing import List
+
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    # Uzbek-specific letters
+    'ў': 'o', 'қ': 'k', 'ғ': 'g', 'ҳ': 'h',
+}
+
+# Latin spellings folded onto the same key as their Cyrillic counterparts
+LATIN_FOLDS = {
+    'x': 'h', 'q': 'k', 'w': 'v',
+}
+
+_TABLE = str.maketrans({**CYRILLIC_TO_LATIN, **LATIN_FOLDS})
+# Apostrophes in o'/g' and their typographic variants are dropped
+APOSTROPHES = "’'`ʻʼ‘"
+_APOSTROPHES = re.compile(f"[{APOSTROPHES}]")
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text: str) -> str:
+    """Fold text to a lowercase Latin search key"""
+    if not text:
+        return ''
+    text = _APOSTROPHES.sub('', text.lower()).translate(_TABLE)
+    return _NON_WORD.sub(' ', text).strip()
+
+
+def tokenize(text: str, limit: int = 6) -> List[str]:
+    """Normalized query tokens, at most ``limit`` of them"""
+    return normalize(text).split()[:limit]
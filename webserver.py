@@ -0,0 +1,57 @@
+"""Optional HTTP server for service endpoints (Prometheus metrics)."""
+import logging
+from typing import Optional
+
+from aiohttp import web
+
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Extra routes registered by other modules before the server starts
+_routes = []
+
+
+def add_route(method: str, path: str, handler):
+    """Register an HTTP route on the service web server"""
+    _routes.append(web.route(method, path, handler))
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Prometheus text exposition endpoint"""
+    return web.Response(
+        text=metrics.render_prometheus(),
+        content_type='text/plain',
+        charset='utf-8'
+    )
+
+
+def create_app() -> web.Application:
+    """Build aiohttp application with all registered routes"""
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    app.add_routes(_routes)
+    return app
+
+
+class WebServer:
+    def __init__(self):
+        self.runner: Optional[web.AppRunner] = None
+
+    async def start(self, port: int, host: str = '0.0.0.0'):
+        """Start serving in the current event loop"""
+        self.runner = web.AppRunner(create_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        logger.info("Web server listening on %s:%s", host, port)
+
+    async def stop(self):
+        """Stop serving"""
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+# Global web server instance
+web_server = WebServer()
@@ -0,0 +1,127 @@
+"""Write-behind queue for writes that need not be durable before the reply.
+
+Profile and language changes and stored recommendations are queued here
+instead of each opening a connection and committing on the handler's path.
+One writer task takes them from the queue and commits them in batches: a
+batch closes ``delay`` seconds after its first write or once it holds
+``max_batch`` writes, so under load many handlers share one transaction (and
+one fsync). With ``delay`` 0 every write is committed before ``submit``
+returns.
+
+Queued changes to a user's row are kept in an overlay until they are
+committed, and ``Database.get_user`` applies them, so users read their own
+writes at once. ``flush`` waits for everything queued so far;
+``Database.close`` flushes before closing connections, so writes queued
+before shutdown are kept.
+"""
+import asyncio
+import logging
+import time
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from database.queries import Query
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# A queued statement and its parameters
+Write = Tuple[Query, Sequence]
+
+
+class WriteBehind:
+    def __init__(self, connect: Callable, delay: float = 0.005, max_batch: int = 256):
+        self.connect = connect
+        self.delay = delay
+        self.max_batch = max_batch
+        self._pending: List[Write] = []
+        # Writes submitted and committed (or dropped) so far; overlay entries
+        # carry the number of the last write that changed them
+        self._submitted = 0
+        self._done = 0
+        self._overlay: Dict[int, Tuple[int, Dict[str, Any]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        # Created with the task: on Python 3.9 an Event binds to the current loop
+        self._full: Optional[asyncio.Event] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.delay > 0
+
+    async def submit(self, query: Query, parameters: Sequence, user_id: Optional[int] = None,
+                     fields: Optional[Dict[str, Any]] = None):
+        """Queue a write; ``fields`` are the columns it sets on the user's row,
+        seen by ``apply`` until the write is committed"""
+        if not self.enabled:
+            await self._commit([(query, parameters)])
+            return
+
+        self._pending.append((query, parameters))
+        self._submitted += 1
+        if user_id is not None and fields:
+            _, changed = self._overlay.get(user_id, (0, {}))
+            self._overlay[user_id] = (self._submitted, {**changed, **fields})
+        metrics.set_gauge('write_behind_pending', len(self._pending))
+
+        if self._task is None:
+            self._full = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        elif len(self._pending) >= self.max_batch:
+            self._full.set()
+
+    def apply(self, user_id: int, row):
+        """``row`` of a user with their queued changes applied"""
+        entry = self._overlay.get(user_id)
+        if row is None or entry is None:
+            return row
+        return row._replace(**entry[1])
+
+    async def flush(self):
+        """Wait until every write queued so far is committed"""
+        while self._task is not None:
+            # A cancelled caller must not cancel the writer
+            await asyncio.shield(self._task)
+
+    async def _run(self):
+        try:
+            while self._pending:
+                if len(self._pending) < self.max_batch:
+                    try:
+                        await asyncio.wait_for(self._full.wait(), self.delay)
+                    except asyncio.TimeoutError:
+                        pass
+                self._full.clear()
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                metrics.set_gauge('write_behind_pending', len(self._pending))
+
+                await self._commit(batch)
+                self._done += len(batch)
+                self._overlay = {
+                    user_id: entry for user_id, entry in self._overlay.items()
+                    if entry[0] > self._done
+                }
+        finally:
+            self._task = None
+
+    async def _commit(self, batch: List[Write]):
+        """Commit a batch in one transaction; if it fails, each write on its own
+        so one bad write does not lose the others"""
+        start = time.perf_counter()
+        try:
+            async with self.connect() as db:
+                # Consecutive writes of the same statement go in one executemany
+                for query, writes in groupby(batch, key=itemgetter(0)):
+                    await db.execute_query_many(query, [parameters for _, parameters in writes])
+                await db.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"Dropped queued write {batch[0][0].name}: {e}")
+                return
+            logger.warning(f"Batch of {len(batch)} queued writes failed, retrying one by one: {e}")
+            for write in batch:
+                await self._commit([write])
+            return
+        metrics.observe('write_behind', 'commit', time.perf_counter() - start)
+        metrics.observe_value('write_behind_batch', 'writes', len(batch))